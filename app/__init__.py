@@ -5,30 +5,54 @@ import sys
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
+from logging import getLogger
 from flask import Flask, jsonify, request, redirect
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_talisman import Talisman
-from authlib.integrations.flask_client import OAuth
 
 from config import get_config
-from .data.cosmos_db_client import CosmosDBClient
-from .auth import auth_bp, init_auth
+from .clients.lazy import LazyClient
+from .data.retry import start_deadline, clear_deadline
+from .rbac.engine import init_rbac
+from .ratelimit import limiter, init_limiter
+from .metrics import init_metrics
+from .encoding import init_encoding
+from .auth import init_auth
 from .api import init_api
-from .api.routes import init_routes
-from .auth.oauth import configure_oauth
+from .health import init_health, PROBE_ENDPOINTS
 from .logging.setup import configure_logging
 from .error_handlers import register_error_handlers
 from .utils.helpers import ensure_https
 
-limiter = Limiter(key_func=get_remote_address)
-cosmos_client = None
+# Not logging.getLogger: importing the app.logging package rebinds that name here
+logger = getLogger(__name__)
+
+def _cosmos_factory(app):
+    def build():
+        # Imported here so building the app does not load the Cosmos DB and Key Vault SDKs
+        from .data.cosmos_db_client import CosmosDBClient
+        return CosmosDBClient(app)
+    return build
+
+
+def warm_up(app):
+    """Build the Cosmos DB client and Encryptor and load the roles now instead of on the first request.
+
+    Call it from the process that serves (or, with preload_app, forks) the workers. Failures
+    are logged and left to the first request and /readyz to retry.
+    """
+    try:
+        app.extensions['cosmos'].get()
+        app.extensions['rbac'].refresh()
+        return True
+    except Exception as e:
+        logger.error("Warm-up failed: %s", e)
+        return False
+
 
 def create_app(test_config=None):
     load_dotenv()
-    print("Environment variables loaded")
     app = Flask(__name__)
 
     if not app.debug and os.environ.get('FLASK_ENV') != 'development':
@@ -40,39 +64,31 @@ def create_app(test_config=None):
 
     
     if test_config is None:
-        print("Loading configuration")
         config_class = get_config()
-        print(f"Config class: {config_class.__name__}")
         app.config.from_object(config_class)
-        print("Configuration loaded, attempting to load secrets")
+        # Start logging before the Key Vault round trips so their failures are captured
+        configure_logging(app)
+        logger.info("Loading secrets", extra={'config_class': config_class.__name__})
         try:
             config_class.load_secrets()
-            print("Secrets loaded successfully")
             for key in dir(config_class):
                 if key.isupper():
                     app.config[key] = getattr(config_class, key)
         except Exception as e:
-            print(f"Error loading secrets: {str(e)}")
+            logger.error("Error loading secrets: %s", e)
     else:
         app.config.update(test_config)
+        configure_logging(app)
 
-    configure_logging(app)
+    # Key Vault and Cosmos DB are first contacted on first use (or by warm_up), not here
+    cosmos_client = LazyClient(_cosmos_factory(app), 'Cosmos DB client')
+    app.extensions['cosmos'] = cosmos_client
+    init_rbac(app, cosmos_client)
+    auth = init_auth(app)
 
-    cosmos_client = CosmosDBClient(app)
-    if not hasattr(app, 'auth_initialized'):
-        auth = init_auth(app)
-        app.auth_initialized = True
-    print("After auth initialization")
-
-    limiter = Limiter(
-        get_remote_address,
-        app=app,
-        default_limits=[f"{app.config['RATE_LIMIT']} per day", f"{app.config['RATE_LIMIT_PERIOD']} per hour"],
-        storage_uri="memory://"
-    )
-
-    oauth = OAuth(app)
-    configure_oauth(app, oauth)
+    init_limiter(app)
+    init_metrics(app, limiter)
+    init_encoding(app)
 
     # Content Security Policy
     csp = {
@@ -85,14 +101,15 @@ def create_app(test_config=None):
 
     # Initialize Talisman with CSP
     
-    Talisman(app, force_https=not app.debug, frame_options='DENY', x_xss_protection=False, 
+    talisman = Talisman(app, force_https=not app.debug, frame_options='DENY', x_xss_protection=False, 
              strict_transport_security=True, session_cookie_secure=not app.debug, 
              content_security_policy=csp, referrer_policy='strict-origin-when-cross-origin'
             )
 
-    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(auth.blueprint, url_prefix='/auth')
     api_blueprint = init_api(cosmos_client, auth, limiter)  # Initialize API routes
     app.register_blueprint(api_blueprint, url_prefix='/api')
+    init_health(app, cosmos_client, talisman, limiter)
 
     register_error_handlers(app)
     
@@ -102,8 +119,18 @@ def create_app(test_config=None):
     def favicon():
         return '', 204
     
+    @app.before_request
+    def start_retry_budget():
+        start_deadline(app.config.get('REQUEST_RETRY_BUDGET_SECONDS', 10))
+
+    @app.teardown_request
+    def end_retry_budget(error=None):
+        clear_deadline()
+
     @app.before_request
     def force_https_redirects():
+        if request.endpoint in PROBE_ENDPOINTS:
+            return None
         if request.url.startswith('http://') and not app.debug:
             return redirect(ensure_https(request.url), code=301)
 
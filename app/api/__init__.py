@@ -1,9 +1,7 @@
 from flask import Blueprint
 
-api_bp = Blueprint('api', __name__)
-
 def init_api(cosmos_client, auth, limiter):
     from . import routes
-    routes.init_routes(api_bp, cosmos_client, auth, limiter)
-
-    return api_bp
\ No newline at end of file
+    # A new blueprint per app: the views close over this app's clients
+    api_bp = Blueprint('api', __name__)
+    return routes.init_routes(api_bp, cosmos_client, auth, limiter)
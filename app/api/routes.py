@@ -1,28 +1,107 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, json, current_app, Response, stream_with_context
 import uuid
-from functools import wraps
-import tenacity
-from . import api_bp
-from azure.cosmos.exceptions import CosmosHttpResponseError
+import logging
+import itertools
+import re
+from azure.cosmos.exceptions import (CosmosHttpResponseError, CosmosAccessConditionFailedError,
+                                     CosmosResourceNotFoundError)
 from azure.core.exceptions import AzureError
 from ..rbac.utils import rbac_required
+from ..rbac.engine import rbac_engine
 from ..models.role import Role
 from ..models.user import User
+from ..data.key_rotation import RotationInProgressError
+from ..data.change_feed import decode_cursor
+from ..data.etags import NOT_MODIFIED, parse_if_match, parse_if_none_match
+from ..data.fields import parse_fields
+from ..encoding import json_response, response_encoder
+from ..utils.helpers import encode_continuation, decode_continuation
+
+logger = logging.getLogger(__name__)
+
+CONSUMER_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
 
 def init_routes(bp, cosmos_client, auth, limiter):
-    print("API routes file is being imported")
     def rate_limit_decorator():
         return limiter.limit("100/minute")
 
-    def exponential_backoff(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            return tenacity.retry(
-                wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-                stop=tenacity.stop_after_attempt(5),
-                retry=tenacity.retry_if_exception_type(Exception)
-            )(func)(*args, **kwargs)
-        return wrapper
+    def page_size_arg():
+        limit = request.args.get('limit', current_app.config.get('DEFAULT_PAGE_SIZE', 100))
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError("limit must be an integer")
+        if limit < 1 or limit > current_app.config.get('MAX_PAGE_SIZE', 1000):
+            raise ValueError(f"limit must be between 1 and {current_app.config.get('MAX_PAGE_SIZE', 1000)}")
+        return limit
+
+    def tagged(response, etag, status=200):
+        if etag:
+            response.headers['ETag'] = etag
+        return response, status
+
+    def tagged_json(value, etag):
+        # The same version of the same query encodes to the same bytes, so keep them for the next request.
+        # Reads with a field that failed to decrypt come without an etag and are never kept
+        return tagged(json_response(value, key=(etag, request.full_path) if etag else None), etag)
+
+    def not_modified(etag):
+        # Nothing was decrypted or serialized; the client's copy is current
+        return tagged(current_app.response_class(), etag, 304)
+
+    def stream_users(stream_format, page_size, continuation=None, fields=None):
+        pages = cosmos_client.iter_item_pages(page_size, continuation, fields=fields)
+        # Pull the first page before answering so query errors still surface as a 500
+        pages = itertools.chain([next(pages, [])], pages)
+        encoder = response_encoder()
+        if stream_format == 'ndjson':
+            def generate():
+                for page in pages:
+                    if page:
+                        yield encoder.ndjson(page)
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        def generate():
+            yield b'['
+            separator = b''
+            for page in pages:
+                if page:
+                    yield separator + encoder.array_items(page)
+                    separator = b','
+            yield b']'
+        return Response(stream_with_context(generate()), mimetype='application/json')
+    
+    def read_batch_items():
+        """Return the items of a batch request: a JSON array, or one JSON document per line for NDJSON."""
+        max_items = current_app.config.get('MAX_BATCH_ITEMS', 10000)
+        if request.mimetype == 'application/x-ndjson':
+            items = []
+            for line in request.stream:
+                if line.strip():
+                    items.append(json.loads(line))
+                    if len(items) > max_items:
+                        break
+        else:
+            items = request.get_json(silent=True)
+            if not isinstance(items, list):
+                raise ValueError("Body must be a JSON array or NDJSON")
+        if len(items) > max_items:
+            raise ValueError(f"A batch can hold at most {max_items} items")
+        return items
+
+    def batch_write(operation):
+        try:
+            items = read_batch_items()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            results = cosmos_client.bulk_write(operation, items)
+        except AzureError as e:
+            logger.error("Azure error in batch %s: %s", operation, e)
+            return jsonify({"error": "Azure service error", "details": str(e)}), 500
+        failed = sum(1 for result in results if result['status'] >= 400)
+        body = {"results": results, "succeeded": len(results) - failed, "failed": failed}
+        return jsonify(body), 207 if failed else 200
     
     @bp.route('/')
     @limiter.limit("100/minute")
@@ -35,29 +114,82 @@ def init_routes(bp, cosmos_client, auth, limiter):
     @limiter.limit("100/minute")
     def get_users():
             try:
-                users = cosmos_client.get_all_items()
-                return jsonify(users), 200
+                try:
+                    fields = parse_fields(request.args.get('fields'))
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+                if_none_match = parse_if_none_match(request.headers.get('If-None-Match'))
+                stream_format = request.args.get('stream')
+                if stream_format is None and request.accept_mimetypes.best == 'application/x-ndjson':
+                    stream_format = 'ndjson'
+                if stream_format is not None or 'limit' in request.args or 'continuation' in request.args:
+                    try:
+                        page_size = page_size_arg()
+                        continuation = decode_continuation(request.args.get('continuation'))
+                    except ValueError as e:
+                        return jsonify({"error": str(e)}), 400
+                    if stream_format is not None:
+                        if stream_format not in ('ndjson', 'json'):
+                            return jsonify({"error": "stream must be 'ndjson' or 'json'"}), 400
+                        return stream_users(stream_format, page_size, continuation, fields)
+                    page = cosmos_client.get_items_page_versioned(page_size, continuation, fields=fields,
+                                                                  if_none_match=if_none_match)
+                    if page.value is NOT_MODIFIED:
+                        return not_modified(page.etag)
+                    users, next_continuation = page.value
+                    return tagged_json({"items": users, "continuation": encode_continuation(next_continuation)},
+                                       page.etag)
+                users = cosmos_client.get_all_items_versioned(fields=fields, if_none_match=if_none_match)
+                if users.value is NOT_MODIFIED:
+                    return not_modified(users.etag)
+                return tagged_json(users.value, users.etag)
             except CosmosHttpResponseError as e:
-                print(f"Cosmos DB HTTP Error: {str(e)}")
-                print(f"Status code: {e.status_code}")
-                print(f"Substatus: {e.sub_status}")
-                print(f"Error code: {e.error_code}")
+                logger.error("Cosmos DB HTTP error in get_users: %s", e.message,
+                             extra={'status_code': e.status_code, 'sub_status': e.sub_status, 'error_code': e.error_code})
                 return jsonify({"error": "Database error", "details": str(e)}), 500
             except AzureError as e:
-                print(f"Azure Error: {str(e)}")
+                logger.error("Azure error in get_users: %s", e)
                 return jsonify({"error": "Azure service error", "details": str(e)}), 500
             except Exception as e:
-                print(f"Unexpected error in get_users: {str(e)}")
-                print(f"Error type: {type(e).__name__}")
+                logger.exception("Unexpected error in get_users")
                 return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
+    @bp.route('/users/changes', methods=['GET'])
+    @auth.require_auth('any')
+    @rbac_required(['read_user'])
+    @limiter.limit("100/minute")
+    def get_user_changes():
+        """Users created or changed since the cursor in ?since=, from the Cosmos DB change feed.
+
+        With ?consumer=<name> the server keeps the cursor: a request acknowledges the since
+        it sends, and one without since resumes from the last acknowledged cursor.
+        """
+        consumer = request.args.get('consumer')
+        since = request.args.get('since')
+        try:
+            if consumer is not None and not CONSUMER_NAME.match(consumer):
+                raise ValueError("consumer must be 1-64 letters, digits, '_', '.' or '-'")
+            fields = parse_fields(request.args.get('fields'))
+            limit = page_size_arg()
+            decode_cursor(since)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if consumer is not None and since is None:
+            since = cosmos_client.load_change_feed_cursor(consumer)
+        users, cursor, more = cosmos_client.read_changes(since, limit, fields=fields)
+        if consumer is not None and request.args.get('since') is not None:
+            cosmos_client.save_change_feed_cursor(consumer, since)
+        return jsonify({"items": users, "cursor": cursor, "more": more}), 200
+
     @bp.route('/users', methods=['POST'])
     @auth.require_auth('any')
     @rate_limit_decorator()
     @rbac_required(['create_user'])
-    @exponential_backoff
     def create_user():
-        new_user = request.json
+        try:
+            new_user = User.schema.validate(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         if 'id' not in new_user:
             new_user['id'] = str(uuid.uuid4())
         created_user = cosmos_client.create_item(new_user)
@@ -66,41 +198,129 @@ def init_routes(bp, cosmos_client, auth, limiter):
     @bp.route('/users/<string:id>', methods=['GET'])
     @auth.require_auth('any')
     @rate_limit_decorator()
-    @exponential_backoff
     def get_user(id):
-        user = cosmos_client.get_item(id)
-        if user:
-            return jsonify(user), 200
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        user = cosmos_client.get_item_versioned(id, fields=fields,
+                                                if_none_match=parse_if_none_match(request.headers.get('If-None-Match')))
+        if user.value is NOT_MODIFIED:
+            return not_modified(user.etag)
+        if user.value:
+            return tagged_json(user.value, user.etag)
         return jsonify({"error": "User not found"}), 404
 
     @bp.route('/users/<string:id>', methods=['PUT'])
     @auth.require_auth('any')
     @rate_limit_decorator()
-    @exponential_backoff
     def update_user(id):
-        update_data = request.json
+        try:
+            if_match = parse_if_match(request.headers.get('If-Match'))
+            update_data = User.schema.validate(request.get_json(silent=True))
+            if update_data.get('id', id) != id:
+                raise ValueError("id in the body does not match the URL")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         update_data['id'] = id
-        updated_user = cosmos_client.update_item(update_data)
-        return jsonify(updated_user), 200
+        try:
+            updated_user = cosmos_client.update_item(update_data, if_match=if_match)
+        except CosmosAccessConditionFailedError:
+            return jsonify({"error": "User was changed since it was read; read it again"}), 412
+        except CosmosResourceNotFoundError:
+            return jsonify({"error": "User not found"}), 404
+        return tagged(jsonify(updated_user), updated_user.get('_etag'))
 
     @bp.route('/users/<string:id>', methods=['DELETE'])
     @auth.require_auth('any')
     @rate_limit_decorator()
-    @exponential_backoff
     def delete_user(id):
-        cosmos_client.delete_item(id)
+        try:
+            cosmos_client.delete_item(id, if_match=parse_if_match(request.headers.get('If-Match')))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except CosmosAccessConditionFailedError:
+            return jsonify({"error": "User was changed since it was read; read it again"}), 412
+        except CosmosResourceNotFoundError:
+            return jsonify({"error": "User not found"}), 404
         return '', 204
     
+    @bp.route('/users:batch', methods=['POST'])
+    @auth.require_auth('any')
+    @rate_limit_decorator()
+    @rbac_required(['create_user'])
+    def create_users_batch():
+        return batch_write('create')
+
+    @bp.route('/users:batch', methods=['PUT'])
+    @auth.require_auth('any')
+    @rate_limit_decorator()
+    @rbac_required(['update_user'])
+    def update_users_batch():
+        return batch_write('upsert')
+
+    @bp.route('/users:batch', methods=['DELETE'])
+    @auth.require_auth('any')
+    @rate_limit_decorator()
+    @rbac_required(['delete_user'])
+    def delete_users_batch():
+        return batch_write('delete')
+
     @bp.route('/rotate-key', methods=['POST'])
     @auth.require_auth('any')
     @rate_limit_decorator()
     def rotate_encryption_key():
         try:
-            new_version = cosmos_client.rotate_encryption_key()
-            return jsonify({"message": f"Key rotated successfully. New version: {new_version}"}), 200
+            status = cosmos_client.start_key_rotation(
+                rotate=request.args.get('rotate', 'true').lower() != 'false',
+                resume=request.args.get('resume', 'true').lower() != 'false'
+            )
+            return jsonify({"message": f"Key rotation started. New version: {status['target_version']}",
+                            "status": status}), 202
+        except RotationInProgressError as e:
+            return jsonify({"error": str(e), "status": cosmos_client.get_key_rotation_status()}), 409
         except Exception as e:
             return jsonify({"error": f"Key rotation failed: {str(e)}"}), 500
 
+    @bp.route('/rotate-key/status', methods=['GET'])
+    @auth.require_auth('any')
+    @rate_limit_decorator()
+    def key_rotation_status():
+        status = cosmos_client.get_key_rotation_status()
+        if status is None:
+            return jsonify({"error": "No key rotation has been started"}), 404
+        return jsonify(status), 200
+
+    @bp.route('/cache/stats', methods=['GET'])
+    @auth.require_auth('any')
+    @rate_limit_decorator()
+    def cache_stats():
+        stats = cosmos_client.get_cache_stats()
+        if stats is None:
+            return jsonify({"error": "Caching is disabled"}), 404
+        return jsonify(stats), 200
+
+    @bp.route('/view/stats', methods=['GET'])
+    @auth.require_auth('any')
+    @rate_limit_decorator()
+    def view_stats():
+        stats = cosmos_client.get_view_stats()
+        if stats is None:
+            return jsonify({"error": "The users view is disabled"}), 404
+        return jsonify(stats), 200
+
+    @bp.route('/retry/stats', methods=['GET'])
+    @auth.require_auth('any')
+    @rate_limit_decorator()
+    def retry_stats():
+        return jsonify(cosmos_client.get_retry_stats()), 200
+
+    @bp.route('/coalescing/stats', methods=['GET'])
+    @auth.require_auth('any')
+    @rate_limit_decorator()
+    def coalescing_stats():
+        return jsonify(cosmos_client.get_coalescing_stats()), 200
+
     @bp.route('/test_encryption', methods=['POST', 'GET'])
     def test_encryption():
         if request.method == 'POST':
@@ -134,17 +354,21 @@ def init_routes(bp, cosmos_client, auth, limiter):
     @rbac_required(['manage_roles'])
     def get_roles():
         roles = cosmos_client.get_all_roles()
-        return jsonify([role.to_dict() for role in roles]), 200
+        return json_response(Role.to_dicts(roles))
 
     @bp.route('/roles', methods=['POST'])
     @auth.require_auth('any')
     @rbac_required(['manage_roles'])
     def create_role():
-        data = request.json
+        try:
+            data = Role.schema.validate(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         new_role = Role(data['name'], data['permissions'])
         created_role = cosmos_client.create_role(new_role)
+        rbac_engine.refresh()
         return jsonify(created_role.to_dict()), 201
     
     
 
-    return api_bp
\ No newline at end of file
+    return bp
@@ -0,0 +1,349 @@
+import asyncio
+import json
+import logging
+import re
+from urllib.parse import parse_qs
+import limits
+from asgiref.wsgi import WsgiToAsgi
+from azure.cosmos.exceptions import (CosmosHttpResponseError, CosmosAccessConditionFailedError,
+                                     CosmosResourceNotFoundError)
+from azure.core.exceptions import AzureError
+from . import create_app
+from .auth.authenticator import Authenticator
+from .data.async_cosmos_db_client import AsyncCosmosDBClient
+from .data.etags import NOT_MODIFIED, parse_if_match, parse_if_none_match
+from .data.fields import parse_fields
+from .models.user import User
+from .data.retry import deadline
+from .encoding import EncodedBody, ResponseEncoder
+from .rbac.engine import rbac_engine
+from .ratelimit import create_rate_limiter
+from .utils.helpers import ensure_https, encode_continuation, decode_continuation
+
+logger = logging.getLogger(__name__)
+
+USER_PATH = re.compile(r'^/api/users/(?P<id>[^/]+)$')
+
+SECURITY_HEADERS = [
+    (b'strict-transport-security', b'max-age=31536000; includeSubDomains'),
+    (b'x-frame-options', b'DENY'),
+    (b'x-content-type-options', b'nosniff'),
+    (b'content-security-policy', b"default-src 'self'"),
+    (b'referrer-policy', b'strict-origin-when-cross-origin'),
+]
+
+
+class AsyncRequest:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self._receive = receive
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.args = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.remote_addr = (scope.get('client') or ('unknown',))[0]
+
+    async def body(self):
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await self._receive()
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        return b''.join(chunks)
+
+    async def json(self):
+        return json.loads(await self.body() or b'null')
+
+# Serializes responses of an AsyncAPI built around an app without init_encoding
+DEFAULT_ENCODER = ResponseEncoder.from_config({'COMPRESSION_ENABLED': False})
+
+
+class AsyncResponse:
+    """A response from a payload to serialize, an EncodedBody (body) or an async iterator of chunks."""
+
+    def __init__(self, status, payload=None, chunks=None, content_type='application/json', headers=None, body=None):
+        self.status = status
+        self.payload = payload
+        self.chunks = chunks
+        self.content_type = content_type
+        self.headers = headers or []
+        self.body = body
+
+    async def send(self, send, encoder=None, accept_encoding=None):
+        encoder = encoder or DEFAULT_ENCODER
+        headers = [(b'content-type', self.content_type.encode())] + SECURITY_HEADERS + self.headers
+        has_body = self.chunks is not None or self.body is not None or self.payload is not None
+        if has_body and encoder.compressible(self.content_type):
+            headers.append((b'vary', b'Accept-Encoding'))
+        if self.chunks is None:
+            body = self.body
+            if body is None and self.payload is not None:
+                body = EncodedBody(encoder.dumps(self.payload))
+            data = b''
+            if body is not None:
+                data = body.data
+                coding = encoder.negotiate(accept_encoding, self.content_type, len(data))
+                if coding is not None:
+                    data = encoder.compress(body, coding)
+                    headers.append((b'content-encoding', coding.name.encode()))
+            await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': data})
+            return
+        coding = encoder.negotiate(accept_encoding, self.content_type)
+        stream = coding.stream() if coding is not None else None
+        if stream is not None:
+            headers.append((b'content-encoding', coding.name.encode()))
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+        async for chunk in self.chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if stream is not None:
+                chunk = stream.write(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': stream.close() if stream is not None else b''})
+
+
+class AsyncAPI:
+    """ASGI application that serves the /api/users endpoints natively on asyncio.
+
+    Authentication, RBAC and rate limits mirror the Flask routes; every other path is
+    handed to the Flask app through WsgiToAsgi, which runs it on a worker thread.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.encoder = flask_app.extensions.get('response_encoder') or ResponseEncoder.from_config(self.config)
+        self.authenticator = flask_app.extensions.get('authenticator') or Authenticator(flask_app)
+        self.cosmos_client = None
+        self._cosmos_lock = None
+        # Share the Flask app's storage and strategy so both paths count against the same backend.
+        # Hits are synchronous; with a batched storage they stay in process and do not block the loop.
+        flask_limiter = next(iter(flask_app.extensions.get('limiter', ())), None)
+        self.rate_limiter = flask_limiter.limiter if flask_limiter is not None else create_rate_limiter(self.config)
+        self.route_limits = [
+            limits.parse("100/minute"),
+            limits.parse(f"{self.config['RATE_LIMIT']} per day"),
+            limits.parse(f"{self.config['RATE_LIMIT_PERIOD']} per hour"),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        route = self._match(scope) if scope['type'] == 'http' else None
+        if route is None:
+            return await self.wsgi(scope, receive, send)
+        handler, kwargs, permissions = route
+        request = AsyncRequest(scope, receive)
+        response = await self._dispatch(request, handler, kwargs, permissions)
+        await response.send(send, self.encoder, request.headers.get('accept-encoding'))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.cosmos_client is not None:
+                    await self.cosmos_client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _match(self, scope):
+        method, path = scope['method'], scope['path']
+        if path == '/api/users':
+            if method == 'GET':
+                return self.get_users, {}, ['read_user']
+            if method == 'POST':
+                return self.create_user, {}, ['create_user']
+        match = USER_PATH.match(path)
+        # /api/users/changes is served by the Flask app
+        if match and match.group('id') != 'changes':
+            handler = {'GET': self.get_user, 'PUT': self.update_user, 'DELETE': self.delete_user}.get(method)
+            if handler is not None:
+                return handler, {'id': match.group('id')}, []
+        return None
+
+    async def _get_cosmos_client(self):
+        if self.cosmos_client is None:
+            if self._cosmos_lock is None:
+                self._cosmos_lock = asyncio.Lock()
+            async with self._cosmos_lock:
+                if self.cosmos_client is None:
+                    self.cosmos_client = await AsyncCosmosDBClient.create(self.config)
+        return self.cosmos_client
+
+    def _authenticate(self, request):
+        """Return the caller's Principal, or None; shares the authenticator and its cache with Auth.require_auth."""
+        return self.authenticator.authenticate(request.headers)
+
+    @staticmethod
+    def _authorized(roles, permissions):
+        return rbac_engine.is_allowed(roles, rbac_engine.permission_mask(permissions))
+
+    async def _dispatch(self, request, handler, kwargs, permissions):
+        if request.scope.get('scheme') == 'http' and not self.flask_app.debug:
+            query_string = request.scope.get('query_string', b'').decode()
+            location = ensure_https(f"http://{request.headers.get('host', '')}{request.path}"
+                                    f"{'?' + query_string if query_string else ''}")
+            return AsyncResponse(301, headers=[(b'location', location.encode())])
+        principal = self._authenticate(request)
+        if principal is None:
+            return AsyncResponse(401, {"error": "Unauthorized"})
+        if permissions and not self._authorized(principal.roles, permissions):
+            return AsyncResponse(403, {"error": "Forbidden"})
+        rate_key = f'{principal.method}:{principal.identity}'
+        for limit in self.route_limits:
+            if not self.rate_limiter.hit(limit, rate_key, handler.__name__):
+                return AsyncResponse(429, {"error": "Rate limit exceeded"})
+        try:
+            with deadline(self.config.get('REQUEST_RETRY_BUDGET_SECONDS', 10)):
+                return await handler(request, **kwargs)
+        except CosmosHttpResponseError as e:
+            logger.error("Cosmos DB HTTP error in %s: %s", handler.__name__, e.message,
+                         extra={'status_code': e.status_code, 'sub_status': e.sub_status})
+            return AsyncResponse(500, {"error": "Database error", "details": str(e)})
+        except AzureError as e:
+            logger.error("Azure error in %s: %s", handler.__name__, e)
+            return AsyncResponse(500, {"error": "Azure service error", "details": str(e)})
+        except Exception as e:
+            logger.exception("Unexpected error in %s", handler.__name__)
+            return AsyncResponse(500, {"error": "Internal server error", "details": str(e)})
+
+    @staticmethod
+    def _tagged(status, payload, etag, body=None):
+        # 304 carries the etag and no body: nothing was decrypted or serialized
+        headers = [(b'etag', etag.encode())] if etag else []
+        if status == 304:
+            return AsyncResponse(status, headers=headers)
+        return AsyncResponse(status, payload, headers=headers, body=body)
+
+    def _versioned(self, request, versioned, payload=lambda value: value):
+        if versioned.value is NOT_MODIFIED:
+            return self._tagged(304, None, versioned.etag)
+        # Keyed like the Flask routes: the same version of the same query encodes to the same bytes
+        key = (versioned.etag, request.path, request.scope.get('query_string', b'')) if versioned.etag else None
+        return self._tagged(200, None, versioned.etag, self.encoder.body(payload(versioned.value), key))
+
+    def _page_size(self, request):
+        limit = request.args.get('limit', self.config.get('DEFAULT_PAGE_SIZE', 100))
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError("limit must be an integer")
+        if limit < 1 or limit > self.config.get('MAX_PAGE_SIZE', 1000):
+            raise ValueError(f"limit must be between 1 and {self.config.get('MAX_PAGE_SIZE', 1000)}")
+        return limit
+
+    async def get_users(self, request):
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return AsyncResponse(400, {"error": str(e)})
+        cosmos_client = await self._get_cosmos_client()
+        stream_format = request.args.get('stream')
+        if stream_format is None and request.headers.get('accept') == 'application/x-ndjson':
+            stream_format = 'ndjson'
+        if_none_match = parse_if_none_match(request.headers.get('if-none-match'))
+        if stream_format is None and 'limit' not in request.args and 'continuation' not in request.args:
+            return self._versioned(request, await cosmos_client.get_all_items_versioned(
+                fields=fields, if_none_match=if_none_match))
+        try:
+            page_size = self._page_size(request)
+            continuation = decode_continuation(request.args.get('continuation'))
+        except ValueError as e:
+            return AsyncResponse(400, {"error": str(e)})
+        if stream_format is None:
+            page = await cosmos_client.get_items_page_versioned(page_size, continuation, fields=fields,
+                                                                if_none_match=if_none_match)
+            return self._versioned(request, page, lambda value: {"items": value[0],
+                                                        "continuation": encode_continuation(value[1])})
+        if stream_format not in ('ndjson', 'json'):
+            return AsyncResponse(400, {"error": "stream must be 'ndjson' or 'json'"})
+
+        pages = cosmos_client.iter_item_pages(page_size, continuation, fields=fields)
+        # Pull the first page before answering so query errors still surface as a 500
+        try:
+            first_page = await pages.__anext__()
+        except StopAsyncIteration:
+            first_page = []
+
+        async def ndjson():
+            if first_page:
+                yield self.encoder.ndjson(first_page)
+            async for page in pages:
+                if page:
+                    yield self.encoder.ndjson(page)
+
+        async def json_array():
+            separator = b'['
+            if first_page:
+                yield separator + self.encoder.array_items(first_page)
+                separator = b','
+            async for page in pages:
+                if page:
+                    yield separator + self.encoder.array_items(page)
+                    separator = b','
+            yield b'[]' if separator == b'[' else b']'
+
+        if stream_format == 'ndjson':
+            return AsyncResponse(200, chunks=ndjson(), content_type='application/x-ndjson')
+        return AsyncResponse(200, chunks=json_array())
+
+    async def create_user(self, request):
+        try:
+            new_user = User.schema.validate(await request.json())
+        except ValueError as e:
+            return AsyncResponse(400, {"error": str(e)})
+        cosmos_client = await self._get_cosmos_client()
+        return AsyncResponse(201, await cosmos_client.create_item(new_user))
+
+    async def get_user(self, request, id):
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return AsyncResponse(400, {"error": str(e)})
+        cosmos_client = await self._get_cosmos_client()
+        user = await cosmos_client.get_item_versioned(
+            id, fields=fields, if_none_match=parse_if_none_match(request.headers.get('if-none-match')))
+        if user.value is None:
+            return AsyncResponse(404, {"error": "User not found"})
+        return self._versioned(request, user)
+
+    async def update_user(self, request, id):
+        try:
+            if_match = parse_if_match(request.headers.get('if-match'))
+            update_data = User.schema.validate(await request.json())
+            if update_data.get('id', id) != id:
+                raise ValueError("id in the body does not match the URL")
+        except ValueError as e:
+            return AsyncResponse(400, {"error": str(e)})
+        update_data['id'] = id
+        cosmos_client = await self._get_cosmos_client()
+        try:
+            updated_user = await cosmos_client.update_item(update_data, if_match=if_match)
+        except CosmosAccessConditionFailedError:
+            return AsyncResponse(412, {"error": "User was changed since it was read; read it again"})
+        except CosmosResourceNotFoundError:
+            return AsyncResponse(404, {"error": "User not found"})
+        return self._tagged(200, updated_user, updated_user.get('_etag'))
+
+    async def delete_user(self, request, id):
+        try:
+            if_match = parse_if_match(request.headers.get('if-match'))
+        except ValueError as e:
+            return AsyncResponse(400, {"error": str(e)})
+        cosmos_client = await self._get_cosmos_client()
+        try:
+            await cosmos_client.delete_item(id, if_match=if_match)
+        except CosmosAccessConditionFailedError:
+            return AsyncResponse(412, {"error": "User was changed since it was read; read it again"})
+        except CosmosResourceNotFoundError:
+            return AsyncResponse(404, {"error": "User not found"})
+        return AsyncResponse(204)
+
+
+def create_asgi_app(flask_app=None):
+    return AsyncAPI(flask_app or create_app())
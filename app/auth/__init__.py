@@ -1,18 +1,19 @@
-from flask import Blueprint
-
-auth_bp = Blueprint('auth', __name__)
-
 from . import routes
 from .base import Auth
 from .jwt_auth import JWTAuth
-from .oauth_auth import OAuthAuth
 from .api_key_auth import APIKeyAuth
+from .authenticator import Authenticator, Principal
 
 def init_auth(app):
     jwt_auth = JWTAuth(app)
-    oauth_auth = OAuthAuth(app)
-    api_key_auth = APIKeyAuth(app)
-    auth = Auth(app, jwt_auth, oauth_auth, api_key_auth)
-    routes.init_auth_routes(auth)
-    print("Auth initialized")
-    return auth
\ No newline at end of file
+    oauth_auth = None
+    if app.config.get('GITHUB_CLIENT_ID'):
+        # authlib is only imported when GitHub login is configured
+        from .oauth_auth import OAuthAuth
+        oauth_auth = OAuthAuth(app)
+    authenticator = Authenticator(app)
+    api_key_auth = APIKeyAuth(app, authenticator)
+    auth = Auth(app, jwt_auth, oauth_auth, api_key_auth, authenticator)
+    app.extensions['authenticator'] = authenticator
+    auth.blueprint = routes.init_auth_routes(auth)
+    return auth
@@ -1,12 +1,10 @@
 from flask import request
+from .authenticator import Authenticator
 
 class APIKeyAuth:
-    def __init__(self, app):
+    def __init__(self, app, authenticator=None):
         self.app = app
+        self.authenticator = authenticator or Authenticator(app)
 
     def check_api_key(self):
-        api_key = request.headers.get('X-API-Key')
-        if api_key is None:
-            return False
-        result = api_key == self.app.config['API_KEY']
-        return result
\ No newline at end of file
+        return self.authenticator.authenticate(request.headers, ('api_key',)) is not None
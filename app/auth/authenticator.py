@@ -0,0 +1,116 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import time
+from flask import has_app_context
+from flask_jwt_extended import decode_token
+from ..data.cache import InProcessCache
+
+AUTH_METHODS = ('api_key', 'basic', 'jwt')
+
+
+class Principal:
+    """The authenticated caller, stored on g.user for rbac_required."""
+
+    def __init__(self, identity, roles, method, claims=None):
+        self.identity = identity
+        self.roles = list(roles)
+        self.method = method
+        self.claims = claims
+
+
+class Authenticator:
+    """Picks the one authenticator matching the credential headers a request carries.
+
+    Verified JWTs and API keys are cached by a SHA-256 digest of the credential until the
+    token expires or AUTH_CACHE_TTL passes, so repeat callers cost a header lookup and a
+    dictionary hit. Failed verifications are not cached. Works with Flask's request.headers
+    and with the lower-cased header dict of the ASGI app.
+    """
+
+    def __init__(self, app, cache=None, clock=time.time):
+        self.app = app
+        self.config = app.config
+        self.clock = clock
+        self.cache = cache or InProcessCache(
+            max_entries=app.config.get('AUTH_CACHE_MAX_ENTRIES', 10000),
+            ttl=app.config.get('AUTH_CACHE_TTL', 300)
+        )
+
+    def authenticate(self, headers, methods=AUTH_METHODS):
+        """Return the Principal for these headers, or None."""
+        api_key = headers.get('x-api-key')
+        if api_key is not None:
+            return self._api_key(api_key) if 'api_key' in methods else None
+        scheme, _, credentials = (headers.get('authorization') or '').partition(' ')
+        scheme = scheme.lower()
+        if scheme == 'bearer' and 'jwt' in methods:
+            return self._jwt(credentials.strip())
+        if scheme == 'basic' and 'basic' in methods:
+            return self._basic(credentials.strip())
+        return None
+
+    @staticmethod
+    def _digest(method, credential):
+        return method + ':' + hashlib.sha256(credential.encode()).hexdigest()
+
+    def _cached(self, key):
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh:
+            return entry.value
+        return None
+
+    def _api_key(self, api_key):
+        key = self._digest('api_key', api_key)
+        principal = self._cached(key)
+        if principal is not None:
+            return principal
+        expected = self.config.get('API_KEY')
+        if not expected or not hmac.compare_digest(api_key.encode(), expected.encode()):
+            return None
+        principal = Principal('api-key', self.config.get('API_KEY_ROLES', ['admin']), 'api_key')
+        self.cache.set(key, principal)
+        return principal
+
+    def _basic(self, credentials):
+        # Plain comparisons against config are cheaper than a cache lookup
+        try:
+            username, _, password = base64.b64decode(credentials, validate=True).decode().partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        expected_username = self.config.get('BASIC_AUTH_USERNAME') or ''
+        expected_password = self.config.get('BASIC_AUTH_PASSWORD') or ''
+        if not expected_username or not expected_password:
+            return None
+        username_ok = hmac.compare_digest(username.encode(), expected_username.encode())
+        password_ok = hmac.compare_digest(password.encode(), expected_password.encode())
+        if not (username_ok and password_ok):
+            return None
+        return Principal(username, self.config.get('BASIC_AUTH_ROLES', ['admin']), 'basic')
+
+    def _jwt(self, token):
+        if not token:
+            return None
+        key = self._digest('jwt', token)
+        principal = self._cached(key)
+        if principal is not None and principal.claims.get('exp', float('inf')) > self.clock():
+            return principal
+        try:
+            if has_app_context():
+                claims = decode_token(token)
+            else:
+                with self.app.app_context():
+                    claims = decode_token(token)
+        except Exception:
+            return None
+        if claims.get('type', 'access') != 'access':
+            return None
+        identity = claims.get(self.config.get('JWT_IDENTITY_CLAIM', 'sub'))
+        principal = Principal(identity, claims.get('roles', []), 'jwt', claims)
+        ttl = self.cache.ttl
+        if 'exp' in claims:
+            ttl = min(ttl, claims['exp'] - self.clock())
+        if ttl > 0:
+            self.cache.set(key, principal, ttl=ttl)
+        return principal
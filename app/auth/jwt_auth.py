@@ -8,17 +8,12 @@ class JWTAuth:
     def jwt_required(self):
         return jwt_required()
 
-    def check_jwt(self):
-        try:
-            jwt_required()(lambda: None)()
-            return True
-        except Exception as e:
-            current_app.logger.error(f"JWT error: {str(e)}")
-            return False
-
     def login_jwt(self, username, password):
         if username == current_app.config['BASIC_AUTH_USERNAME'] and password == current_app.config['BASIC_AUTH_PASSWORD']:
-            access_token = create_access_token(identity=username)
+            access_token = create_access_token(
+                identity=username,
+                additional_claims={'roles': current_app.config.get('BASIC_AUTH_ROLES', ['admin'])}
+            )
             return jsonify(access_token=access_token), 200
         else:
             return jsonify({"error": "Invalid credentials"}), 401
\ No newline at end of file
@@ -1,14 +0,0 @@
-from authlib.integrations.flask_client import OAuth
-
-def configure_oauth(app, oauth):
-    oauth.register(
-        name='github',
-        client_id=app.config['GITHUB_CLIENT_ID'],
-        client_secret=app.config['GITHUB_CLIENT_SECRET'],
-        access_token_url='https://github.com/login/oauth/access_token',
-        access_token_params=None,
-        authorize_url='https://github.com/login/oauth/authorize',
-        authorize_params=None,
-        api_base_url='https://api.github.com/',
-        client_kwargs={'scope': 'user:email'},
-    )
\ No newline at end of file
@@ -28,7 +28,10 @@ class OAuthAuth:
             github_user = resp.json()
             
             # Use the GitHub username as the identity for the JWT
-            access_token = create_access_token(identity=github_user['login'])
+            access_token = create_access_token(
+                identity=github_user['login'],
+                additional_claims={'roles': current_app.config.get('OAUTH_DEFAULT_ROLES', ['user'])}
+            )
             
             return jsonify(
                 message="Successfully authenticated with GitHub",
@@ -1,23 +1,25 @@
-from flask import request
-from . import auth_bp
+from flask import Blueprint, request, jsonify
 
 def init_auth_routes(auth):
-    print("Initializing auth routes")
+    # A new blueprint per app: the views close over this app's Auth
+    auth_bp = Blueprint('auth', __name__)
+
     @auth_bp.route('/login', methods=['POST'])
     def login():
-        print("Login route called")
         username = request.json.get('username', None)
         password = request.json.get('password', None)
         return auth.jwt_auth.login_jwt(username, password)
 
     @auth_bp.route('/login/github')
     def github_login():
-        print("GitHub login route called")
+        if auth.oauth_auth is None:
+            return jsonify({"error": "GitHub login is not configured"}), 404
         return auth.oauth_auth.oauth_login()
 
     @auth_bp.route('/login/github/callback')
     def github_callback():
-        print("GitHub callback route called")
+        if auth.oauth_auth is None:
+            return jsonify({"error": "GitHub login is not configured"}), 404
         return auth.oauth_auth.oauth_callback()
 
-    return auth_bp
\ No newline at end of file
+    return auth_bp
@@ -0,0 +1 @@
+from .registry import ClientRegistry, get_registry, set_registry
\ No newline at end of file
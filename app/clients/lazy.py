@@ -0,0 +1,43 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class LazyClient:
+    """Builds a client on first use and then stands in for it.
+
+    Attribute access goes to the real client, so callers use it as if it had been built
+    up front. A failed build is not remembered: the next use tries again, and `error`
+    holds the last failure for readiness checks.
+    """
+
+    def __init__(self, factory, name='client'):
+        self._factory = factory
+        self._name = name
+        self._client = None
+        self._lock = threading.Lock()
+        self.error = None
+
+    @property
+    def ready(self):
+        return self._client is not None
+
+    def get(self):
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                try:
+                    self._client = self._factory()
+                    self.error = None
+                    logger.info("Initialized %s", self._name)
+                except Exception as e:
+                    self.error = e
+                    raise
+            return self._client
+
+    def __getattr__(self, name):
+        # Only reached for names LazyClient itself does not define
+        return getattr(self.get(), name)
@@ -0,0 +1,174 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from azure.cosmos import CosmosClient
+from azure.identity import DefaultAzureCredential
+from azure.keyvault.keys import KeyClient
+from azure.keyvault.keys.crypto import CryptographyClient
+from azure.keyvault.secrets import SecretClient
+from ..data.retry import cosmos_connection_policy
+from .transport import TimedTransport
+
+
+class ClientRegistry:
+    """Process-wide Azure credential, SDK clients and memoized Key Vault lookups.
+
+    Every client shares one credential (and its token cache) and one HTTP connection
+    pool. With gunicorn's preload_app the master warms the registry once and forked
+    workers inherit it; after_fork, run automatically in every child, drops only the
+    inherited pooled connections so no socket is ever shared between processes.
+    """
+
+    def __init__(self, pool_size=32):
+        self.pool_size = pool_size
+        self._session = self._new_session()
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._clients = {}
+        self._secrets = {}
+        self._keys = {}
+
+    def _new_session(self):
+        session = requests.Session()
+        # Retries are left to the Azure SDK pipeline policies
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                              max_retries=Retry(total=False, redirect=False, raise_on_status=False))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _transport(self, stage):
+        return TimedTransport(stage, session=self._session, session_owner=False)
+
+    def _memoized(self, cache, key, factory):
+        """Return cache[key], building it at most once even when threads race for it."""
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        with self._lock:
+            lock = self._locks.setdefault((id(cache), key), threading.Lock())
+        with lock:
+            if key not in cache:
+                cache[key] = factory()
+        return cache[key]
+
+    def credential(self):
+        return self._memoized(self._clients, ('credential',), lambda: DefaultAzureCredential(
+            additionally_allowed_tenants=["*"], transport=self._transport('identity')))
+
+    def secret_client(self, vault_url):
+        return self._memoized(self._clients, ('secrets', vault_url), lambda: SecretClient(
+            vault_url=vault_url, credential=self.credential(), transport=self._transport('keyvault')))
+
+    def key_client(self, vault_url):
+        return self._memoized(self._clients, ('keys', vault_url), lambda: KeyClient(
+            vault_url=vault_url, credential=self.credential(), transport=self._transport('keyvault')))
+
+    def crypto_client(self, key):
+        return self._memoized(self._clients, ('crypto', key.id), lambda: CryptographyClient(
+            key, credential=self.credential(), transport=self._transport('keyvault')))
+
+    def cosmos_client(self, endpoint, credential):
+        return self._memoized(self._clients, ('cosmos', endpoint), lambda: CosmosClient(
+            endpoint, credential=credential, transport=self._transport('cosmos'),
+            connection_policy=cosmos_connection_policy()))
+
+    def get_secret(self, vault_url, name):
+        return self._memoized(self._secrets, (vault_url, name),
+                              lambda: self.secret_client(vault_url).get_secret(name).value)
+
+    def get_secrets(self, vault_url, names, refresh=False):
+        """Fetch several secrets concurrently and return (values, errors), both keyed by secret name.
+
+        The first lookup runs alone so the Key Vault auth challenge and the access token
+        are resolved once; the rest then share them. refresh=True bypasses the memoized values.
+        """
+        fetch = self._refresh_secret if refresh else self.get_secret
+        names = list(names)
+        values, errors = {}, {}
+
+        def collect(name, call):
+            try:
+                values[name] = call()
+            except Exception as e:
+                errors[name] = e
+
+        if names:
+            collect(names[0], lambda: fetch(vault_url, names[0]))
+        if len(names) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(names) - 1, self.pool_size),
+                                    thread_name_prefix='secret-fetch') as pool:
+                futures = [(name, pool.submit(fetch, vault_url, name)) for name in names[1:]]
+            for name, future in futures:
+                collect(name, future.result)
+        return values, errors
+
+    def _refresh_secret(self, vault_url, name):
+        value = self.secret_client(vault_url).get_secret(name).value
+        self._secrets[(vault_url, name)] = value
+        return value
+
+    def seed_secrets(self, vault_url, values):
+        """Memoize secret values obtained elsewhere, e.g. from a local snapshot."""
+        for name, value in values.items():
+            self._secrets[(vault_url, name)] = value
+
+    def get_key(self, vault_url, name, version=None):
+        """Return a Key Vault key; version None means the latest one, memoized until forget_key."""
+        return self._memoized(self._keys, (vault_url, name, version),
+                              lambda: self.key_client(vault_url).get_key(name, version=version))
+
+    def forget_key(self, vault_url, name):
+        """Forget the memoized latest version of a key, e.g. after rotating it."""
+        self._keys.pop((vault_url, name, None), None)
+
+    def after_fork(self):
+        # Locks may have been held by another thread at fork time; pooled sockets belong to the parent
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._session.close()
+
+    def close(self):
+        for client in self._clients.values():
+            close = getattr(client, 'close', None)
+            if close is not None:
+                close()
+        self._clients.clear()
+        self._session.close()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                # From the environment: the registry may be needed before any app config is loaded
+                _registry = ClientRegistry(pool_size=int(os.environ.get('AZURE_POOL_SIZE', 32)))
+    return _registry
+
+
+def set_registry(registry):
+    """Replace the process-wide registry, e.g. with one serving local stand-ins; returns the old one."""
+    global _registry
+    with _registry_lock:
+        previous, _registry = _registry, registry
+    return previous
+
+
+def _after_fork_in_child():
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    if _registry is not None:
+        _registry.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
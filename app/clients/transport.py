@@ -0,0 +1,32 @@
+import time
+from azure.core.pipeline.transport import RequestsTransport
+from ..metrics import record_request_charge, record_stage
+
+REQUEST_CHARGE_HEADER = 'x-ms-request-charge'
+
+
+class TimedTransport(RequestsTransport):
+    """Reports the time of every HTTP call an Azure client makes as a stage ('cosmos', 'keyvault', ...).
+
+    Timing the transport rather than the client methods counts each retry and query page
+    once and keeps local work such as decryption out of the service's time. Cosmos DB
+    responses also carry the request units they cost.
+    """
+
+    def __init__(self, stage, **kwargs):
+        super().__init__(**kwargs)
+        self.stage = stage
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            record_stage(self.stage, time.perf_counter() - start)
+        charge = response.headers.get(REQUEST_CHARGE_HEADER)
+        if charge:
+            try:
+                record_request_charge(float(charge))
+            except ValueError:
+                pass
+        return response
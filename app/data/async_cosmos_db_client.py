@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import uuid
+import aiohttp
+from azure.core import MatchConditions
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.cosmos import exceptions
+from azure.cosmos.aio import CosmosClient
+from azure.identity.aio import DefaultAzureCredential
+from azure.keyvault.secrets.aio import SecretClient
+from ..security.async_encryption import AsyncEncryptor
+from ..security.encryption import Encryptor
+from .cache import create_cache
+from .cosmos_db_client import LIST_PARAMETERS, list_query
+from .data_keys import AsyncDataKeyStore
+from .etags import ANY, NOT_MODIFIED, Versioned, list_etag, matches, write_conditions
+from .fields import FieldPolicy, project
+from .retry import cosmos_connection_policy, cosmos_retry
+from .single_flight import coalesce
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCosmosDBClient:
+    """asyncio counterpart of CosmosDBClient built on azure.cosmos.aio.
+
+    One instance per event loop keeps a single connection pool, so a worker can have
+    many Cosmos and Key Vault calls in flight at once. Build it with
+    ``await AsyncCosmosDBClient.create(config)`` and ``await close()`` it on shutdown.
+
+    Point reads go through the same read-through cache as CosmosDBClient; listings are
+    always queried, since the users view (USERS_VIEW_ENABLED) is not kept under asyncio.
+    """
+
+    def __init__(self, config):
+        self.cosmos_endpoint = config.get('COSMOS_ENDPOINT')
+        self.database_name = config.get('DATABASE_NAME')
+        self.container_name = config.get('CONTAINER_NAME')
+        self.key_vault_url = config.get('KEY_VAULT_URL')
+        self.key_name = config.get('KEY_NAME')
+        self.encryption_mode = config.get('ENCRYPTION_MODE', 'envelope')
+        self.decrypt_concurrency = int(config.get('DECRYPT_CONCURRENCY', 16))
+        self.pool_size = int(config.get('AZURE_POOL_SIZE', 32))
+        self.key_version_ttl = config.get('KEY_VERSION_REFRESH_SECONDS', 60)
+        self.field_policy = FieldPolicy(config.get('ENCRYPTED_FIELDS'))
+        self.cache = create_cache(config)
+        if config.get('USERS_VIEW_ENABLED', False):
+            logger.warning("USERS_VIEW_ENABLED has no effect on the asyncio data path: "
+                           "GET /api/users is queried from Cosmos DB on every call")
+
+        if not all([self.cosmos_endpoint, self.database_name, self.container_name, self.key_vault_url, self.key_name]):
+            raise ValueError("Missing Cosmos DB or Key Vault configuration")
+
+        self.credential = None
+        self.session = None
+        self.client = None
+        self.container = None
+        self.encryptor = None
+        self._decrypt_semaphore = None
+
+    @classmethod
+    async def create(cls, config):
+        cosmos = cls(config)
+        # One aiohttp session of pool_size connections for every Azure client of this instance,
+        # instead of a session (and a default 100-connection pool) per client
+        cosmos.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=cosmos.pool_size),
+            cookie_jar=aiohttp.DummyCookieJar(), auto_decompress=False, trust_env=True)
+        transport = AioHttpTransport(session=cosmos.session, session_owner=False)
+        cosmos.credential = DefaultAzureCredential(additionally_allowed_tenants=["*"], transport=transport)
+        try:
+            # Config.load_secrets has usually fetched the key already
+            cosmos_key = config.get('COSMOS_KEY')
+            if not cosmos_key:
+                async with SecretClient(vault_url=cosmos.key_vault_url, credential=cosmos.credential,
+                                        transport=transport) as secret_client:
+                    cosmos_key = (await secret_client.get_secret('COSMOS-KEY')).value
+            cosmos.client = CosmosClient(cosmos.cosmos_endpoint, credential=cosmos_key, transport=transport,
+                                         connection_policy=cosmos_connection_policy())
+            cosmos.container = cosmos.client.get_database_client(cosmos.database_name) \
+                .get_container_client(cosmos.container_name)
+            cosmos.encryptor = await AsyncEncryptor.create(cosmos.key_vault_url, cosmos.key_name,
+                                                           mode=cosmos.encryption_mode, credential=cosmos.credential,
+                                                           transport=transport, key_version_ttl=cosmos.key_version_ttl,
+                                                           data_key_store=AsyncDataKeyStore(cosmos.container))
+            cosmos._decrypt_semaphore = asyncio.Semaphore(max(cosmos.decrypt_concurrency, 1))
+        except Exception:
+            logger.exception("Error initializing AsyncCosmosDBClient")
+            await cosmos.close()
+            raise
+        return cosmos
+
+    async def close(self):
+        if self.encryptor is not None:
+            await self.encryptor.close()
+        if self.client is not None:
+            await self.client.close()
+        if self.credential is not None:
+            await self.credential.close()
+        if self.session is not None:
+            await self.session.close()
+
+    async def _decrypt_item(self, item, fields=None):
+        for field in self.field_policy.encrypted(item, fields):
+            async with self._decrypt_semaphore:
+                try:
+                    item[field] = await self.encryptor.decrypt(item[field])
+                except Exception as decrypt_error:
+                    logger.warning("Could not decrypt %s of item %s: %s", field, item.get('id', 'unknown'),
+                                   type(decrypt_error).__name__)
+        return project(item, fields)
+
+    async def _decrypt_items(self, items, fields=None):
+        return list(await asyncio.gather(*(self._decrypt_item(item, fields) for item in items)))
+
+    async def _encrypt_body(self, body):
+        for field in self.field_policy.encrypted(body):
+            body[field] = await self.encryptor.encrypt(body[field])
+        return body
+
+    def _query_pages(self, page_size, continuation=None, fields=None):
+        return self.container.query_items(
+            query=list_query(fields), parameters=LIST_PARAMETERS, max_item_count=page_size
+        ).by_page(continuation)
+
+    async def get_all_items(self, fields=None):
+        return (await self.get_all_items_versioned(fields)).value
+
+    @coalesce
+    @cosmos_retry
+    async def get_all_items_versioned(self, fields=None, if_none_match=None):
+        query = list_query(fields)
+        items = [item async for item in self.container.query_items(query=query, parameters=LIST_PARAMETERS)]
+        etag = list_etag(items, fields)
+        if matches(etag, if_none_match):
+            return Versioned(NOT_MODIFIED, etag)
+        items = await self._decrypt_items(items, fields)
+        return Versioned(items, self._listing_etag(items, etag, fields))
+
+    async def get_items_page(self, page_size, continuation=None, fields=None):
+        return (await self.get_items_page_versioned(page_size, continuation, fields)).value
+
+    @cosmos_retry
+    async def get_items_page_versioned(self, page_size, continuation=None, fields=None, if_none_match=None):
+        pages = self._query_pages(page_size, continuation, fields)
+        items = []
+        async for page in pages:
+            items = [item async for item in page]
+            break
+        etag = list_etag(items, fields, page_size, continuation, pages.continuation_token)
+        if matches(etag, if_none_match):
+            return Versioned(NOT_MODIFIED, etag)
+        items = await self._decrypt_items(items, fields)
+        return Versioned((items, pages.continuation_token), self._listing_etag(items, etag, fields))
+
+    async def iter_item_pages(self, page_size, continuation=None, fields=None):
+        async for page in self._query_pages(page_size, continuation, fields):
+            yield await self._decrypt_items([item async for item in page], fields)
+
+    @coalesce.writes
+    @cosmos_retry
+    async def create_item(self, item):
+        body = dict(item)
+        body.setdefault('id', str(uuid.uuid4()))
+        return await self.container.create_item(body=await self._encrypt_body(body))
+
+    async def get_item(self, id, fields=None):
+        return (await self.get_item_versioned(id, fields)).value
+
+    @coalesce
+    @cosmos_retry
+    async def get_item_versioned(self, id, fields=None, if_none_match=None):
+        if self.cache is None:
+            return await self._read_item(id, fields, if_none_match)
+        cached = await self._cache_call(self.cache.get, id)
+        if cached is not None and cached.fresh:
+            if matches(cached.etag, if_none_match):
+                return Versioned(NOT_MODIFIED, cached.etag)
+            return await self._from_cache(cached, fields)
+        try:
+            if cached is not None and cached.etag:
+                item = await self.container.read_item(item=id, partition_key=id, etag=cached.etag,
+                                                      match_condition=MatchConditions.IfModified)
+                if not item:
+                    await self._cache_call(self.cache.revalidated, id, cached)
+                    if matches(cached.etag, if_none_match):
+                        return Versioned(NOT_MODIFIED, cached.etag)
+                    return await self._from_cache(cached, fields)
+            else:
+                return await self._read_item(id, fields, if_none_match, cache=True)
+        except exceptions.CosmosResourceNotFoundError:
+            await self._cache_call(self.cache.delete, id)
+            return Versioned(None, None)
+        return await self._decrypted(item, fields, if_none_match, cache=True)
+
+    async def _read_item(self, id, fields=None, if_none_match=None, cache=False):
+        try:
+            if if_none_match is not None and len(if_none_match) == 1 and ANY not in if_none_match:
+                etag = next(iter(if_none_match))
+                item = await self.container.read_item(item=id, partition_key=id, etag=etag,
+                                                      match_condition=MatchConditions.IfModified)
+                if not item:
+                    return Versioned(NOT_MODIFIED, etag)
+            else:
+                item = await self.container.read_item(item=id, partition_key=id)
+        except exceptions.CosmosResourceNotFoundError:
+            if cache:
+                await self._cache_call(self.cache.delete, id)
+            return Versioned(None, None)
+        return await self._decrypted(item, fields, if_none_match, cache)
+
+    async def _decrypted(self, item, fields, if_none_match, cache):
+        etag = item.get('_etag')
+        if cache and not self.cache.stores_plaintext:
+            await self._cache_call(self.cache.set, item['id'], dict(item), etag=etag)
+        if matches(etag, if_none_match):
+            return Versioned(NOT_MODIFIED, etag)
+        complete = cache and self.field_policy.covers(item, fields)
+        projected = await self._decrypt_item(item, fields)
+        failed = self._decrypt_failed(projected, fields)
+        if complete and self.cache.stores_plaintext and not failed:
+            # Decrypted in place; a plaintext cache only takes fully decrypted items
+            await self._cache_call(self.cache.set, item['id'], dict(item), etag=etag)
+        return Versioned(projected, None if failed else etag)
+
+    async def _from_cache(self, cached, fields=None):
+        item = dict(cached.value)
+        if not self.cache.stores_plaintext:
+            item = await self._decrypt_item(item, fields)
+            return Versioned(item, None if self._decrypt_failed(item, fields) else cached.etag)
+        return Versioned(project(item, fields), cached.etag)
+
+    def _decrypt_failed(self, item, fields=None):
+        # Like CosmosDBClient's: a result with a field that failed to decrypt gets no etag and is cached nowhere
+        return any(Encryptor.is_decryption_error(item[field]) for field in self.field_policy.encrypted(item, fields))
+
+    def _listing_etag(self, items, etag, fields=None):
+        return None if any(self._decrypt_failed(item, fields) for item in items) else etag
+
+    async def _cache_call(self, method, *args, **kwargs):
+        # A shared store is reached through a blocking client, so keep it off the event loop
+        if self.cache.blocking:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    async def invalidate_cache(self, id):
+        if self.cache is not None:
+            await self._cache_call(self.cache.delete, id)
+
+    @coalesce.writes
+    @cosmos_retry
+    async def update_item(self, item, if_match=None):
+        body = await self._encrypt_body(dict(item))
+        try:
+            if if_match is None:
+                return await self.container.upsert_item(body=body)
+            return await self.container.replace_item(item=body['id'], body=body,
+                                                     **write_conditions(if_match))
+        finally:
+            await self.invalidate_cache(body.get('id'))
+
+    @coalesce.writes
+    @cosmos_retry
+    async def delete_item(self, id, if_match=None):
+        try:
+            await self.container.delete_item(item=id, partition_key=id, **write_conditions(if_match))
+        finally:
+            await self.invalidate_cache(id)
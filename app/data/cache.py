@@ -0,0 +1,178 @@
+import fnmatch
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# value is what was cached, etag the Cosmos _etag it was read at, fresh False once the TTL has passed.
+# Stale entries are kept so the next read can revalidate them with a conditional request.
+CacheEntry = namedtuple('CacheEntry', ['value', 'etag', 'fresh'])
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stale': 0, 'revalidations': 0, 'evictions': 0}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class InProcessCache:
+    """LRU cache with a TTL and a size bound, local to one worker process."""
+    stores_plaintext = True
+    # Calls never wait on the network, so an event loop can make them directly
+    blocking = False
+
+    def __init__(self, max_entries=10000, ttl=30, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.incr('misses')
+                return None
+            self._entries.move_to_end(key)
+        value, etag, expires_at = entry
+        fresh = self.clock() < expires_at
+        self.stats.incr('hits' if fresh else 'stale')
+        return CacheEntry(value, etag, fresh)
+
+    def set(self, key, value, etag=None, ttl=None):
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, etag, expires_at)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            self.stats.incr('evictions', evicted)
+
+    def revalidated(self, key, entry):
+        """Record that a stale entry was confirmed unchanged and restart its TTL."""
+        self.stats.incr('revalidations')
+        self.set(key, entry.value, entry.etag)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        stats.update(backend='memory', size=len(self._entries), max_entries=self.max_entries, ttl=self.ttl)
+        return stats
+
+
+class SharedCache:
+    """Cache kept in a shared key-value store (a redis.Redis or LocalKeyValueStore).
+
+    Values are stored as they come from Cosmos, still encrypted, so no plaintext leaves
+    the worker; a hit saves the point read and the caller decrypts. The store drops
+    entries on its own once they are well past their TTL, so evictions happen there.
+    """
+    stores_plaintext = False
+    blocking = True
+
+    def __init__(self, client, prefix='cosmos-cache:', ttl=30, stale_ttl_factor=10, clock=time.time):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stale_ttl_factor = stale_ttl_factor
+        self.clock = clock
+        self.stats = CacheStats()
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats.incr('misses')
+            return None
+        data = json.loads(raw)
+        fresh = self.clock() < data['expires_at']
+        self.stats.incr('hits' if fresh else 'stale')
+        return CacheEntry(data['value'], data['etag'], fresh)
+
+    def set(self, key, value, etag=None, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        data = {'value': value, 'etag': etag, 'expires_at': self.clock() + ttl}
+        self.client.set(self.prefix + key, json.dumps(data), ex=max(int(ttl * self.stale_ttl_factor), 1))
+
+    def revalidated(self, key, entry):
+        self.stats.incr('revalidations')
+        self.set(key, entry.value, entry.etag)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        stats.update(backend='shared', ttl=self.ttl)
+        return stats
+
+
+class LocalKeyValueStore:
+    """In-process stand-in for the subset of the redis-py API that SharedCache uses."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._data.get(key, (None, None))
+            if expires_at is not None and self.clock() >= expires_at:
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, self.clock() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match='*'):
+        with self._lock:
+            keys = [key for key in self._data if fnmatch.fnmatchcase(key, match)]
+        return iter(keys)
+
+
+def create_cache(config):
+    """Build the read-through cache selected by CACHE_BACKEND ('memory', 'redis', 'local' or 'none')."""
+    backend = config.get('CACHE_BACKEND', 'memory')
+    ttl = float(config.get('CACHE_TTL', 30))
+    if backend == 'none':
+        return None
+    if backend == 'memory':
+        return InProcessCache(max_entries=int(config.get('CACHE_MAX_ENTRIES', 10000)), ttl=ttl)
+    if backend == 'local':
+        return SharedCache(LocalKeyValueStore(), ttl=ttl)
+    if backend == 'redis':
+        import redis
+        return SharedCache(redis.Redis.from_url(config['CACHE_REDIS_URL']), ttl=ttl)
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
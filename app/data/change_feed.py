@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from azure.cosmos import exceptions
+from ..utils.helpers import encode_continuation, decode_continuation
+from .etags import NOT_MODIFIED, Versioned, list_etag, matches
+from .fields import project
+
+logger = logging.getLogger(__name__)
+
+CURSOR_TYPE = 'change_feed_cursor'
+# Change feed documents carry their log sequence number; queries do not, so it is dropped
+FEED_ONLY_FIELDS = ('_lsn',)
+
+
+def encode_cursor(cursor):
+    return encode_continuation(json.dumps(cursor, separators=(',', ':'), sort_keys=True))
+
+
+def decode_cursor(token):
+    """Reverse encode_cursor; None for no token, ValueError for a malformed one."""
+    if not token:
+        return None
+    try:
+        cursor = json.loads(decode_continuation(token))
+    except ValueError as e:
+        raise ValueError("Invalid change feed cursor") from e
+    if not isinstance(cursor, dict) or not isinstance(cursor.get('ranges'), dict) \
+            or not isinstance(cursor.get('ts'), (int, type(None))):
+        raise ValueError("Invalid change feed cursor")
+    return cursor
+
+
+def partition_key_ranges(container):
+    # azure-cosmos 4.7 reads the change feed one partition key range at a time and has no public
+    # call to list them
+    return [pk_range['id'] for pk_range in container.client_connection._ReadPartitionKeyRanges(container.container_link)]
+
+
+class ChangeFeed:
+    """Reads the container's change feed from a cursor, one partition key range after another.
+
+    A cursor holds the feed continuation (an etag) of every range and the newest _ts seen.
+    Ranges that a split created after the cursor was made start from that timestamp, so a
+    split may repeat a few documents but never skips one. Deletions are not in the feed.
+    """
+
+    def __init__(self, container, is_internal=None):
+        self.container = container
+        self.is_internal = is_internal or (lambda document: False)
+        self._ranges = None
+
+    def ranges(self, refresh=False):
+        if self._ranges is None or refresh:
+            self._ranges = partition_key_ranges(self.container)
+        return self._ranges
+
+    def read(self, cursor=None, limit=100):
+        """Return (documents, cursor, more): documents changed after cursor, about limit of them.
+
+        Without a cursor the feed starts from the beginning, i.e. with every current document.
+        more is True when there may be further changes to read right away.
+        """
+        ranges = self.ranges()
+        if cursor is None:
+            cursor = {'ranges': dict.fromkeys(ranges), 'ts': None}
+        else:
+            cursor = {'ranges': dict(cursor['ranges']), 'ts': cursor['ts']}
+        documents = []
+        for range_id in ranges:
+            try:
+                if self._read_range(range_id, cursor, documents, limit):
+                    return documents, cursor, True
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code != 410:
+                    raise
+                # Split: the children are listed from now on and start from the newest timestamp seen
+                logger.info("Partition key range %s is gone; reading its successors", range_id)
+                cursor['ranges'].pop(range_id, None)
+                self.ranges(refresh=True)
+                return documents, cursor, True
+        # Ranges that no longer exist were split; their successors have taken over
+        cursor['ranges'] = {range_id: cursor['ranges'][range_id] for range_id in ranges}
+        return documents, cursor, False
+
+    def _read_range(self, range_id, cursor, documents, limit):
+        options = {}
+        if range_id in cursor['ranges']:
+            continuation = cursor['ranges'][range_id]
+            if continuation is None:
+                options['is_start_from_beginning'] = True
+            else:
+                options['continuation'] = continuation
+        elif cursor['ts'] is not None:
+            options['start_time'] = datetime.fromtimestamp(cursor['ts'], timezone.utc)
+        else:
+            options['is_start_from_beginning'] = True
+        cursor['ranges'].setdefault(range_id, None)
+
+        pages = self.container.query_items_change_feed(partition_key_range_id=range_id,
+                                                       max_item_count=limit, **options).by_page()
+        for page in pages:
+            page = list(page)
+            if not page:
+                break
+            cursor['ranges'][range_id] = pages.continuation_token
+            for document in page:
+                cursor['ts'] = max(cursor['ts'] or 0, document.get('_ts', 0))
+                if not self.is_internal(document):
+                    for field in FEED_ONLY_FIELDS:
+                        document.pop(field, None)
+                    documents.append(document)
+            if len(documents) >= limit:
+                return True
+        return False
+
+
+class MaterializedView:
+    """Every item, decrypted, in process memory, kept up to date from the change feed.
+
+    The first listing builds it; after that a background thread per process applies the
+    changes every poll_interval seconds, so listings neither scan the container nor
+    decrypt. Deletions are not in the change feed: those made through this process apply
+    at once, and a rebuild every rebuild_interval seconds drops the rest.
+
+    An item for which failed(item) is true after decrypting is left out, and the document
+    is decrypted again on every sync until it succeeds or the feed brings a newer version.
+    """
+
+    def __init__(self, feed, decrypt, poll_interval=5, rebuild_interval=600, batch_size=1000, failed=None):
+        self.feed = feed
+        self.decrypt = decrypt
+        self.failed = failed or (lambda item: False)
+        self.poll_interval = poll_interval
+        self.rebuild_interval = rebuild_interval
+        self.batch_size = batch_size
+        # (items by id, listing etags by fields), replaced as a whole so readers see one consistent pair
+        self._state = ({}, {})
+        # Documents, as the feed returned them, whose decrypt failed: id -> document
+        self._retry = {}
+        self._cursor = None
+        self._built_at = None
+        self._synced_at = None
+        self._sync_lock = threading.Lock()
+        self._poller_lock = threading.Lock()
+        self._poller_pid = None
+
+    @property
+    def ready(self):
+        return self._cursor is not None
+
+    def sync(self, rebuild=False):
+        """Apply the changes since the last sync, or read everything again with rebuild. Returns the count."""
+        with self._sync_lock:
+            rebuild = rebuild or self._cursor is None
+            cursor = None if rebuild else self._cursor
+            # Copy on write: listings keep reading the previous dict meanwhile
+            items = {} if rebuild else None
+            pending = {} if rebuild else dict(self._retry)
+            retry = {}
+            applied = 0
+            more = True
+            while more:
+                documents, cursor, more = self.feed.read(cursor, self.batch_size)
+                if documents:
+                    if items is None:
+                        items = dict(self._state[0])
+                    for document in documents:
+                        pending.pop(document['id'], None)
+                    self._apply(items, documents, retry)
+                    applied += len(documents)
+            if pending:
+                if items is None:
+                    items = dict(self._state[0])
+                self._apply(items, list(pending.values()), retry)
+            if items is not None:
+                self._state = (items, {})
+            self._retry = retry
+            self._cursor = cursor
+            self._synced_at = time.monotonic()
+            if rebuild:
+                self._built_at = self._synced_at
+            return applied
+
+    def _apply(self, items, documents, retry):
+        # decrypt may work in place; keep what the feed returned to try again
+        originals = {document['id']: dict(document) for document in documents}
+        for item in self.decrypt(documents):
+            if self.failed(item):
+                items.pop(item['id'], None)
+                retry[item['id']] = originals[item['id']]
+            else:
+                items[item['id']] = item
+                retry.pop(item['id'], None)
+
+    def discard(self, id):
+        with self._sync_lock:
+            self._retry.pop(id, None)
+            if id in self._state[0]:
+                items = dict(self._state[0])
+                del items[id]
+                self._state = (items, {})
+
+    def list(self, fields=None, if_none_match=None):
+        """Versioned list of the items, projected on fields; NOT_MODIFIED while the etag matches."""
+        if self._cursor is None:
+            self.sync()
+        self._ensure_poller()
+        items, etags = self._state
+        key = tuple(fields) if fields is not None else None
+        etag = etags.get(key)
+        if etag is None:
+            etag = etags[key] = list_etag(items.values(), fields)
+        if matches(etag, if_none_match):
+            return Versioned(NOT_MODIFIED, etag)
+        return Versioned([project(dict(item), fields) for item in items.values()], etag)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'items': len(self._state[0]),
+            'ready': self.ready,
+            'failed_decrypts': len(self._retry),
+            'seconds_since_sync': None if self._synced_at is None else round(now - self._synced_at, 3),
+            'seconds_since_rebuild': None if self._built_at is None else round(now - self._built_at, 3),
+        }
+
+    def _ensure_poller(self):
+        # Per process, like the role refresher: workers forked from a preloaded master start their own
+        if self.poll_interval <= 0 or self._poller_pid == os.getpid():
+            return
+        with self._poller_lock:
+            if self._poller_pid != os.getpid():
+                self._poller_pid = os.getpid()
+                threading.Thread(target=self._poll_loop, name='change-feed-view', daemon=True).start()
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                rebuild = self.rebuild_interval > 0 and time.monotonic() - (self._built_at or 0) >= self.rebuild_interval
+                self.sync(rebuild=rebuild)
+            except Exception as e:
+                logger.warning("Change feed sync failed, serving the view as of the last one: %s", e)
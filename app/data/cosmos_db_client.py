@@ -1,13 +1,66 @@
-from azure.cosmos import CosmosClient, exceptions
+from azure.cosmos import exceptions, PartitionKey
+from azure.core import MatchConditions
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+import time
+import logging
 import uuid
-import tenacity
 from ..security.encryption import Encryptor
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
-import base64
+from .cache import create_cache
+from .change_feed import CURSOR_TYPE, ChangeFeed, MaterializedView, decode_cursor, encode_cursor
+from .data_keys import DATA_KEY_TYPE, DataKeyStore
+from .etags import ANY, NOT_MODIFIED, Versioned, list_etag, matches, write_conditions
+from .fields import FieldPolicy, project
+from .retry import cosmos_retry
+from .single_flight import coalesce
+from .key_rotation import (KeyRotationJob, RotationInProgressError, CHECKPOINT_TYPE, new_checkpoint,
+                           load_checkpoint, claim_checkpoint, is_active, describe)
+from .lookups import (LOOKUP_TYPE, USERNAME, ROLE_NAME, ROLE_CATALOG_ID, ROLE_CATALOG_TYPE, ROLE_FIELDS,
+                      lookup_id, new_lookup, new_role_catalog, select)
+from ..clients import get_registry
 from ..models.role import Role
+from ..models.schema import ValidationError
 from ..models.user import User
 
+logger = logging.getLogger(__name__)
+
+
+# Bookkeeping documents that share the container but are never returned as items
+INTERNAL_DOCUMENT_TYPES = [CHECKPOINT_TYPE, LOOKUP_TYPE, ROLE_CATALOG_TYPE, CURSOR_TYPE, DATA_KEY_TYPE]
+LIST_FILTER = "NOT IS_DEFINED(c.type) OR NOT ARRAY_CONTAINS(@internal_types, c.type)"
+LIST_QUERY = f"SELECT * FROM c WHERE {LIST_FILTER}"
+LIST_PARAMETERS = [{"name": "@internal_types", "value": INTERNAL_DOCUMENT_TYPES}]
+
+
+def list_query(fields=None):
+    if fields is None:
+        return LIST_QUERY
+    # 'type' decides which fields are encrypted and '_etag' makes the listing's etag; both are dropped again
+    extra = [field for field in ('type', '_etag') if field not in fields]
+    return f"SELECT {select(fields + extra)} FROM c WHERE {LIST_FILTER}"
+
+
+def is_internal(document):
+    return document.get('type') in INTERNAL_DOCUMENT_TYPES
+
+
+def cursor_id(consumer):
+    return lookup_id(CURSOR_TYPE, consumer)
+
+
+# Only the paths queries filter on are indexed; skipping the encrypted payloads makes writes cheaper
+INDEXING_POLICY = {
+    'indexingMode': 'consistent',
+    'automatic': True,
+    'includedPaths': [{'path': '/type/?'}, {'path': '/username/?'}, {'path': '/name/?'}],
+    'excludedPaths': [{'path': '/*'}, {'path': '/"_etag"/?'}],
+}
+ROLE_CATALOG_UPDATE_ATTEMPTS = 5
+
+BULK_OPERATIONS = ('create', 'upsert', 'delete')
+BULK_SUCCESS_STATUS = {'create': 201, 'upsert': 200, 'delete': 204}
+
 
 class CosmosDBClient:
     def __init__(self, app):
@@ -19,157 +72,570 @@ class CosmosDBClient:
         
         if not all([cosmos_endpoint, database_name, container_name, key_vault_url, key_name]):
             raise ValueError("Missing Cosmos DB or Key Vault configuration")
+
+        self.decrypt_concurrency = int(app.config.get('DECRYPT_CONCURRENCY', 16))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.rotation_page_size = int(app.config.get('KEY_ROTATION_PAGE_SIZE', 100))
+        self.rotation_stale_after = int(app.config.get('KEY_ROTATION_STALE_SECONDS', 300))
+        self.rotation_job = None
+        self._rotation_lock = threading.Lock()
+        self.cache = create_cache(app.config)
+        self.field_policy = FieldPolicy(app.config.get('ENCRYPTED_FIELDS'))
         
         try:
-            credential = DefaultAzureCredential(additionally_allowed_tenants=["*"])
-            secret_client = SecretClient(vault_url=key_vault_url, credential=credential)
-            cosmos_key = secret_client.get_secret('COSMOS-KEY').value
+            registry = get_registry()
+            cosmos_key = registry.get_secret(key_vault_url, 'COSMOS-KEY')
             
-            self.client = CosmosClient(cosmos_endpoint, credential=cosmos_key)
+            self.client = registry.cosmos_client(cosmos_endpoint, cosmos_key)
             self.database = self.client.get_database_client(database_name)
             self.container = self.database.get_container_client(container_name)
-            print("About to initialize Encryptor")
-            self.encryptor = Encryptor(key_vault_url, key_name)
-            print("Encryptor initialized")
-        except Exception as e:
-            print(f"Error initializing CosmosDBClient: {str(e)}")
+            self.encryptor = Encryptor(key_vault_url, key_name, mode=app.config.get('ENCRYPTION_MODE', 'envelope'),
+                                       registry=registry,
+                                       key_version_ttl=app.config.get('KEY_VERSION_REFRESH_SECONDS', 60),
+                                       data_key_store=DataKeyStore(self.container))
+            self.change_feed = ChangeFeed(self.container, is_internal=is_internal)
+            self.view = None
+            if app.config.get('USERS_VIEW_ENABLED', False):
+                self.view = MaterializedView(self.change_feed, self._decrypt_items,
+                                             poll_interval=float(app.config.get('USERS_VIEW_POLL_SECONDS', 5)),
+                                             rebuild_interval=float(app.config.get('USERS_VIEW_REBUILD_SECONDS', 600)),
+                                             failed=self._decrypt_failed)
+        except Exception:
+            logger.exception("Error initializing CosmosDBClient")
             raise
 
     
-    def _decrypt_item(self, item):
-        if 'name' in item:
-            encrypted_name = item['name']
-            print(f"Attempting to decrypt: {encrypted_name}")
+    def _decrypt_item(self, item, fields=None):
+        """Decrypt the item's encrypted fields in place, only those in fields when given."""
+        for field in self.field_policy.encrypted(item, fields):
             try:
-                # Ensure the encrypted name is properly padded
-                padding = 4 - (len(encrypted_name) % 4)
-                if padding:
-                    encrypted_name += '=' * padding
-                
-                decoded_name = base64.b64decode(encrypted_name)
-                decrypted_name = self.encryptor.decrypt(decoded_name)
-                item['name'] = decrypted_name
-                print(f"Successfully decrypted: {decrypted_name}")
+                item[field] = self.encryptor.decrypt(item[field])
             except Exception as decrypt_error:
-                print(f"Error decrypting name for item {item.get('id', 'unknown')}: {str(decrypt_error)}")
+                # Never log the value itself, encrypted or not
+                logger.warning("Could not decrypt %s of item %s: %s", field, item.get('id', 'unknown'),
+                               type(decrypt_error).__name__)
         return item
 
-    @tenacity.retry(
-        wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-        stop=tenacity.stop_after_attempt(5),
-        retry=tenacity.retry_if_exception_type(Exception)
-    )
-    def get_all_items(self):
+    def _encrypt_body(self, body):
+        for field in self.field_policy.encrypted(body):
+            body[field] = self.encryptor.encrypt(body[field])
+        return body
+
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.decrypt_concurrency,
+                                                        thread_name_prefix='cosmos-worker')
+        return self._executor
+
+    def _map_concurrently(self, func, items):
+        """Apply func to every item on the shared bounded pool, keeping input order."""
+        items = list(items)
+        if self.decrypt_concurrency <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        # Each call runs in a copy of the caller's context so the retry deadline and request timings follow it
+        executor = self._get_executor()
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _decrypt_items(self, items, fields=None):
+        if fields is not None:
+            if not any(self.field_policy.encrypted(item, fields) for item in items):
+                return [project(item, fields) for item in items]
+            return [project(item, fields) for item in
+                    self._map_concurrently(lambda item: self._decrypt_item(item, fields), items)]
+        return self._map_concurrently(self._decrypt_item, items)
+
+    def get_all_items(self, fields=None):
+        """All items; with fields, only those are read from Cosmos DB and decrypted."""
+        return self.get_all_items_versioned(fields).value
+
+    @coalesce
+    @cosmos_retry
+    def get_all_items_versioned(self, fields=None, if_none_match=None):
+        """All items and the listing's etag; NOT_MODIFIED, undecrypted, while it matches if_none_match."""
+        if self.view is not None:
+            return self.view.list(fields, if_none_match)
         try:
-            query = "SELECT * FROM c"
-            items = list(self.container.query_items(query=query, enable_cross_partition_query=True))
-            return [self._decrypt_item(item) for item in items]
+            items = list(self.container.query_items(query=list_query(fields), parameters=LIST_PARAMETERS,
+                                                    enable_cross_partition_query=True))
+            etag = list_etag(items, fields)
+            if matches(etag, if_none_match):
+                return Versioned(NOT_MODIFIED, etag)
+            items = self._decrypt_items(items, fields)
+            return Versioned(items, self._listing_etag(items, etag, fields))
         except exceptions.CosmosHttpResponseError as e:
-            print(f"Cosmos DB HTTP Error in get_all_items: {str(e)}")
-            print(f"Status code: {e.status_code}")
-            print(f"Substatus: {e.sub_status}")
-            print(f"Error code: {e.error_code}")
+            logger.error("Cosmos DB HTTP error in get_all_items: %s", e.message,
+                         extra={'status_code': e.status_code, 'sub_status': e.sub_status, 'error_code': e.error_code})
             raise
-        except Exception as e:
-            print(f"Unexpected error in get_all_items: {str(e)}")
-            print(f"Error type: {type(e).__name__}")
+        except Exception:
+            logger.exception("Unexpected error in get_all_items")
             raise
 
-    @tenacity.retry(
-        wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-        stop=tenacity.stop_after_attempt(5),
-        retry=tenacity.retry_if_exception_type(Exception)
-    )
+    def _query_pages(self, page_size, continuation=None, fields=None):
+        return self.container.query_items(
+            query=list_query(fields), parameters=LIST_PARAMETERS, enable_cross_partition_query=True,
+            max_item_count=page_size
+        ).by_page(continuation)
+
+    def get_items_page(self, page_size, continuation=None, fields=None):
+        """Return one decrypted page of items and the continuation token for the next one."""
+        return self.get_items_page_versioned(page_size, continuation, fields).value
+
+    @cosmos_retry
+    def get_items_page_versioned(self, page_size, continuation=None, fields=None, if_none_match=None):
+        """(items, continuation) of one page and the page's etag; NOT_MODIFIED while it matches if_none_match."""
+        pages = self._query_pages(page_size, continuation, fields)
+        items = list(next(pages, []))
+        etag = list_etag(items, fields, page_size, continuation, pages.continuation_token)
+        if matches(etag, if_none_match):
+            return Versioned(NOT_MODIFIED, etag)
+        items = self._decrypt_items(items, fields)
+        return Versioned((items, pages.continuation_token), self._listing_etag(items, etag, fields))
+
+    def iter_item_pages(self, page_size, continuation=None, fields=None):
+        """Yield decrypted pages one at a time so callers never hold more than one page."""
+        for page in self._query_pages(page_size, continuation, fields):
+            yield self._decrypt_items(list(page), fields)
+
+    @coalesce.writes
+    @cosmos_retry
     def create_item(self, item):
-        if 'id' not in item:
-            item['id'] = str(uuid.uuid4())
-        if 'name' in item:
-            item['name'] = self.encryptor.encrypt(item['name'])
-        return self.container.create_item(body=item)
-
-    @tenacity.retry(
-        wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-        stop=tenacity.stop_after_attempt(5),
-        retry=tenacity.retry_if_exception_type(Exception)
-    )
-    def get_item(self, id):
+        # Encrypt into a copy so a retried attempt starts again from the plaintext
+        body = dict(item)
+        body.setdefault('id', str(uuid.uuid4()))
+        return self.container.create_item(body=self._encrypt_body(body))
+
+    def get_item(self, id, fields=None):
+        """Point-read one item; with fields, only the encrypted fields among them are decrypted."""
+        return self.get_item_versioned(id, fields).value
+
+    @coalesce
+    @cosmos_retry
+    def get_item_versioned(self, id, fields=None, if_none_match=None):
+        """Point-read one item and its etag; None if it does not exist, NOT_MODIFIED while the
+        etag matches if_none_match (a set from parse_if_none_match), without decrypting anything.
+
+        The etag is None when a field could not be decrypted: such a result is cached nowhere.
+        """
+        if self.cache is None:
+            return self._read_item(id, fields, if_none_match)
+        cached = self.cache.get(id)
+        if cached is not None and cached.fresh:
+            if matches(cached.etag, if_none_match):
+                return Versioned(NOT_MODIFIED, cached.etag)
+            return self._from_cache(cached, fields)
+        try:
+            if cached is not None and cached.etag:
+                # Conditional read: Cosmos answers 304 with no body while the etag still matches
+                item = self.container.read_item(item=id, partition_key=id, etag=cached.etag,
+                                                match_condition=MatchConditions.IfModified)
+                if not item:
+                    self.cache.revalidated(id, cached)
+                    if matches(cached.etag, if_none_match):
+                        return Versioned(NOT_MODIFIED, cached.etag)
+                    return self._from_cache(cached, fields)
+            else:
+                return self._read_item(id, fields, if_none_match, cache=True)
+        except exceptions.CosmosResourceNotFoundError:
+            self.cache.delete(id)
+            return Versioned(None, None)
+        return self._decrypted(item, fields, if_none_match, cache=True)
+
+    def _read_item(self, id, fields=None, if_none_match=None, cache=False):
+        try:
+            if if_none_match is not None and len(if_none_match) == 1 and ANY not in if_none_match:
+                # The client's own etag: Cosmos answers 304 with no body, and no RUs for one, while it matches
+                etag = next(iter(if_none_match))
+                item = self.container.read_item(item=id, partition_key=id, etag=etag,
+                                                match_condition=MatchConditions.IfModified)
+                if not item:
+                    return Versioned(NOT_MODIFIED, etag)
+            else:
+                item = self.container.read_item(item=id, partition_key=id)
+        except exceptions.CosmosResourceNotFoundError:
+            if cache:
+                self.cache.delete(id)
+            return Versioned(None, None)
+        return self._decrypted(item, fields, if_none_match, cache)
+
+    def _decrypted(self, item, fields, if_none_match, cache):
+        etag = item.get('_etag')
+        if cache and not self.cache.stores_plaintext:
+            self.cache.set(item['id'], dict(item), etag=etag)
+        if matches(etag, if_none_match):
+            return Versioned(NOT_MODIFIED, etag)
+        if not cache:
+            for field in self.field_policy.encrypted(item, fields):
+                item[field] = self.encryptor.decrypt(item[field])
+            return self._checked(item, etag, fields)
+        complete = self.field_policy.covers(item, fields)
+        item = self._decrypt_item(item, fields)
+        failed = self._decrypt_failed(item, fields)
+        if self.cache.stores_plaintext and complete and not failed:
+            # A plaintext cache only takes fully decrypted items, so nothing it holds is ever an
+            # error message that revalidation would keep serving until the document changes
+            self.cache.set(item['id'], dict(item), etag=etag)
+        return Versioned(project(item, fields), None if failed else etag)
+
+    def _from_cache(self, cached, fields=None):
+        item = dict(cached.value)
+        if not self.cache.stores_plaintext:
+            item = self._decrypt_item(item, fields)
+        return self._checked(item, cached.etag, fields)
+
+    def _decrypt_failed(self, item, fields=None):
+        return any(Encryptor.is_decryption_error(item[field]) for field in self.field_policy.encrypted(item, fields))
+
+    def _listing_etag(self, items, etag, fields=None):
+        # Like a point read's: no etag, and so no cached encoded body, when anything failed to decrypt
+        return None if any(self._decrypt_failed(item, fields) for item in items) else etag
+
+    def _checked(self, item, etag, fields=None):
+        """Versioned projection of a decrypted item, without an etag if any field failed to decrypt."""
+        return Versioned(project(item, fields), None if self._decrypt_failed(item, fields) else etag)
+
+    def invalidate_cache(self, id=None):
+        """Drop one cached item, or every cached item when id is None."""
+        if self.cache is not None:
+            if id is None:
+                self.cache.clear()
+            else:
+                self.cache.delete(id)
+
+    def get_cache_stats(self):
+        return self.cache.get_stats() if self.cache is not None else None
+
+    @staticmethod
+    def get_retry_stats():
+        return cosmos_retry.stats.as_dict()
+
+    @staticmethod
+    def get_coalescing_stats():
+        return coalesce.stats.as_dict()
+
+    @coalesce.writes
+    @cosmos_retry
+    def update_item(self, item, if_match=None):
+        """Upsert item; with if_match (an etag or ANY) replace it only if it exists and still matches.
+
+        A stale etag raises CosmosAccessConditionFailedError, a missing item CosmosResourceNotFoundError.
+        """
+        body = self._encrypt_body(dict(item))
         try:
-            item = self.container.read_item(item=id, partition_key=id)
-            if 'name' in item:
-                item['name'] = self.encryptor.decrypt(item['name'])
-            return item
+            if if_match is None:
+                return self.container.upsert_item(body=body)
+            return self.container.replace_item(item=body['id'], body=body, **write_conditions(if_match))
+        finally:
+            self.invalidate_cache(body.get('id'))
+
+    @coalesce.writes
+    @cosmos_retry
+    def delete_item(self, id, if_match=None):
+        try:
+            self.container.delete_item(item=id, partition_key=id, **write_conditions(if_match))
+        finally:
+            self.invalidate_cache(id)
+        if self.view is not None:
+            self.view.discard(id)
+
+    # Change feed
+
+    @cosmos_retry
+    def read_changes(self, cursor=None, limit=100, fields=None):
+        """Items created or changed after cursor, decrypted: (items, cursor, more).
+
+        cursor is a token from an earlier call, None to start with every item; pass the
+        returned one next time. more means further changes can be read right away. Deleted
+        items are not reported (the Cosmos DB change feed does not carry deletions).
+        """
+        documents, cursor, more = self.change_feed.read(decode_cursor(cursor), limit)
+        return self._decrypt_items(documents, fields), encode_cursor(cursor), more
+
+    def load_change_feed_cursor(self, consumer):
+        """The cursor a named consumer last acknowledged, or None."""
+        try:
+            return self.container.read_item(item=cursor_id(consumer), partition_key=cursor_id(consumer))['cursor']
         except exceptions.CosmosResourceNotFoundError:
             return None
 
-    @tenacity.retry(
-        wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-        stop=tenacity.stop_after_attempt(5),
-        retry=tenacity.retry_if_exception_type(Exception)
-    )
-    def update_item(self, item):
-        if 'name' in item:
-            item['name'] = self.encryptor.encrypt(item['name'])
-        return self.container.upsert_item(body=item)
-
-    @tenacity.retry(
-        wait=tenacity.wait_exponential(multiplier=1, min=4, max=10),
-        stop=tenacity.stop_after_attempt(5),
-        retry=tenacity.retry_if_exception_type(Exception)
-    )
-    def delete_item(self, id):
-        self.container.delete_item(item=id, partition_key=id)
+    @cosmos_retry
+    def save_change_feed_cursor(self, consumer, cursor):
+        self.container.upsert_item(body={'id': cursor_id(consumer), 'type': CURSOR_TYPE, 'consumer': consumer,
+                                         'cursor': cursor, 'updated_at': time.time()})
+
+    def get_view_stats(self):
+        return self.view.stats() if self.view is not None else None
+
+
+    @coalesce.writes
+    def bulk_write(self, operation, items):
+        """Apply one operation ('create', 'upsert' or 'delete') to many items.
+
+        Names are encrypted up front on the shared pool, into copies of the items. Every item
+        is its own point operation, written concurrently on the same pool, so throughput is
+        bounded by the container's RUs rather than by round trips. The container is
+        partitioned on /id, so only operations on the same id could share a transactional
+        batch; those are instead written one after another, in input order. Returns one
+        result dict per input item, in input order.
+        """
+        if operation not in BULK_OPERATIONS:
+            raise ValueError(f"Unknown bulk operation: {operation}")
+        results = [None] * len(items)
+        bodies = {}
+        for index, item in enumerate(items):
+            if operation == 'delete' and isinstance(item, str):
+                item = {'id': item}
+            if not isinstance(item, dict) or (operation != 'create' and not item.get('id')):
+                results[index] = {'index': index, 'id': None, 'status': 400, 'error': "Each item needs an 'id'"}
+                continue
+            if operation != 'delete':
+                try:
+                    User.schema.validate(item)
+                except ValidationError as e:
+                    results[index] = {'index': index, 'id': item.get('id'), 'status': 400, 'error': str(e)}
+                    continue
+            body = {'id': item['id']} if operation == 'delete' else dict(item)
+            body.setdefault('id', str(uuid.uuid4()))
+            bodies[index] = body
+        if operation != 'delete':
+            bodies = dict(zip(bodies, self._map_concurrently(self._encrypt_body, bodies.values())))
 
+        groups = {}
+        for index, body in bodies.items():
+            groups.setdefault(body['id'], []).append(index)
+
+        def write(indices):
+            return [self._write_one(operation, bodies[index]) for index in indices]
+
+        for indices, group_results in zip(groups.values(), self._map_concurrently(write, groups.values())):
+            for index, result in zip(indices, group_results):
+                results[index] = dict(result, index=index)
+        if operation != 'create':
+            for id in groups:
+                self.invalidate_cache(id)
+        if operation == 'delete' and self.view is not None:
+            for result in results:
+                if result['status'] == BULK_SUCCESS_STATUS['delete']:
+                    self.view.discard(result['id'])
+        return results
+
+    def _write_one(self, operation, body):
+        try:
+            if operation == 'delete':
+                self.container.delete_item(item=body['id'], partition_key=body['id'])
+                return {'id': body['id'], 'status': BULK_SUCCESS_STATUS[operation]}
+            written = getattr(self.container, f'{operation}_item')(body=body)
+            return {'id': body['id'], 'status': BULK_SUCCESS_STATUS[operation], 'etag': written.get('_etag')}
+        except exceptions.CosmosHttpResponseError as e:
+            return {'id': body['id'], 'status': e.status_code or 500, 'error': e.reason or str(e)}
 
     def re_encrypt_all_items(self):
-        query = "SELECT * FROM c"
-        items = list(self.container.query_items(query=query, enable_cross_partition_query=True))
-        for item in items:
-            if 'name' in item:
-                decrypted_name = self.encryptor.decrypt(item['name'])
-                item['name'] = self.encryptor.encrypt(decrypted_name)
-                self.container.upsert_item(body=item)
+        """Re-encrypt every item onto the current key version in the calling thread."""
+        state = new_checkpoint(self.encryptor.current_key_version)
+        return KeyRotationJob(self, state, self.rotation_page_size).run()
 
     def rotate_encryption_key(self):
         new_version = self.encryptor.rotate_key()
+        self.invalidate_cache()
         self.re_encrypt_all_items()
         return new_version
+
+    def start_key_rotation(self, rotate=True, resume=True):
+        """Start re-encryption in a background thread and return its initial status.
+
+        An unfinished rotation is resumed from its checkpoint, onto the key version it
+        started (which this worker switches to), instead of creating yet another key
+        version. Raises RotationInProgressError while another job (in this or any other
+        worker) is still heartbeating.
+        """
+        with self._rotation_lock:
+            if self.rotation_job is not None and self.rotation_job.is_running():
+                raise RotationInProgressError("A key rotation is already running")
+            checkpoint = load_checkpoint(self.container)
+            if is_active(checkpoint, self.rotation_stale_after):
+                raise RotationInProgressError("A key rotation is already running")
+            resumable = (resume and checkpoint is not None and checkpoint['status'] != 'completed'
+                         and checkpoint.get('target_version') is not None)
+            if resumable:
+                # Possibly created by a worker that died since; new writes must go to it as well
+                self.encryptor.use_key_version(checkpoint['target_version'])
+                state = dict(checkpoint, status='pending', updated_at=time.time())
+            else:
+                state = dict(new_checkpoint(self.encryptor.current_key_version), updated_at=time.time())
+            claim_checkpoint(self.container, checkpoint, state)
+            if not resumable and rotate:
+                try:
+                    state['target_version'] = self.encryptor.rotate_key()
+                except Exception as e:
+                    state.update(status='failed', error=str(e), updated_at=time.time())
+                    self.container.upsert_item(body=state)
+                    raise
+            self.invalidate_cache()
+            self.rotation_job = KeyRotationJob(self, state, self.rotation_page_size).start()
+            return describe(state)
+
+    def get_key_rotation_status(self):
+        if self.rotation_job is not None and self.rotation_job.is_running():
+            return describe(self.rotation_job.state)
+        checkpoint = load_checkpoint(self.container)
+        return describe(checkpoint) if checkpoint else None
     
 
+    def _point_read(self, id):
+        try:
+            return self.container.read_item(item=id, partition_key=id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+
+    def _delete_quietly(self, id):
+        try:
+            self.container.delete_item(item=id, partition_key=id)
+        except exceptions.CosmosResourceNotFoundError:
+            pass
+
+    def _claim_lookup(self, kind, value, target_id):
+        """Create the lookup for a unique value; raises CosmosResourceExistsError if another document holds it."""
+        lookup = new_lookup(kind, value, target_id)
+        try:
+            self.container.create_item(body=lookup)
+        except exceptions.CosmosResourceExistsError:
+            existing = self._point_read(lookup['id'])
+            # A retried write finds its own lookup; a lookup whose target is gone is stale and reclaimed
+            if existing is None or existing.get('target') == target_id or self._point_read(existing['target']) is None:
+                self.container.upsert_item(body=lookup)
+            else:
+                raise
+        return lookup['id']
+
+    def _resolve(self, kind, value, document_type, field):
+        lookup = self._point_read(lookup_id(kind, value))
+        if lookup is None:
+            return None
+        item = self._point_read(lookup['target'])
+        # The lookup can outlive or predate its target when a write failed half-way
+        if item is None or item.get('type') != document_type or item.get(field) != value:
+            return None
+        return item
+
+    def _query_roles(self):
+        query = f"SELECT {select(ROLE_FIELDS)} FROM c WHERE c.type = 'role'"
+        return list(self.container.query_items(query=query, enable_cross_partition_query=True))
+
+    def _update_role_catalog(self, change):
+        """Apply change(roles) to the role catalog with optimistic concurrency."""
+        for _ in range(ROLE_CATALOG_UPDATE_ATTEMPTS):
+            catalog = self._point_read(ROLE_CATALOG_ID)
+            try:
+                if catalog is None:
+                    catalog = new_role_catalog(self._query_roles())
+                    change(catalog['roles'])
+                    self.container.create_item(body=catalog)
+                else:
+                    change(catalog['roles'])
+                    self.container.replace_item(item=ROLE_CATALOG_ID, body=catalog, etag=catalog['_etag'],
+                                                match_condition=MatchConditions.IfNotModified)
+                return
+            except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceExistsError):
+                continue
+        # Readers fall back to querying the roles, so a lost update only costs RUs until the next write
+        self._delete_quietly(ROLE_CATALOG_ID)
+
+    @coalesce
     def get_all_roles(self):
-        query = "SELECT * FROM c WHERE c.type = 'role'"
-        items = list(self.container.query_items(query=query, enable_cross_partition_query=True))
-        return [Role.from_dict(item) for item in items]
+        catalog = self._point_read(ROLE_CATALOG_ID)
+        if catalog is not None:
+            return [Role(role['name'], role['permissions'], id=role_id) for role_id, role in catalog['roles'].items()]
+        roles = self._query_roles()
+        try:
+            self.container.create_item(body=new_role_catalog(roles))
+        except exceptions.CosmosResourceExistsError:
+            pass
+        return Role.from_dicts(roles)
 
+    @coalesce.writes
     def create_role(self, role):
         role_dict = role.to_dict()
         role_dict['type'] = 'role'  # Add a type field to distinguish roles from other documents
-        created_item = self.container.create_item(body=role_dict)
+        self._claim_lookup(ROLE_NAME, role.name, role.id)
+        try:
+            created_item = self.container.create_item(body=role_dict)
+        except Exception:
+            self._delete_quietly(lookup_id(ROLE_NAME, role.name))
+            raise
+        self._update_role_catalog(lambda roles: roles.update({role.id: {'name': role.name,
+                                                                        'permissions': role.permissions}}))
         return Role.from_dict(created_item)
 
+    @coalesce
     def get_role_by_name(self, name):
-        query = f"SELECT * FROM c WHERE c.type = 'role' AND c.name = @name"
-        parameters = [{"name": "@name", "value": name}]
-        items = list(self.container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
-        return Role.from_dict(items[0]) if items else None
+        item = self._resolve(ROLE_NAME, name, 'role', 'name')
+        return Role.from_dict(item) if item else None
 
+    @coalesce.writes
     def update_role(self, role):
         role_dict = role.to_dict()
         role_dict['type'] = 'role'
+        previous = self._point_read(role.id)
+        renamed = previous is not None and previous.get('name') != role.name
+        if previous is None or renamed:
+            self._claim_lookup(ROLE_NAME, role.name, role.id)
         updated_item = self.container.upsert_item(body=role_dict)
+        if renamed:
+            self._delete_quietly(lookup_id(ROLE_NAME, previous['name']))
+        self._update_role_catalog(lambda roles: roles.update({role.id: {'name': role.name,
+                                                                        'permissions': role.permissions}}))
         return Role.from_dict(updated_item)
 
+    @coalesce.writes
     def delete_role(self, role_id):
+        previous = self._point_read(role_id)
         self.container.delete_item(item=role_id, partition_key=role_id)
+        if previous is not None:
+            self._delete_quietly(lookup_id(ROLE_NAME, previous['name']))
+        self._update_role_catalog(lambda roles: roles.pop(role_id, None))
 
     # Update user-related methods to handle roles
+    @coalesce.writes
     def create_user(self, user):
+        """Create a user; usernames are unique, a taken one raises CosmosResourceExistsError."""
         user_dict = user.to_dict()
         user_dict['type'] = 'user'  # Add a type field to distinguish users from other documents
-        created_item = self.container.create_item(body=user_dict)
+        self._claim_lookup(USERNAME, user.username, user.id)
+        try:
+            created_item = self.container.create_item(body=user_dict)
+        except Exception:
+            self._delete_quietly(lookup_id(USERNAME, user.username))
+            raise
         return User.from_dict(created_item)
 
+    @coalesce
     def get_user_by_username(self, username):
-        query = f"SELECT * FROM c WHERE c.type = 'user' AND c.username = @username"
-        parameters = [{"name": "@username", "value": username}]
-        items = list(self.container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
-        return User.from_dict(items[0]) if items else None
+        item = self._resolve(USERNAME, username, 'user', 'username')
+        return User.from_dict(item) if item else None
+
+    @coalesce.writes
+    def rebuild_lookups(self):
+        """Write the lookup documents and the role catalog for users and roles that predate them."""
+        users = self.container.query_items(query=f"SELECT {select(('id', 'username'))} FROM c WHERE c.type = 'user'",
+                                           enable_cross_partition_query=True)
+        user_count = 0
+        for user in users:
+            self.container.upsert_item(body=new_lookup(USERNAME, user['username'], user['id']))
+            user_count += 1
+        roles = self._query_roles()
+        for role in roles:
+            self.container.upsert_item(body=new_lookup(ROLE_NAME, role['name'], role['id']))
+        self.container.upsert_item(body=new_role_catalog(roles))
+        return {'users': user_count, 'roles': len(roles)}
+
+    def apply_indexing_policy(self, indexing_policy=None):
+        """Replace the container's indexing policy; Cosmos re-indexes in the background."""
+        self.container = self.database.replace_container(
+            self.container, partition_key=PartitionKey(path='/id'),
+            indexing_policy=indexing_policy or INDEXING_POLICY
+        )
+        return self.container.read()['indexingPolicy']
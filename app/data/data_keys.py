@@ -0,0 +1,62 @@
+import base64
+from azure.cosmos import exceptions
+from .lookups import lookup_id
+
+# One document per key version holding the wrapped envelope data key, e.g.
+# {'id': 'data_key:<version>', 'type': 'data_key', 'version': '<version>', 'wrapped_key': '<base64>'}.
+# Every worker encrypts with the same data key, so a reader unwraps one key per version
+# instead of one per worker that ever wrote.
+DATA_KEY_TYPE = 'data_key'
+
+
+def data_key_id(version):
+    return lookup_id(DATA_KEY_TYPE, version)
+
+
+def new_data_key(version, wrapped_key):
+    return {'id': data_key_id(version), 'type': DATA_KEY_TYPE, 'version': version,
+            'wrapped_key': base64.b64encode(wrapped_key).decode()}
+
+
+class DataKeyStore:
+    """Wrapped data keys kept in the Cosmos container, for Encryptor."""
+
+    def __init__(self, container):
+        self.container = container
+
+    def get(self, version):
+        """The wrapped data key of a key version, or None if no worker has stored one yet."""
+        try:
+            document = self.container.read_item(item=data_key_id(version), partition_key=data_key_id(version))
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        return base64.b64decode(document['wrapped_key'])
+
+    def add(self, version, wrapped_key):
+        """Store wrapped_key unless another worker got there first; return the one that is stored."""
+        try:
+            self.container.create_item(body=new_data_key(version, wrapped_key))
+            return wrapped_key
+        except exceptions.CosmosResourceExistsError:
+            return self.get(version)
+
+
+class AsyncDataKeyStore:
+    """DataKeyStore for an azure.cosmos.aio container, for AsyncEncryptor."""
+
+    def __init__(self, container):
+        self.container = container
+
+    async def get(self, version):
+        try:
+            document = await self.container.read_item(item=data_key_id(version), partition_key=data_key_id(version))
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        return base64.b64decode(document['wrapped_key'])
+
+    async def add(self, version, wrapped_key):
+        try:
+            await self.container.create_item(body=new_data_key(version, wrapped_key))
+            return wrapped_key
+        except exceptions.CosmosResourceExistsError:
+            return await self.get(version)
@@ -0,0 +1,63 @@
+import hashlib
+import json
+from collections import namedtuple
+from azure.core import MatchConditions
+
+# A read and the etag of what it returned; value is NOT_MODIFIED when If-None-Match matched,
+# in which case nothing was decrypted
+Versioned = namedtuple('Versioned', ['value', 'etag'])
+NOT_MODIFIED = object()
+ANY = '*'
+
+
+def parse_if_none_match(header):
+    """If-None-Match -> set of entity tags in Cosmos DB's quoted form, {ANY}, or None without one.
+
+    GET compares weakly, so W/ prefixes are dropped.
+    """
+    if header is None or not header.strip():
+        return None
+    tags = set()
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == ANY:
+            return {ANY}
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag:
+            tags.add(tag)
+    return tags
+
+
+def parse_if_match(header):
+    """If-Match -> one entity tag, ANY, or None without one.
+
+    Cosmos DB checks a single etag per write, so a list of several is refused with ValueError.
+    Weak tags are passed on as they are and never match, since writes compare strongly.
+    """
+    if header is None or not header.strip():
+        return None
+    tags = [tag.strip() for tag in header.split(',') if tag.strip()]
+    if len(tags) != 1:
+        raise ValueError("If-Match takes a single entity tag or *")
+    return tags[0]
+
+
+def matches(etag, tags):
+    return etag is not None and tags is not None and (ANY in tags or etag in tags)
+
+
+def list_etag(items, *parts):
+    """Entity tag of a listing: changes whenever an item, the set of items or parts (fields, page) change."""
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode())
+    for item in items:
+        digest.update(f"{item.get('id')}\x00{item.get('_etag')}\x01".encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def write_conditions(if_match):
+    """Keyword arguments that make a Cosmos DB replace or delete conditional on if_match."""
+    # ANY only needs the item to exist, which replace and delete check anyway
+    if if_match is None or if_match == ANY:
+        return {}
+    return {'etag': if_match, 'match_condition': MatchConditions.IfNotModified}
@@ -0,0 +1,59 @@
+import re
+
+# Documents without a 'type' are the items served by /api/users
+ITEM_TYPE = 'item'
+DEFAULT_ENCRYPTED_FIELDS = {ITEM_TYPE: ['name']}
+
+FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def path(field):
+    """Query reference to a field: c["value"], since c.value is a syntax error for reserved words."""
+    return f'c["{field}"]'
+
+
+def parse_fields(value):
+    """'id,email' -> ['id', 'email']; None when no projection was asked for.
+
+    Names end up in a query's SELECT list, so anything but plain identifiers is refused.
+    """
+    if value is None:
+        return None
+    fields = []
+    for field in value.split(','):
+        field = field.strip()
+        if not FIELD_NAME.match(field):
+            raise ValueError(f"Invalid field name: {field!r}")
+        if field not in fields:
+            fields.append(field)
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+class FieldPolicy:
+    """Which fields are stored encrypted, per document type."""
+
+    def __init__(self, encrypted_fields=None):
+        encrypted_fields = DEFAULT_ENCRYPTED_FIELDS if encrypted_fields is None else encrypted_fields
+        for doc_type, fields in encrypted_fields.items():
+            # Both end up in query text (key rotation), so only plain identifiers are accepted
+            if not all(FIELD_NAME.match(name) for name in (doc_type, *fields)):
+                raise ValueError(f"Invalid encrypted fields for {doc_type!r}: {fields!r}")
+        self.encrypted_fields = {doc_type: tuple(fields) for doc_type, fields in encrypted_fields.items()}
+
+    def encrypted(self, document, fields=None):
+        """Encrypted fields present in document, limited to fields when given."""
+        return [field for field in self.encrypted_fields.get(document.get('type', ITEM_TYPE), ())
+                if field in document and (fields is None or field in fields)]
+
+    def covers(self, document, fields):
+        """True if a projection on fields includes every encrypted field of the document."""
+        return fields is None or all(field in fields
+                                     for field in self.encrypted_fields.get(document.get('type', ITEM_TYPE), ()))
+
+
+def project(document, fields):
+    if fields is None:
+        return document
+    return {field: document[field] for field in fields if field in document}
@@ -0,0 +1,196 @@
+import threading
+import logging
+import time
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from ..security.encryption import Encryptor
+from .fields import ITEM_TYPE, path
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_ID = 'key-rotation-checkpoint'
+CHECKPOINT_TYPE = 'key_rotation'
+
+
+def pending_filter(field_policy):
+    """Query filter for documents with an encrypted field not yet on the target key version."""
+    clauses = []
+    for doc_type, fields in sorted(field_policy.encrypted_fields.items()):
+        if not fields:
+            continue
+        stale = ' OR '.join(f"(IS_DEFINED({path(field)}) AND NOT ENDSWITH({path(field)}, @suffix))"
+                            for field in fields)
+        of_type = "NOT IS_DEFINED(c.type)" if doc_type == ITEM_TYPE else f"c.type = '{doc_type}'"
+        clauses.append(f"({of_type} AND ({stale}))")
+    return ' OR '.join(clauses) or 'false'
+
+
+class RotationInProgressError(Exception):
+    pass
+
+
+def new_checkpoint(target_version=None):
+    return {
+        'id': CHECKPOINT_ID,
+        'type': CHECKPOINT_TYPE,
+        'target_version': target_version,
+        'status': 'pending',
+        'continuation': None,
+        'total': None,
+        'processed': 0,
+        'skipped': 0,
+        'failed': 0,
+        'started_at': None,
+        'run_started_at': None,
+        'run_start_done': 0,
+        'updated_at': None,
+        'completed_at': None,
+        'error': None
+    }
+
+
+def load_checkpoint(container):
+    try:
+        return container.read_item(item=CHECKPOINT_ID, partition_key=CHECKPOINT_ID)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+
+def claim_checkpoint(container, existing, state):
+    """Write state over the existing checkpoint, failing if another worker got there first."""
+    state = {k: v for k, v in state.items() if not k.startswith('_')}
+    try:
+        if existing is None:
+            return container.create_item(body=state)
+        return container.replace_item(item=CHECKPOINT_ID, body=state,
+                                      etag=existing['_etag'], match_condition=MatchConditions.IfNotModified)
+    except (exceptions.CosmosResourceExistsError, exceptions.CosmosAccessConditionFailedError):
+        raise RotationInProgressError("Another key rotation was started concurrently")
+
+
+def is_active(checkpoint, stale_after):
+    """A running checkpoint counts as active until its heartbeat is older than stale_after seconds."""
+    return (checkpoint is not None and checkpoint.get('status') in ('pending', 'running')
+            and time.time() - (checkpoint.get('updated_at') or 0) < stale_after)
+
+
+def describe(checkpoint):
+    """Summarize a checkpoint with throughput and ETA for the status endpoint."""
+    done = checkpoint['processed'] + checkpoint['skipped'] + checkpoint['failed']
+    elapsed = (checkpoint.get('updated_at') or 0) - (checkpoint.get('run_started_at') or 0)
+    rate = (done - checkpoint.get('run_start_done', 0)) / elapsed if elapsed > 0 else 0.0
+    total = checkpoint.get('total')
+    remaining = max(total - done, 0) if total is not None else None
+    if checkpoint['status'] == 'completed':
+        remaining = 0
+    eta = remaining / rate if rate > 0 and remaining is not None else None
+    return {
+        'target_version': checkpoint['target_version'],
+        'status': checkpoint['status'],
+        'total': total,
+        'processed': checkpoint['processed'],
+        'skipped': checkpoint['skipped'],
+        'failed': checkpoint['failed'],
+        'remaining': remaining,
+        'items_per_second': round(rate, 2),
+        'eta_seconds': round(eta, 1) if eta is not None else None,
+        'started_at': checkpoint.get('started_at'),
+        'updated_at': checkpoint.get('updated_at'),
+        'completed_at': checkpoint.get('completed_at'),
+        'error': checkpoint.get('error')
+    }
+
+
+class KeyRotationJob:
+    """Re-encrypts every encrypted document onto state['target_version'].
+
+    Items are streamed page by page and re-encrypted in parallel on the client's worker
+    pool. After each page the query continuation token and counters are written to the
+    checkpoint document, so a job that dies (worker recycled, deploy) resumes from there.
+    """
+
+    def __init__(self, cosmos_client, state, page_size=100):
+        self.cosmos_client = cosmos_client
+        self.container = cosmos_client.container
+        self.encryptor = cosmos_client.encryptor
+        self.state = state
+        self.page_size = page_size
+        self.field_policy = cosmos_client.field_policy
+        self.pending_filter = pending_filter(self.field_policy)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='key-rotation', daemon=True)
+        self._thread.start()
+        return self
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _pending_parameters(self):
+        return [{"name": "@suffix", "value": f"|{self.state['target_version']}"}]
+
+    def _count_pending(self):
+        query = f"SELECT VALUE COUNT(1) FROM c WHERE {self.pending_filter}"
+        result = list(self.container.query_items(query=query, parameters=self._pending_parameters(),
+                                                 enable_cross_partition_query=True))
+        return sum(result)
+
+    def _save(self):
+        self.state['updated_at'] = time.time()
+        self.container.upsert_item(body={k: v for k, v in self.state.items() if not k.startswith('_')})
+
+    def _re_encrypt(self, item):
+        stale = [field for field in self.field_policy.encrypted(item)
+                 if Encryptor.key_version_of(item[field]) not in (None, self.state['target_version'])]
+        if not stale:
+            return 'skipped'
+        for field in stale:
+            plaintext = self.encryptor.decrypt(item[field])
+            if Encryptor.is_decryption_error(plaintext):
+                return 'failed'
+            item[field] = self.encryptor.encrypt(plaintext)
+        try:
+            # Leave the item alone if it was written or removed while we worked on it
+            self.container.replace_item(item=item['id'], body=item, etag=item.get('_etag'),
+                                        match_condition=MatchConditions.IfNotModified)
+        except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+            return 'skipped'
+        except Exception as e:
+            logger.error("Error re-encrypting item %s: %s", item.get('id', 'unknown'), e)
+            return 'failed'
+        return 'processed'
+
+    def run(self):
+        state = self.state
+        now = time.time()
+        state['status'] = 'running'
+        state['error'] = None
+        state['started_at'] = state.get('started_at') or now
+        state['run_started_at'] = now
+        state['run_start_done'] = state['processed'] + state['skipped'] + state['failed']
+        try:
+            if state['total'] is None:
+                state['total'] = self._count_pending()
+            self._save()
+            query = f"SELECT * FROM c WHERE {self.pending_filter}"
+            pages = self.container.query_items(
+                query=query, parameters=self._pending_parameters(),
+                enable_cross_partition_query=True, max_item_count=self.page_size
+            ).by_page(state['continuation'])
+            for page in pages:
+                for outcome in self.cosmos_client._map_concurrently(self._re_encrypt, list(page)):
+                    state[outcome] += 1
+                state['continuation'] = pages.continuation_token
+                self._save()
+            state['status'] = 'completed'
+            state['completed_at'] = time.time()
+        except Exception as e:
+            logger.exception("Key rotation to version %s failed", state['target_version'])
+            state['status'] = 'failed'
+            state['error'] = str(e)
+        try:
+            self._save()
+        except Exception as e:
+            logger.error("Could not save key rotation checkpoint: %s", e)
+        return describe(state)
@@ -0,0 +1,34 @@
+from urllib.parse import quote
+from .fields import path
+
+# Lookup documents map a unique value to the id of the document holding it, e.g.
+# {'id': 'username:alice', 'type': 'lookup', 'target': '<user id>'}. The partition key is the
+# id, so resolving a username or role name is two point reads instead of a cross-partition query.
+LOOKUP_TYPE = 'lookup'
+USERNAME = 'username'
+ROLE_NAME = 'role-name'
+
+# One document listing every role, so loading all roles is a single point read
+ROLE_CATALOG_ID = 'role-catalog'
+ROLE_CATALOG_TYPE = 'role_catalog'
+
+ROLE_FIELDS = ('id', 'name', 'permissions')
+
+
+def lookup_id(kind, value):
+    # '/', '\', '?' and '#' are not allowed in Cosmos ids
+    return f"{kind}:{quote(str(value), safe='')}"
+
+
+def new_lookup(kind, value, target_id):
+    return {'id': lookup_id(kind, value), 'type': LOOKUP_TYPE, 'kind': kind, 'target': target_id}
+
+
+def new_role_catalog(roles):
+    return {'id': ROLE_CATALOG_ID, 'type': ROLE_CATALOG_TYPE,
+            'roles': {role['id']: {'name': role['name'], 'permissions': role['permissions']} for role in roles}}
+
+
+def select(fields):
+    """Projection list for a query: ('id', 'name') -> 'c["id"], c["name"]'"""
+    return ', '.join(path(field) for field in fields)
@@ -0,0 +1,188 @@
+import contextvars
+import functools
+import inspect
+import random
+import threading
+import time
+from contextlib import contextmanager
+import tenacity
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from azure.cosmos.documents import ConnectionPolicy, RetryOptions
+
+# Statuses that can succeed on a later attempt: timeout, throttled, Cosmos "retry with", server errors.
+# Anything else (400, 401, 403, 404, 409, 412, 413, ...) fails the same way every time.
+RETRYABLE_STATUS_CODES = {408, 429, 449, 500, 502, 503, 504}
+
+_deadline = contextvars.ContextVar('retry_deadline', default=None)
+_retrying = contextvars.ContextVar('retrying', default=False)
+
+
+def is_retryable(error):
+    if isinstance(error, HttpResponseError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    # Connection failures and timeouts before any response arrived
+    return isinstance(error, (ServiceRequestError, ServiceResponseError))
+
+
+def retry_after(error):
+    """Return the wait in seconds the service asked for, or None."""
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('x-ms-retry-after-ms') is not None:
+            return float(headers['x-ms-retry-after-ms']) / 1000
+        if headers.get('Retry-After') is not None:
+            return float(headers['Retry-After'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def start_deadline(seconds):
+    """Give retries in the current context (e.g. one HTTP request) at most this many seconds in total."""
+    _deadline.set(time.monotonic() + seconds)
+
+
+def clear_deadline():
+    _deadline.set(None)
+
+
+@contextmanager
+def deadline(seconds):
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class RetryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'retries': 0, 'recovered': 0, 'exhausted': 0, 'not_retryable': 0}
+        self._retries_by_status = {}
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def record_retry(self, status):
+        with self._lock:
+            self._counters['retries'] += 1
+            self._retries_by_status[status] = self._retries_by_status.get(status, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counters, retries_by_status=dict(self._retries_by_status))
+
+
+class RetryPolicy:
+    """Retry transient Cosmos DB and Key Vault errors with full-jitter exponential backoff.
+
+    Waits as long as the service asks through x-ms-retry-after-ms, gives up at once on errors
+    that cannot succeed, and stops when the deadline of the current request would be exceeded.
+    Retries never nest: a decorated call made inside another one runs once and leaves
+    retrying to the outermost call. Works on both plain and async functions.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.2, max_delay=5, default_budget=30, sleep=time.sleep):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_budget = default_budget
+        self.sleep = sleep
+        self.stats = RetryStats()
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _retrying.get():
+                    return await func(*args, **kwargs)
+                token = _retrying.set(True)
+                try:
+                    retrying = tenacity.AsyncRetrying(**self._retrying_kwargs())
+                    return await self._observe_async(retrying, retrying(func, *args, **kwargs))
+                finally:
+                    _retrying.reset(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _retrying.get():
+                return func(*args, **kwargs)
+            token = _retrying.set(True)
+            try:
+                retrying = tenacity.Retrying(sleep=self.sleep, **self._retrying_kwargs())
+                return self._observe(retrying, lambda: retrying(func, *args, **kwargs))
+            finally:
+                _retrying.reset(token)
+        return wrapper
+
+    def _retrying_kwargs(self):
+        deadline_at = _deadline.get() or time.monotonic() + self.default_budget
+        return dict(
+            retry=tenacity.retry_if_exception(is_retryable),
+            stop=functools.partial(self._should_stop, deadline_at),
+            wait=functools.partial(self._next_delay, deadline_at),
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )
+
+    def _observe(self, retrying, call):
+        self.stats.incr('calls')
+        try:
+            result = call()
+        except Exception as e:
+            self.stats.incr('exhausted' if is_retryable(e) else 'not_retryable')
+            raise
+        if retrying.statistics.get('attempt_number', 1) > 1:
+            self.stats.incr('recovered')
+        return result
+
+    async def _observe_async(self, retrying, awaitable):
+        self.stats.incr('calls')
+        try:
+            result = await awaitable
+        except Exception as e:
+            self.stats.incr('exhausted' if is_retryable(e) else 'not_retryable')
+            raise
+        if retrying.statistics.get('attempt_number', 1) > 1:
+            self.stats.incr('recovered')
+        return result
+
+    def _should_stop(self, deadline_at, retry_state):
+        if retry_state.attempt_number >= self.max_attempts:
+            return True
+        remaining = deadline_at - time.monotonic()
+        hinted = retry_after(retry_state.outcome.exception())
+        # No point sleeping past the deadline when the service says it will not accept the request sooner
+        return remaining <= 0 or (hinted is not None and hinted > remaining)
+
+    def _next_delay(self, deadline_at, retry_state):
+        hinted = retry_after(retry_state.outcome.exception())
+        if hinted is not None:
+            delay = hinted + random.uniform(0, self.base_delay)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry_state.attempt_number - 1)))
+        return max(0, min(delay, deadline_at - time.monotonic()))
+
+    def _before_sleep(self, retry_state):
+        error = retry_state.outcome.exception()
+        self.stats.record_retry(str(getattr(error, 'status_code', None) or type(error).__name__))
+
+
+# Shared by every Cosmos DB call so retry metrics cover the whole process
+cosmos_retry = RetryPolicy()
+
+
+def cosmos_connection_policy():
+    """Connection policy for Cosmos DB clients whose calls go through cosmos_retry.
+
+    The SDK retries a 429 itself, up to 9 times over 30 seconds, before raising; under
+    cosmos_retry that multiplies the attempts and outlasts the request deadline. Throttles
+    are raised at once instead, so cosmos_retry alone decides when and whether to retry.
+    (retry_total=0 would not do: the SDK treats 0 as unset and keeps its default.)
+    """
+    policy = ConnectionPolicy()
+    policy.RetryOptions = RetryOptions(max_retry_attempt_count=0)
+    return policy
@@ -0,0 +1,185 @@
+import asyncio
+import functools
+import inspect
+import threading
+
+
+def freeze(value):
+    """A hashable stand-in for an argument: lists become tuples, sets frozensets, dicts sorted pairs."""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+
+def detach(value):
+    """A copy of a shared result that one caller can change without the others seeing it.
+
+    Dicts are copied one level deep, like the item cache does; lists and tuples
+    (Versioned included) are rebuilt around copies; anything else is shared as it is.
+    """
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return [detach(item) for item in value]
+    if isinstance(value, tuple):
+        items = [detach(item) for item in value]
+        return type(value)._make(items) if hasattr(type(value), '_make') else tuple(items)
+    return value
+
+
+class SingleFlightStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'shared': 0}
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self, done):
+        # A threading.Event, or an asyncio future
+        self.done = done
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Concurrent identical calls share one execution: the first runs, the others wait for its outcome.
+
+    Calls are identical when they go to the same method of the same object with equal
+    arguments and no write (a method decorated with writes) on that object has returned
+    since the first one started. A caller that reads after its own write therefore never
+    joins a read that may predate it; a read that overlaps a write still in progress may
+    or may not see it, as without coalescing. Every caller gets its own detached copy of a
+    shared result, or the same exception. Works on plain functions (threads, or greenlets
+    under gevent) and on coroutine functions, where followers await the first call's future.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.stats = SingleFlightStats()
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        # Writes that have returned, per object; part of every key so later reads start afresh
+        self._generations = {}
+
+    def _key(self, name, obj, args, kwargs):
+        return name, id(obj), self._generations.get(id(obj), 0), freeze(args), freeze(kwargs)
+
+    def _written(self, obj):
+        with self._lock:
+            self._generations[id(obj)] = self._generations.get(id(obj), 0) + 1
+
+    def writes(self, func):
+        """Decorator for methods that change what the object's coalesced reads return."""
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self_, *args, **kwargs):
+                try:
+                    return await func(self_, *args, **kwargs)
+                finally:
+                    # Also after a failure: the write may have been applied before the error
+                    self._written(self_)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self_, *args, **kwargs):
+            try:
+                return func(self_, *args, **kwargs)
+            finally:
+                self._written(self_)
+        return wrapper
+
+    def __call__(self, func):
+        name = func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self_, *args, **kwargs):
+                if not self.enabled:
+                    return await func(self_, *args, **kwargs)
+                return await self._do_async(self._key(name, self_, args, kwargs), func, self_, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self_, *args, **kwargs):
+            if not self.enabled:
+                return func(self_, *args, **kwargs)
+            return self._do(self._key(name, self_, args, kwargs), func, self_, *args, **kwargs)
+        return wrapper
+
+    def _do(self, key, func, *args, **kwargs):
+        self.stats.incr('calls')
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call(threading.Event())
+            else:
+                call.followers += 1
+        if not leader:
+            self.stats.incr('shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return detach(call.result)
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        # Followers copy the original, so with any the first caller takes a copy too
+        return detach(call.result) if call.followers else call.result
+
+    async def _do_async(self, key, func, *args, **kwargs):
+        self.stats.incr('calls')
+        call = self._async_calls.get(key)
+        while call is not None:
+            call.followers += 1
+            self.stats.incr('shared')
+            try:
+                # Shielded: a follower that is cancelled must not cancel the call the others wait for
+                return detach(await asyncio.shield(call.done))
+            except asyncio.CancelledError:
+                if not call.done.cancelled():
+                    raise
+            # The first caller was cancelled; the next one to get here runs the call again
+            call = self._async_calls.get(key)
+        call = self._async_calls[key] = _Call(asyncio.get_running_loop().create_future())
+        try:
+            call.result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            call.done.cancel()
+            raise
+        except BaseException as e:
+            call.done.set_exception(e)
+            # Retrieved here so an exception nobody else waited for is not reported as unhandled
+            call.done.exception()
+            raise
+        else:
+            call.done.set_result(call.result)
+        finally:
+            del self._async_calls[key]
+        return detach(call.result) if call.followers else call.result
+
+
+# Shared by the Cosmos DB clients' reads so calls from every request thread of a worker are merged
+coalesce = SingleFlight()
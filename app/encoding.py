@@ -0,0 +1,337 @@
+import gzip
+import json
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from flask import current_app, request
+from .metrics import TimedJSONEncoder, stage
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/csv')
+# No body, or a byte range of the uncompressed one
+UNCOMPRESSED_STATUSES = (204, 206, 304)
+
+
+class JSONBackend:
+    """The standard library's json; output matches flask.json with compact separators."""
+    name = 'json'
+
+    def dumps(self, value, default=None, sort_keys=False):
+        return json.dumps(value, default=default, sort_keys=sort_keys, separators=(',', ':')).encode()
+
+
+class OrjsonBackend:
+    name = 'orjson'
+
+    def __init__(self, orjson):
+        self.orjson = orjson
+        # Datetimes go to default as they do with json, so both backends write them the same way
+        self.options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        self.fallback = JSONBackend()
+
+    def dumps(self, value, default=None, sort_keys=False):
+        options = self.options | (self.orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            return self.orjson.dumps(value, default=default, option=options)
+        except TypeError:
+            # orjson refuses some values json accepts, such as integers beyond 64 bits
+            return self.fallback.dumps(value, default, sort_keys)
+
+
+def create_json_backend(name='auto'):
+    """The serializer selected by JSON_BACKEND: 'orjson', 'json', or 'auto' for orjson when it is installed."""
+    if name in ('auto', 'orjson'):
+        try:
+            import orjson
+        except ImportError:
+            if name == 'orjson':
+                raise
+        else:
+            return OrjsonBackend(orjson)
+    if name in ('auto', 'json'):
+        return JSONBackend()
+    raise ValueError(f"Unknown JSON_BACKEND: {name}")
+
+
+class ResponseJSONEncoder(TimedJSONEncoder):
+    """Flask's JSON encoder on the app's backend; jsonify and friends go through it."""
+    backend = JSONBackend()
+
+    def encode(self, o):
+        if self.indent is not None:
+            # Pretty-printed output (debug mode) stays with json
+            return super().encode(o)
+        with stage('serialize'):
+            return self.backend.dumps(o, default=self.default, sort_keys=self.sort_keys).decode()
+
+
+class _GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def write(self, chunk):
+        # Flushed per chunk so NDJSON readers still get every page as it is sent
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        return self._compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self, brotli, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def write(self, chunk):
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def close(self):
+        return self._compressor.finish()
+
+
+class Gzip:
+    name = 'gzip'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        # mtime=0 keeps the output identical for identical bodies
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def stream(self):
+        return _GzipStream(self.level)
+
+
+class Brotli:
+    name = 'br'
+
+    def __init__(self, brotli, quality=4):
+        self.brotli = brotli
+        self.quality = quality
+
+    def compress(self, data):
+        return self.brotli.compress(data, quality=self.quality)
+
+    def stream(self):
+        return _BrotliStream(self.brotli, self.quality)
+
+
+def create_codings(config):
+    """Content codings to offer, most preferred first: br when the brotli package is installed, then gzip."""
+    if not config.get('COMPRESSION_ENABLED', True):
+        return []
+    codings = []
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        codings.append(Brotli(brotli, int(config.get('COMPRESSION_BROTLI_QUALITY', 4))))
+    codings.append(Gzip(int(config.get('COMPRESSION_GZIP_LEVEL', 6))))
+    return codings
+
+
+def choose_coding(accept_encoding, codings):
+    """The coding Accept-Encoding rates highest, earlier ones in codings winning ties; None for identity."""
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for coding in codings:
+        quality = qualities.get(coding.name, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class EncodedBody:
+    """A serialized body and its compressed forms, each made once."""
+
+    def __init__(self, data):
+        self.data = data
+        self._encoded = {}
+
+    def encoded(self, coding):
+        data = self._encoded.get(coding.name)
+        if data is None:
+            # Two threads may both compress; they store the same bytes
+            data = self._encoded[coding.name] = coding.compress(self.data)
+        return data
+
+
+class EncodedBodyCache:
+    """Least recently used EncodedBody objects, by a key that names their content, up to max_bytes of JSON."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        size = len(body.data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous.data)
+            self._entries[key] = body
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.data)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+class ResponseEncoder:
+    """Serializes and compresses response bodies for both the Flask and the ASGI app.
+
+    Bodies of COMPRESSION_MIN_BYTES or more are compressed when the client accepts it;
+    streamed bodies always are. Bodies given a key (an etag and the query) are kept, with
+    their compressed forms, so an unchanged listing is not encoded again.
+    """
+
+    def __init__(self, backend, codings, min_size=1024, cache_bytes=0, sort_keys=True):
+        self.backend = backend
+        self.codings = codings
+        self.min_size = min_size
+        self.sort_keys = sort_keys
+        self.bodies = EncodedBodyCache(cache_bytes) if cache_bytes > 0 else None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(create_json_backend(config.get('JSON_BACKEND', 'auto')), create_codings(config),
+                   min_size=int(config.get('COMPRESSION_MIN_BYTES', 1024)),
+                   cache_bytes=int(config.get('ENCODED_BODY_CACHE_BYTES', 0)),
+                   sort_keys=config.get('JSON_SORT_KEYS', True))
+
+    def dumps(self, value):
+        with stage('serialize'):
+            return self.backend.dumps(value, sort_keys=self.sort_keys)
+
+    def body(self, value, key=None):
+        """EncodedBody of value; with a key, one encoded earlier under the same key is reused.
+
+        Only pass a key for a value that is the same whenever the key is, e.g. (etag, path) of a
+        read; never for one holding a decryption error, which the etag would outlive.
+        """
+        if key is None or self.bodies is None:
+            return EncodedBody(self.dumps(value))
+        body = self.bodies.get(key)
+        if body is None:
+            body = EncodedBody(self.dumps(value))
+            self.bodies.put(key, body)
+        return body
+
+    def ndjson(self, items):
+        with stage('serialize'):
+            return b''.join(self.backend.dumps(item, sort_keys=self.sort_keys) + b'\n' for item in items)
+
+    def array_items(self, items):
+        """items as the inside of a JSON array: comma-separated, without the brackets."""
+        return self.dumps(list(items))[1:-1]
+
+    def compressible(self, mimetype):
+        return bool(self.codings) and mimetype.split(';')[0].strip() in COMPRESSIBLE_MIMETYPES
+
+    def negotiate(self, accept_encoding, mimetype, size=None):
+        """The coding to send a body in, or None to send it as it is; size is None for a streamed body."""
+        if not self.compressible(mimetype) or (size is not None and size < self.min_size):
+            return None
+        return choose_coding(accept_encoding, self.codings)
+
+    def compress(self, body, coding):
+        with stage('compress'):
+            return body.encoded(coding)
+
+    def compress_stream(self, chunks, coding):
+        stream = coding.stream()
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if chunk:
+                with stage('compress'):
+                    yield stream.write(chunk)
+        yield stream.close()
+
+    def compress_response(self, response):
+        """after_request hook: compress the response if it is worth it and the client accepts it."""
+        if (response.status_code < 200 or response.status_code in UNCOMPRESSED_STATUSES
+                or response.direct_passthrough or 'Content-Encoding' in response.headers
+                or not self.compressible(response.mimetype)):
+            return response
+        response.vary.add('Accept-Encoding')
+        accept_encoding = request.headers.get('Accept-Encoding')
+        if response.is_streamed:
+            coding = self.negotiate(accept_encoding, response.mimetype)
+            if coding is None:
+                return response
+            response.response = self.compress_stream(response.response, coding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = getattr(response, 'encoded_body', None) or EncodedBody(response.get_data())
+            coding = self.negotiate(accept_encoding, response.mimetype, len(body.data))
+            if coding is None:
+                return response
+            response.set_data(self.compress(body, coding))
+        # The ETag is left as it is: it names the item version If-Match writes are checked against
+        response.headers['Content-Encoding'] = coding.name
+        return response
+
+
+def response_encoder():
+    """The current app's ResponseEncoder; apps built without init_encoding get a default one."""
+    encoder = current_app.extensions.get('response_encoder')
+    if encoder is None:
+        encoder = current_app.extensions.setdefault('response_encoder', ResponseEncoder.from_config(current_app.config))
+    return encoder
+
+
+def json_response(value, status=200, key=None):
+    """A JSON response through the app's ResponseEncoder; see ResponseEncoder.body for key."""
+    body = response_encoder().body(value, key)
+    response = current_app.response_class(body.data, status=status, mimetype='application/json')
+    # compress_response reuses the compressed forms kept with the body
+    response.encoded_body = body
+    return response
+
+
+def init_encoding(app):
+    """Serialize JSON with JSON_BACKEND and compress responses per Accept-Encoding (COMPRESSION_*)."""
+    encoder = ResponseEncoder.from_config(app.config)
+    app.extensions['response_encoder'] = encoder
+    app.json_encoder = type('ResponseJSONEncoder', (ResponseJSONEncoder,), {'backend': encoder.backend})
+    if encoder.codings:
+        app.after_request(encoder.compress_response)
+    logger.debug("JSON backend %s, content codings %s", encoder.backend.name,
+                 [coding.name for coding in encoder.codings])
+    return encoder
@@ -0,0 +1,26 @@
+from flask import jsonify
+
+# Probes come from the orchestrator over plain HTTP: no auth, no rate limit, no HTTPS redirect
+PROBE_ENDPOINTS = ('healthz', 'readyz')
+
+
+def init_health(app, cosmos_client, talisman=None, limiter=None):
+    def healthz():
+        """Liveness: the process serves requests. Never touches a dependency."""
+        return jsonify({"status": "ok"}), 200
+
+    def readyz():
+        """Readiness: the Cosmos DB client and Encryptor are built, building them if needed."""
+        try:
+            cosmos_client.get()
+        except Exception as e:
+            app.logger.warning("Not ready: %s", type(e).__name__)
+            return jsonify({"status": "unavailable", "error": type(e).__name__}), 503
+        return jsonify({"status": "ready"}), 200
+
+    for name, view in (('healthz', healthz), ('readyz', readyz)):
+        if talisman is not None:
+            view = talisman(force_https=False)(view)
+        if limiter is not None:
+            view = limiter.exempt(view)
+        app.add_url_rule(f'/{name}', name, view)
@@ -1,17 +1,193 @@
-import os
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Attributes every LogRecord has; anything else was passed through extra= and is emitted as a field
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, the extra= fields and any traceback."""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.levelno >= logging.WARNING:
+            entry['source'] = f'{record.pathname}:{record.lineno}'
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the records at each level; WARNING and above are never dropped."""
+
+    def __init__(self, rates, random_func=random.random):
+        super().__init__()
+        self.rates = rates
+        self.random = random_func
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.levelname, 1.0)
+        return rate >= 1.0 or self.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread; drops them rather than wait when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render the message and traceback in the calling thread while its arguments are still
+        # current; the JSON encoding and the write happen on the listener thread
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingPipeline:
+    """Request threads only enqueue records; one background listener formats and writes them."""
+
+    def __init__(self, handlers, queue_size=10000, sample_rates=None):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        if sample_rates:
+            self.handler.addFilter(SamplingFilter(sample_rates))
+        self.handlers = handlers
+        self.listener = None
+        self.start()
+
+    def start(self):
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except (OSError, ValueError):
+                # The stream may already be closed at interpreter exit, as logging.shutdown also allows
+                pass
+
+    def after_fork(self):
+        # The listener thread does not survive fork(); the child needs its own
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.handler.queue = self.queue
+        self.listener = None
+        self.start()
+
+
+def parse_levels(value):
+    """'app.data=DEBUG,azure=WARNING' -> {'app.data': 'DEBUG', 'azure': 'WARNING'}"""
+    if isinstance(value, dict):
+        return value
+    levels = {}
+    for part in (value or '').split(','):
+        name, _, level = part.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def parse_sample_rates(value):
+    return {level: float(rate) for level, rate in parse_levels(value).items()}
+
+
+def _build_handlers(config):
+    formatter = JsonFormatter() if config.get('LOG_FORMAT', 'json') == 'json' else logging.Formatter(
+        '%(asctime)s %(levelname)s %(name)s: %(message)s')
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    handlers = [stream_handler]
+    log_file = config.get('LOG_FILE')
+    if log_file:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = RotatingFileHandler(log_file, maxBytes=config.get('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024),
+                                           backupCount=config.get('LOG_FILE_BACKUP_COUNT', 10))
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    return handlers
+
 
 def configure_logging(app):
-    if not app.debug:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        file_handler = RotatingFileHandler('logs/application.log', maxBytes=10240, backupCount=10)
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-        ))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-
-        app.logger.setLevel(logging.INFO)
-        app.logger.info('Application startup')
\ No newline at end of file
+    """Route every logger through one queue to stdout (and LOG_FILE if set) as JSON lines.
+
+    LOG_LEVEL sets the root level, LOG_LEVELS overrides it per logger
+    ('app.data=DEBUG,azure=WARNING') and LOG_SAMPLE_RATES keeps a fraction of the
+    records below WARNING ('DEBUG=0.01,INFO=0.5'). Calling it again replaces the pipeline.
+    """
+    global _pipeline
+    config = app.config
+    root = logging.getLogger()
+    with _pipeline_lock:
+        if _pipeline is not None:
+            root.removeHandler(_pipeline.handler)
+            _pipeline.stop()
+        _pipeline = LoggingPipeline(_build_handlers(config), queue_size=config.get('LOG_QUEUE_SIZE', 10000),
+                                    sample_rates=parse_sample_rates(config.get('LOG_SAMPLE_RATES')))
+        root.addHandler(_pipeline.handler)
+    root.setLevel(config.get('LOG_LEVEL', 'INFO'))
+    for name, level in parse_levels(config.get('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+    # Let app.logger propagate to the root handler instead of Flask's own stderr handler
+    app.logger.setLevel(logging.NOTSET)
+    app.logger.info('Application startup')
+    return _pipeline
+
+
+def get_pipeline():
+    return _pipeline
+
+
+def _stop_pipeline():
+    if _pipeline is not None:
+        _pipeline.stop()
+
+
+def _after_fork_in_child():
+    if _pipeline is not None:
+        _pipeline.after_fork()
+
+
+atexit.register(_stop_pipeline)
+os.register_at_fork(after_in_child=_after_fork_in_child)
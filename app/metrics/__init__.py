@@ -0,0 +1,159 @@
+import contextvars
+import os
+import threading
+import time
+from functools import wraps
+from flask import Response, g, request
+from flask.json import JSONEncoder
+from .registry import MetricsRegistry, merge, render
+
+# The one registry of the process; stage() and the Azure transports record into it
+metrics = MetricsRegistry()
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+METRICS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RequestTimings:
+    """Stage totals of the current request, for its Server-Timing header."""
+
+    def __init__(self):
+        self.stages = {}
+        self.request_charge = 0.0
+        # Decryption runs on pool threads that share this object
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_charge(self, request_units):
+        with self._lock:
+            self.request_charge += request_units
+
+    def header(self, total):
+        parts = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.stages.items()]
+        if self.request_charge:
+            parts.append(f'cosmos-ru;desc="{self.request_charge:.2f}"')
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def record_stage(name, seconds):
+    metrics.observe('app_stage_seconds', seconds, (('stage', name),))
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def record_request_charge(request_units):
+    metrics.observe('cosmos_request_charge', request_units)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add_charge(request_units)
+
+
+class stage:
+    """Time a block as one stage: `with stage('auth'): ...`. Stages may nest; each is reported on its own."""
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def timed(name):
+    """Decorator form of stage()."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class TimedJSONEncoder(JSONEncoder):
+    def encode(self, o):
+        with stage('serialize'):
+            return super().encode(o)
+
+
+class TimedStorage:
+    """Wraps a limits storage so the time spent on rate-limit counters is reported as a stage."""
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if callable(attribute) and name in ('incr', 'get', 'get_expiry', 'acquire_entry', 'get_moving_window'):
+            # Only reached on first use; the wrapper is kept on the instance after that
+            attribute = timed('ratelimit')(attribute)
+            setattr(self, name, attribute)
+        return attribute
+
+
+def init_metrics(app, limiter=None):
+    """Time every request and its stages, add Server-Timing headers and serve /metrics.
+
+    METRICS_DIR shares the totals between gunicorn workers; SERVER_TIMING_ENABLED
+    controls the response header.
+    """
+    metrics.configure(app.config.get('METRICS_DIR'), app.config.get('METRICS_FLUSH_SECONDS', 5))
+    server_timing = app.config.get('SERVER_TIMING_ENABLED', True)
+    app.json_encoder = TimedJSONEncoder
+    if limiter is not None and limiter.enabled:
+        strategy = limiter.limiter
+        strategy.storage = TimedStorage(strategy.storage)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_token = _request_timings.set(RequestTimings())
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('http_request_duration_seconds', elapsed,
+                        (('endpoint', endpoint), ('method', request.method), ('status', str(response.status_code))))
+        timings = _request_timings.get()
+        if server_timing and timings is not None:
+            response.headers['Server-Timing'] = timings.header(elapsed)
+        return response
+
+    @app.teardown_request
+    def end_request_timer(error=None):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            _request_timings.reset(token)
+
+    def metrics_view():
+        return Response(render(metrics.collect()), mimetype=METRICS_MIMETYPE)
+
+    if limiter is not None:
+        metrics_view = limiter.exempt(metrics_view)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    return metrics
+
+
+def _after_fork_in_child():
+    metrics.after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
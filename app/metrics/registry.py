@@ -0,0 +1,245 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cache hit up to a slow Key Vault round trip
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Request units charged per Cosmos DB call
+REQUEST_CHARGE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# name -> (help, buckets); every metric is a histogram, so counts and totals come with _count and _sum
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Request latency by endpoint, method and status', DURATION_BUCKETS),
+    'app_stage_seconds': ('Time spent in each stage of handling a request', DURATION_BUCKETS),
+    'cosmos_request_charge': ('Request units charged per Cosmos DB call', REQUEST_CHARGE_BUCKETS),
+}
+
+FILE_PREFIX = 'metrics-'
+# Totals of every worker that has exited, folded together by the master
+EXITED_FILE = FILE_PREFIX + 'exited.json'
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """Histograms kept in process memory and, with a directory, shared between worker processes.
+
+    Recording is a bisect and three additions under one lock. With a directory every
+    process writes its totals to its own file every flush_interval seconds (and before a
+    scrape), and collect() adds up all the files, so whichever gunicorn worker answers
+    /metrics reports the whole server. When a worker exits the master folds its file into
+    EXITED_FILE (mark_process_dead), so totals never go backwards and the directory holds
+    one file per live worker plus one; clear() them all when the server starts.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._flusher_pid = None
+        self._file = None
+
+    def configure(self, directory=None, flush_interval=None):
+        self.directory = directory
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def observe(self, name, value, labels=()):
+        """Record value in histogram name; labels is a tuple of (label, value) pairs."""
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(buckets) + 1)
+            histogram.counts[bisect.bisect_left(buckets, value)] += 1
+            histogram.sum += value
+            histogram.count += 1
+        if self.directory and self._flusher_pid != os.getpid():
+            self._ensure_flusher()
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, [list(pair) for pair in labels], list(h.counts), h.sum, h.count]
+                    for (name, labels), h in self._histograms.items()]
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+    # Multiprocess
+
+    def _path(self):
+        # A random part per process: a recycled pid must not overwrite an exited worker's totals
+        if self._file is None or self._file[0] != os.getpid():
+            self._file = (os.getpid(), os.path.join(self.directory, f'{FILE_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}.json'))
+        return self._file[1]
+
+    def flush(self):
+        if not self.directory:
+            return
+        self._write(self._path(), self.snapshot())
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.metrics-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def _read_exited(self):
+        try:
+            with open(os.path.join(self.directory, EXITED_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'metrics': [], 'merged': []}
+
+    def collect(self):
+        """Totals of every process sharing the directory, or of this process without one."""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        for _ in range(3):
+            snapshots, complete = self._read_all()
+            if complete:
+                break
+        return merge(snapshots)
+
+    def _read_all(self):
+        # The exited file is read first: a worker file that is gone by the time it is read has
+        # been folded into a newer exited file than this one, and the caller reads them all again
+        try:
+            exited = self._read_exited()
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping metrics file %s: %s", EXITED_FILE, e)
+            exited = {'metrics': [], 'merged': []}
+        snapshots = [exited['metrics']]
+        skip = set(exited['merged']) | {EXITED_FILE}
+        for path in glob.glob(os.path.join(self.directory, FILE_PREFIX + '*.json')):
+            if os.path.basename(path) in skip:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except FileNotFoundError:
+                return snapshots, False
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping metrics file %s: %s", path, e)
+        return snapshots, True
+
+    def mark_process_dead(self, pid):
+        """Fold the files of exited worker pid into EXITED_FILE and delete them; call it from the master."""
+        if not self.directory:
+            return
+        paths = glob.glob(os.path.join(self.directory, f'{FILE_PREFIX}{pid}-*.json'))
+        if not paths:
+            return
+        exited = self._read_exited()
+        # Left behind if the master stopped between folding them in and deleting them
+        for name in exited['merged']:
+            if os.path.exists(os.path.join(self.directory, name)):
+                os.unlink(os.path.join(self.directory, name))
+        snapshots = [exited['metrics']]
+        for path in paths:
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning("Dropping metrics file %s of exited worker %s: %s", path, pid, e)
+        self._write(os.path.join(self.directory, EXITED_FILE),
+                    {'metrics': merge(snapshots), 'merged': [os.path.basename(path) for path in paths]})
+        for path in paths:
+            os.unlink(path)
+
+    def clear(self):
+        """Delete every process's metrics file, e.g. when the server (re)starts."""
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, FILE_PREFIX + '*.json')):
+                os.unlink(path)
+
+    def after_fork(self):
+        # Whatever the preloading master recorded is not this worker's to report
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._flusher_pid = None
+        self._file = None
+
+    def _ensure_flusher(self):
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Metrics flush failed: %s", e)
+
+
+def merge(snapshots):
+    """Add up histograms with the same name and labels across snapshots."""
+    totals = {}
+    for snapshot in snapshots:
+        for name, labels, counts, total, count in snapshot:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            current = totals.get(key)
+            if current is None:
+                totals[key] = [name, labels, list(counts), total, count]
+            else:
+                current[2] = [a + b for a, b in zip(current[2], counts)]
+                current[3] += total
+                current[4] += count
+    return list(totals.values())
+
+
+def _label_text(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render(snapshot):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    by_name = {}
+    for entry in sorted(snapshot, key=lambda entry: (entry[0], entry[1])):
+        by_name.setdefault(entry[0], []).append(entry)
+    for name, entries in by_name.items():
+        help_text, buckets = HISTOGRAMS.get(name, ('', ()))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for _, labels, counts, total, count in entries:
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_label_text(labels, ("le", bound))} {cumulative}')
+            lines.append(f'{name}_sum{_label_text(labels)} {total}')
+            lines.append(f'{name}_count{_label_text(labels)} {count}')
+    return '\n'.join(lines) + '\n'
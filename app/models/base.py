@@ -0,0 +1,44 @@
+# app/models/base.py
+
+import uuid
+
+
+class Model:
+    """Base of the stored documents' models.
+
+    Instances have __slots__ instead of a __dict__, and the id is only generated when
+    first read, so models built from stored documents never call uuid4. Subclasses list
+    their slots, their fields (the keys of to_dict, in order) and a from_dict that fills
+    the slots directly.
+    """
+    __slots__ = ('_id',)
+    fields = ()
+    schema = None
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = str(uuid.uuid4())
+        return self._id
+
+    @id.setter
+    def id(self, value):
+        self._id = value
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.fields}
+
+    @classmethod
+    def from_dicts(cls, items):
+        from_dict = cls.from_dict
+        return [from_dict(item) for item in items]
+
+    @staticmethod
+    def to_dicts(models):
+        return [model.to_dict() for model in models]
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields)})"
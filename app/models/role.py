@@ -1,8 +1,19 @@
 # app/models/role.py
 
-class Role:
-    def __init__(self, name, permissions):
-        self.id = str(uuid.uuid4())
+from .base import Model
+from .schema import Field, Schema
+
+
+class Role(Model):
+    __slots__ = ('name', 'permissions')
+    fields = ('id', 'name', 'permissions')
+    schema = Schema({
+        'name': Field(str, required=True, max_length=128),
+        'permissions': Field(list, required=True, items=Field(str, max_length=128)),
+    })
+
+    def __init__(self, name, permissions, id=None):
+        self._id = id
         self.name = name
         self.permissions = permissions
 
@@ -15,6 +26,8 @@ class Role:
 
     @classmethod
     def from_dict(cls, data):
-        role = cls(data['name'], data['permissions'])
-        role.id = data['id']
-        return role
\ No newline at end of file
+        role = cls.__new__(cls)
+        role._id = data['id']
+        role.name = data['name']
+        role.permissions = data['permissions']
+        return role
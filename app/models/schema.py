@@ -0,0 +1,66 @@
+# app/models/schema.py
+
+import re
+
+
+class ValidationError(ValueError):
+    """A request body that does not match its schema; errors lists every problem found."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class Field:
+    """One property of a schema: its JSON type and the constraints on its value."""
+
+    TYPES = {str: 'a string', int: 'an integer', bool: 'a boolean', list: 'a list', dict: 'an object'}
+
+    def __init__(self, type, required=False, max_length=None, pattern=None, choices=None, items=None):
+        self.type = type
+        self.required = required
+        self.max_length = max_length
+        self.pattern = re.compile(pattern) if pattern else None
+        self.choices = choices
+        self.items = items
+
+    def check(self, name, value, errors):
+        # bool is an int to isinstance, but not to a JSON schema
+        if not isinstance(value, self.type) or (isinstance(value, bool) and self.type is not bool):
+            errors.append(f"{name} must be {self.TYPES.get(self.type, self.type.__name__)}")
+            return
+        if self.max_length is not None and not 0 < len(value) <= self.max_length:
+            errors.append(f"{name} must have 1 to {self.max_length} {'items' if self.type is list else 'characters'}")
+        if self.pattern is not None and not self.pattern.match(value):
+            errors.append(f"{name} is not valid")
+        if self.choices is not None and value not in self.choices:
+            errors.append(f"{name} must be one of {', '.join(self.choices)}")
+        if self.items is not None:
+            for index, item in enumerate(value):
+                self.items.check(f"{name}[{index}]", item, errors)
+
+
+class Schema:
+    """Checks request bodies against a set of Fields; with extra, properties it does not name are let through."""
+
+    def __init__(self, fields, extra=False):
+        self.fields = fields
+        self.extra = extra
+
+    def validate(self, data, partial=False):
+        """Return data if it matches, raise ValidationError otherwise; partial skips the required check."""
+        if not isinstance(data, dict):
+            raise ValidationError(["the body must be a JSON object"])
+        errors = []
+        for name, field in self.fields.items():
+            value = data.get(name)
+            if value is None:
+                if field.required and not partial:
+                    errors.append(f"{name} is required")
+                continue
+            field.check(name, value, errors)
+        if not self.extra:
+            errors.extend(f"{name} is not allowed" for name in data if name not in self.fields)
+        if errors:
+            raise ValidationError(errors)
+        return data
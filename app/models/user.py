@@ -1,8 +1,28 @@
 # app/models/user.py
 
-class User:
-    def __init__(self, username, email, roles=None):
-        self.id = str(uuid.uuid4())
+from .base import Model
+from .schema import Field, Schema
+
+# Loose on purpose: the address is confirmed by whoever sends mail to it
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+
+
+class User(Model):
+    __slots__ = ('username', 'email', 'roles')
+    fields = ('id', 'username', 'email', 'roles')
+    # Bodies of /api/users: items may carry fields of their own, but the known ones are checked
+    # and 'type' cannot turn an item into one of the container's internal documents
+    schema = Schema({
+        'id': Field(str, max_length=255, pattern=r'^[^/\\?#]+$'),
+        'type': Field(str, choices=('user',)),
+        'username': Field(str, max_length=128),
+        'name': Field(str, max_length=256),
+        'email': Field(str, max_length=254, pattern=EMAIL_PATTERN),
+        'roles': Field(list, items=Field(str, max_length=128)),
+    }, extra=True)
+
+    def __init__(self, username, email, roles=None, id=None):
+        self._id = id
         self.username = username
         self.email = email
         self.roles = roles or []
@@ -17,6 +37,9 @@ class User:
 
     @classmethod
     def from_dict(cls, data):
-        user = cls(data['username'], data['email'], data.get('roles', []))
-        user.id = data['id']
-        return user
\ No newline at end of file
+        user = cls.__new__(cls)
+        user._id = data['id']
+        user.username = data['username']
+        user.email = data['email']
+        user.roles = data.get('roles') or []
+        return user
@@ -0,0 +1,43 @@
+from flask import current_app, g, request
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+from .storage import BatchedStorage
+
+
+def principal_key():
+    """Rate-limit by the authenticated caller; anonymous requests fall back to the client address.
+
+    Default limits run before the view's auth decorator, so the credentials are checked here
+    too. The authenticator caches verified principals, which keeps this a dictionary hit.
+    """
+    principal = getattr(g, 'user', None)
+    if principal is None:
+        authenticator = current_app.extensions.get('authenticator')
+        if authenticator is not None:
+            principal = authenticator.authenticate(request.headers)
+    if principal is None or getattr(principal, 'identity', None) is None:
+        return f'ip:{get_remote_address()}'
+    return f'{principal.method}:{principal.identity}'
+
+
+# The single limiter for the whole app; storage, strategy and default limits come from the config
+limiter = Limiter(key_func=principal_key)
+
+
+def default_limits(config):
+    return f"{config['RATE_LIMIT']} per day;{config['RATE_LIMIT_PERIOD']} per hour"
+
+
+def init_limiter(app):
+    app.config.setdefault('RATELIMIT_DEFAULT', default_limits(app.config))
+    limiter.init_app(app)
+    return limiter
+
+
+def create_rate_limiter(config):
+    """A limits strategy on its own storage, for code outside Flask with the same settings."""
+    storage = storage_from_string(config.get('RATELIMIT_STORAGE_URI', 'memory://'),
+                                  **config.get('RATELIMIT_STORAGE_OPTIONS', {}))
+    return STRATEGIES[config.get('RATELIMIT_STRATEGY', 'moving-window')](storage)
@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+from limits.storage import MovingWindowSupport, Storage, storage_from_string
+
+logger = logging.getLogger(__name__)
+
+BATCHED_PREFIX = 'batched+'
+
+
+class _Window:
+    __slots__ = ('expiry', 'expires_at', 'start', 'limit', 'shared', 'pending', 'elastic', 'touched')
+
+    def __init__(self, expiry, expires_at, start=0, limit=None, shared=0, elastic=False):
+        self.expiry = expiry
+        self.expires_at = expires_at
+        self.start = start
+        self.limit = limit
+        self.shared = shared
+        self.pending = 0
+        self.elastic = elastic
+        self.touched = True
+
+
+class BatchedStorage(Storage, MovingWindowSupport):
+    """Counts hits in process and writes them to the shared storage in the background.
+
+    Use it by prefixing the shared storage URI with 'batched+', e.g.
+    'batched+redis://host:6379'. The first hit on a key in each window goes to the shared
+    storage to learn what other workers have used; later hits are decided against that
+    figure plus this worker's unsent hits, and a daemon thread sends the hits and reads
+    back the shared totals every sync_interval seconds. Keys not hit during an interval
+    are forgotten, so background traffic follows the active callers. A limit can be
+    exceeded by at most what the other workers admit during one sync_interval.
+    """
+    STORAGE_SCHEME = [BATCHED_PREFIX + scheme for scheme in (
+        'memory', 'redis', 'rediss', 'redis+unix', 'redis+cluster', 'redis+sentinel', 'memcached', 'mongodb')]
+
+    def __init__(self, uri, wrap_exceptions=False, sync_interval=0.5, clock=time.time, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+        self.backend = storage_from_string(uri[len(BATCHED_PREFIX):], **options)
+        self.sync_interval = float(sync_interval)
+        self.clock = clock
+        self._counters = {}
+        self._windows = {}
+        self._syncer_pid = None
+
+    @property
+    def base_exceptions(self):
+        return self.backend.base_exceptions
+
+    # Fixed window
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        self._ensure_syncer()
+        now = self.clock()
+        with self.lock:
+            counter = self._counters.get(key)
+            if counter is not None and counter.expires_at > now:
+                counter.pending += amount
+                counter.touched = True
+                if elastic_expiry:
+                    counter.expires_at = now + expiry
+                return counter.shared + counter.pending
+        shared = self.backend.incr(key, expiry, elastic_expiry=elastic_expiry, amount=amount)
+        expires_at = self.backend.get_expiry(key) or now + expiry
+        with self.lock:
+            self._counters[key] = _Window(expiry, expires_at, shared=shared, elastic=elastic_expiry)
+        return shared
+
+    def get(self, key):
+        with self.lock:
+            counter = self._counters.get(key)
+            if counter is not None and counter.expires_at > self.clock():
+                return counter.shared + counter.pending
+        return self.backend.get(key)
+
+    def get_expiry(self, key):
+        with self.lock:
+            counter = self._counters.get(key)
+            if counter is not None and counter.expires_at > self.clock():
+                return counter.expires_at
+        return self.backend.get_expiry(key)
+
+    # Moving window
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        self._ensure_syncer()
+        now = self.clock()
+        with self.lock:
+            window = self._windows.get(key)
+            if window is not None and window.expires_at > now:
+                if window.shared + window.pending + amount > limit:
+                    return False
+                window.pending += amount
+                window.touched = True
+                return True
+        acquired = self.backend.acquire_entry(key, limit, expiry, amount=amount)
+        start, count = self.backend.get_moving_window(key, limit, expiry)
+        with self.lock:
+            self._windows[key] = _Window(expiry, now + expiry, start=start, limit=limit, shared=count)
+        return acquired
+
+    def get_moving_window(self, key, limit, expiry):
+        with self.lock:
+            window = self._windows.get(key)
+            if window is not None and window.expires_at > self.clock():
+                return window.start, window.shared + window.pending
+        return self.backend.get_moving_window(key, limit, expiry)
+
+    # Background sync
+
+    def sync(self):
+        """Send unsent hits to the shared storage and refresh the shared totals of active keys."""
+        now = self.clock()
+        with self.lock:
+            for table in (self._counters, self._windows):
+                for key, entry in list(table.items()):
+                    if not entry.pending and (not entry.touched or entry.expires_at <= now):
+                        del table[key]
+                    else:
+                        entry.touched = False
+            counters = [(key, entry, entry.pending) for key, entry in self._counters.items()]
+            windows = [(key, entry, entry.pending) for key, entry in self._windows.items()]
+
+        for key, counter, pending in counters:
+            if pending:
+                shared = self.backend.incr(key, counter.expiry, elastic_expiry=counter.elastic, amount=pending)
+            else:
+                shared = self.backend.get(key)
+            with self.lock:
+                counter.pending -= pending
+                counter.shared = shared
+        for key, window, pending in windows:
+            if pending:
+                self._send_entries(key, window, pending)
+            start, count = self.backend.get_moving_window(key, window.limit, window.expiry)
+            with self.lock:
+                window.pending -= pending
+                window.start, window.shared = start, count
+
+    def _send_entries(self, key, window, amount):
+        # All or nothing in the backend: when the whole batch does not fit, record as many entries
+        # as still do, so the shared count reaches the limit and every worker stops admitting.
+        # The rest were already admitted here; that is the overshoot of one interval.
+        while amount > 0 and not self.backend.acquire_entry(key, window.limit, window.expiry, amount=amount):
+            _, count = self.backend.get_moving_window(key, window.limit, window.expiry)
+            # Shrinks on every refusal, so this ends even if the backend keeps refusing
+            amount = min(amount - 1, window.limit - count)
+
+    def _ensure_syncer(self):
+        # Started lazily and per process so workers forked from a preloaded master get their own
+        if self._syncer_pid == os.getpid():
+            return
+        with self.lock:
+            if self._syncer_pid != os.getpid():
+                self._syncer_pid = os.getpid()
+                threading.Thread(target=self._sync_loop, name='ratelimit-sync', daemon=True).start()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning("Rate limit sync failed: %s", e)
+
+    # Storage
+
+    def check(self):
+        return self.backend.check()
+
+    def reset(self):
+        with self.lock:
+            self._counters.clear()
+            self._windows.clear()
+        return self.backend.reset()
+
+    def clear(self, key):
+        with self.lock:
+            self._counters.pop(key, None)
+            self._windows.pop(key, None)
+        self.backend.clear(key)
@@ -0,0 +1,127 @@
+# app/rbac/engine.py
+
+import os
+import logging
+import threading
+import time
+from .constants import ROLES
+
+logger = logging.getLogger(__name__)
+
+
+class RoleSnapshot:
+    """One compiled version of the role catalog; replaced as a whole when roles change."""
+
+    def __init__(self, version, masks):
+        self.version = version
+        self.masks = masks
+        # Effective mask per combination of role names, valid for this version only
+        self.principals = {}
+
+
+class RBACEngine:
+    """Resolves roles to permission bitmasks so every check is a single integer AND.
+
+    The built-in ROLES are overlaid with the roles stored in Cosmos DB, loaded into an
+    in-memory snapshot. A background thread per worker reloads them every
+    refresh_interval seconds and a version bump swaps in a new snapshot, so the request
+    path never touches the database. Role writes call refresh() to apply at once locally.
+    """
+
+    def __init__(self, loader=None, static_roles=None, refresh_interval=60, max_principals=4096):
+        self.loader = loader
+        self.static_roles = ROLES if static_roles is None else static_roles
+        self.refresh_interval = refresh_interval
+        self.max_principals = max_principals
+        # Permission bits are only ever added, so compiled masks stay valid across refreshes
+        self._bits = {}
+        self._bits_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresher_lock = threading.Lock()
+        self._refresher_pid = None
+        self._catalog = None
+        self._snapshot = self._compile(self.static_roles, 0)
+
+    def configure(self, loader=None, refresh_interval=None):
+        self.loader = loader
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def permission_mask(self, permissions):
+        mask = 0
+        for permission in permissions:
+            bit = self._bits.get(permission)
+            if bit is None:
+                with self._bits_lock:
+                    bit = self._bits.setdefault(permission, 1 << len(self._bits))
+            mask |= bit
+        return mask
+
+    def _compile(self, roles, version):
+        return RoleSnapshot(version, {name: self.permission_mask(permissions) for name, permissions in roles.items()})
+
+    def principal_mask(self, roles):
+        snapshot = self._snapshot
+        key = tuple(roles)
+        mask = snapshot.principals.get(key)
+        if mask is None:
+            mask = 0
+            for role in roles:
+                mask |= snapshot.masks.get(role, 0)
+            if len(snapshot.principals) >= self.max_principals:
+                snapshot.principals.clear()
+            snapshot.principals[key] = mask
+        return mask
+
+    def is_allowed(self, roles, required_mask):
+        self._ensure_refresher()
+        return self.principal_mask(roles) & required_mask == required_mask
+
+    def refresh(self):
+        """Reload roles from the loader; a changed catalog becomes a new snapshot version."""
+        if self.loader is None:
+            return self.version
+        with self._refresh_lock:
+            roles = dict(self.static_roles)
+            roles.update(self.loader())
+            catalog = {name: tuple(sorted(permissions)) for name, permissions in roles.items()}
+            if catalog != self._catalog:
+                self._snapshot = self._compile(roles, self._snapshot.version + 1)
+                self._catalog = catalog
+            return self.version
+
+    def _ensure_refresher(self):
+        # Started lazily and per process so workers forked from a preloaded master get their own
+        if self.loader is None or self.refresh_interval <= 0 or self._refresher_pid == os.getpid():
+            return
+        with self._refresher_lock:
+            if self._refresher_pid != os.getpid():
+                self._refresher_pid = os.getpid()
+                threading.Thread(target=self._refresh_loop, name='rbac-refresh', daemon=True).start()
+
+    def _refresh_loop(self):
+        # Roles are no longer loaded at startup; the first pass runs at once unless warm_up() loaded them
+        delay = 0 if self._catalog is None else self.refresh_interval
+        while True:
+            time.sleep(delay)
+            delay = self.refresh_interval
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Role refresh failed, keeping version %s: %s", self.version, e)
+
+
+rbac_engine = RBACEngine()
+
+
+def init_rbac(app, cosmos_client):
+    rbac_engine.configure(
+        loader=lambda: {role.name: role.permissions for role in cosmos_client.get_all_roles()},
+        refresh_interval=app.config.get('RBAC_REFRESH_SECONDS', 60)
+    )
+    app.extensions['rbac'] = rbac_engine
+    return rbac_engine
@@ -2,20 +2,22 @@
 
 from functools import wraps
 from flask import jsonify, g
-from .constants import ROLES
+from .engine import rbac_engine
+from ..metrics import stage
 
 def rbac_required(required_permissions):
+    required_mask = rbac_engine.permission_mask(required_permissions)
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if not g.user or not g.user.roles:
+            user = getattr(g, 'user', None)
+            if not user or not user.roles:
                 return jsonify({"error": "Unauthorized"}), 401
             
-            user_permissions = set()
-            for role in g.user.roles:
-                user_permissions.update(ROLES.get(role, []))
-            
-            if not set(required_permissions).issubset(user_permissions):
+            with stage('rbac'):
+                allowed = rbac_engine.is_allowed(user.roles, required_mask)
+            if not allowed:
                 return jsonify({"error": "Forbidden"}), 403
             
             return f(*args, **kwargs)
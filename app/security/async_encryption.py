@@ -0,0 +1,165 @@
+import asyncio
+import base64
+import logging
+import time
+from azure.keyvault.keys.aio import KeyClient
+from azure.keyvault.keys.crypto.aio import CryptographyClient
+from azure.keyvault.keys.crypto import EncryptionAlgorithm, KeyWrapAlgorithm
+from azure.identity.aio import DefaultAzureCredential
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .encryption import (DECRYPTION_ERROR_PREFIX, ENVELOPE_PREFIX, ENCRYPTION_MODES, seal_envelope, split_envelope,
+                         open_envelope)
+
+logger = logging.getLogger(__name__)
+
+class AsyncEncryptor:
+    """asyncio counterpart of Encryptor; reads and writes the same ciphertext formats.
+
+    Build it with ``await AsyncEncryptor.create(...)`` and ``await close()`` it on shutdown.
+    """
+
+    def __init__(self, key_vault_url, key_name, mode='rsa', credential=None, transport=None, key_version_ttl=None,
+                 data_key_store=None):
+        if mode not in ENCRYPTION_MODES:
+            raise ValueError(f"Unknown encryption mode: {mode}")
+        self.key_vault_url = key_vault_url
+        self.key_name = key_name
+        self.mode = mode
+        self.key_version_ttl = key_version_ttl
+        self._key_version_checked_at = time.monotonic()
+        self._refreshing = False
+        self._owns_credential = credential is None
+        self.credential = credential or DefaultAzureCredential()
+        # A transport shared with the caller's other clients; None lets each client open its own
+        self._client_kwargs = {} if transport is None else {'transport': transport}
+        self.key_client = KeyClient(vault_url=key_vault_url, credential=self.credential, **self._client_kwargs)
+        self.crypto_clients = {}
+        self._data_keys = {}
+        self._unwrapped_keys = {}
+        # Per key version being wrapped and per data key being unwrapped, like Encryptor's
+        self._key_locks = {}
+        # An AsyncDataKeyStore; None keeps one data key per process
+        self.data_key_store = data_key_store
+        self.current_key_version = None
+
+    @classmethod
+    async def create(cls, key_vault_url, key_name, mode='rsa', credential=None, transport=None, key_version_ttl=None,
+                     data_key_store=None):
+        encryptor = cls(key_vault_url, key_name, mode=mode, credential=credential, transport=transport,
+                        key_version_ttl=key_version_ttl, data_key_store=data_key_store)
+        key = await encryptor.key_client.get_key(key_name)
+        encryptor.current_key_version = key.properties.version
+        encryptor.crypto_clients[key.properties.version] = CryptographyClient(key, credential=encryptor.credential,
+                                                                                  **encryptor._client_kwargs)
+        return encryptor
+
+    async def _refresh_key_version(self):
+        if (self._refreshing or self.key_version_ttl is None
+                or time.monotonic() - self._key_version_checked_at < self.key_version_ttl):
+            return
+        # One task checks; the others carry on with the version they have
+        self._refreshing = True
+        try:
+            key = await self.key_client.get_key(self.key_name)
+            if key.properties.version != self.current_key_version:
+                if key.properties.version not in self.crypto_clients:
+                    self.crypto_clients[key.properties.version] = CryptographyClient(
+                        key, credential=self.credential, **self._client_kwargs)
+                logger.info("Switching from key version %s to %s", self.current_key_version, key.properties.version)
+                self.current_key_version = key.properties.version
+        except Exception as e:
+            logger.warning("Could not refresh the key version: %s", type(e).__name__)
+        finally:
+            self._key_version_checked_at = time.monotonic()
+            self._refreshing = False
+
+    async def _get_crypto_client(self, version=None):
+        version = version or self.current_key_version
+        crypto_client = self.crypto_clients.get(version)
+        if crypto_client is None:
+            key = await self.key_client.get_key(self.key_name, version=version)
+            crypto_client = CryptographyClient(key, credential=self.credential, **self._client_kwargs)
+            self.crypto_clients[version] = crypto_client
+        return crypto_client
+
+    def _lock_for(self, key):
+        # Only ever used from the event loop's thread, so no lock is needed around the dict
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = asyncio.Lock()
+        return lock
+
+    async def _get_data_key(self, version):
+        entry = self._data_keys.get(version)
+        if entry is None:
+            async with self._lock_for(version):
+                entry = self._data_keys.get(version)
+                if entry is None:
+                    entry = self._data_keys[version] = await self._load_data_key(version)
+        return entry
+
+    async def _load_data_key(self, version):
+        if self.data_key_store is None:
+            return await self._new_data_key(version)
+        try:
+            wrapped_key = await self.data_key_store.get(version)
+        except Exception as e:
+            logger.warning("Could not load the data key of version %s, using a new one: %s", version, type(e).__name__)
+            return await self._new_data_key(version)
+        if wrapped_key is None:
+            wrapped_key, data_key = await self._new_data_key(version)
+            try:
+                wrapped_key = await self.data_key_store.add(version, wrapped_key)
+            except Exception as e:
+                logger.warning("Could not store the data key of version %s: %s", version, type(e).__name__)
+                return wrapped_key, data_key
+        return wrapped_key, await self._unwrap_data_key(wrapped_key, version)
+
+    async def _new_data_key(self, version):
+        data_key = AESGCM.generate_key(bit_length=256)
+        crypto_client = await self._get_crypto_client(version)
+        wrap_result = await crypto_client.wrap_key(KeyWrapAlgorithm.rsa_oaep, data_key)
+        self._unwrapped_keys[wrap_result.encrypted_key] = data_key
+        return wrap_result.encrypted_key, data_key
+
+    async def _unwrap_data_key(self, wrapped_key, version):
+        data_key = self._unwrapped_keys.get(wrapped_key)
+        if data_key is None:
+            async with self._lock_for(wrapped_key):
+                data_key = self._unwrapped_keys.get(wrapped_key)
+                if data_key is None:
+                    crypto_client = await self._get_crypto_client(version)
+                    unwrap_result = await crypto_client.unwrap_key(KeyWrapAlgorithm.rsa_oaep, wrapped_key)
+                    data_key = unwrap_result.key
+                    self._unwrapped_keys[wrapped_key] = data_key
+        return data_key
+
+    async def encrypt(self, plaintext):
+        await self._refresh_key_version()
+        version = self.current_key_version
+        if self.mode == 'envelope':
+            wrapped_key, data_key = await self._get_data_key(version)
+            return seal_envelope(wrapped_key, data_key, plaintext, version)
+        crypto_client = await self._get_crypto_client(version)
+        result = await crypto_client.encrypt(EncryptionAlgorithm.rsa_oaep, plaintext.encode())
+        return f"{base64.b64encode(result.ciphertext).decode()}|{version}"
+
+    async def decrypt(self, ciphertext):
+        try:
+            encrypted_data, version = ciphertext.rsplit("|", 1)
+            if encrypted_data.startswith(ENVELOPE_PREFIX):
+                wrapped_key, payload = split_envelope(encrypted_data)
+                return open_envelope(await self._unwrap_data_key(wrapped_key, version), payload, version)
+            crypto_client = await self._get_crypto_client(version)
+            result = await crypto_client.decrypt(EncryptionAlgorithm.rsa_oaep, base64.b64decode(encrypted_data))
+            return result.plaintext.decode()
+        except Exception as e:
+            logger.warning("Decryption error: %s", type(e).__name__)
+            return f"{DECRYPTION_ERROR_PREFIX}: {str(e)}]"
+
+    async def close(self):
+        for crypto_client in self.crypto_clients.values():
+            await crypto_client.close()
+        await self.key_client.close()
+        if self._owns_credential:
+            await self.credential.close()
@@ -1,50 +1,197 @@
-from azure.keyvault.keys import KeyClient
-from azure.keyvault.keys.crypto import CryptographyClient, EncryptionAlgorithm
-from azure.identity import DefaultAzureCredential
+from azure.keyvault.keys.crypto import EncryptionAlgorithm, KeyWrapAlgorithm
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import base64
+import logging
+import os
+import threading
+import time
+from ..clients import get_registry
+from ..metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Envelope ciphertexts look like "env1:<wrapped data key>:<nonce + AES-GCM ciphertext>|<key version>".
+# Legacy ciphertexts are "<RSA-OAEP ciphertext>|<key version>"; both decrypt side by side.
+ENVELOPE_PREFIX = "env1:"
+ENCRYPTION_MODES = ('rsa', 'envelope')
+# decrypt() returns this, followed by the error, instead of raising
+DECRYPTION_ERROR_PREFIX = "[Decryption Error"
+
+def seal_envelope(wrapped_key, data_key, plaintext, version):
+    nonce = os.urandom(12)
+    ciphertext = AESGCM(data_key).encrypt(nonce, plaintext.encode(), str(version).encode())
+    return (f"{ENVELOPE_PREFIX}{base64.b64encode(wrapped_key).decode()}:"
+            f"{base64.b64encode(nonce + ciphertext).decode()}|{version}")
+
+def split_envelope(encrypted_data):
+    """Split the part before '|version' into the wrapped data key and the AES-GCM payload."""
+    wrapped_key, payload = encrypted_data[len(ENVELOPE_PREFIX):].split(":", 1)
+    return base64.b64decode(wrapped_key), base64.b64decode(payload)
+
+def open_envelope(data_key, payload, version):
+    return AESGCM(data_key).decrypt(payload[:12], payload[12:], str(version).encode()).decode()
 
 class Encryptor:
-    def __init__(self, key_vault_url, key_name):
+    def __init__(self, key_vault_url, key_name, mode='rsa', registry=None, key_version_ttl=None, data_key_store=None):
+        if mode not in ENCRYPTION_MODES:
+            raise ValueError(f"Unknown encryption mode: {mode}")
         self.key_vault_url = key_vault_url
         self.key_name = key_name
-        self.credential = DefaultAzureCredential()
-        self.key_client = KeyClient(vault_url=key_vault_url, credential=self.credential)
+        self.mode = mode
+        # Seconds between checks for a newer key version created by another worker; None never checks
+        self.key_version_ttl = key_version_ttl
+        self._key_version_checked_at = time.monotonic()
+        self._refresh_lock = threading.Lock()
+        self.registry = registry or get_registry()
+        self.key_client = self.registry.key_client(key_vault_url)
+        self.crypto_clients = {}
+        self._data_keys = {}
+        self._unwrapped_keys = {}
+        self._data_key_lock = threading.Lock()
+        # One lock per key version being wrapped and per data key being unwrapped, so Key Vault
+        # calls for different keys overlap and only callers needing the same key wait
+        self._key_locks = {}
+        # Shares one data key per key version between workers (a DataKeyStore); None keeps one per process
+        self.data_key_store = data_key_store
         self.current_key_version = self._get_latest_key_version()
         self.crypto_client = self._get_crypto_client()
 
     def _get_latest_key_version(self):
-        keys = list(self.key_client.list_properties_of_keys())
-        if not keys:
-            raise ValueError("No keys found in the key vault")
-        latest_key = max(
-            (k for k in keys if getattr(k, 'name', None) == self.key_name),
-            key=lambda k: getattr(getattr(k, 'properties', None), 'version', '') or ''
-        )
-        return getattr(getattr(latest_key, 'properties', None), 'version', None)
-
-    def _get_crypto_client(self):
-        key = self.key_client.get_key(self.key_name, version=self.current_key_version)
-        return CryptographyClient(key, credential=self.credential)
+        return self.registry.get_key(self.key_vault_url, self.key_name).properties.version
+
+    def use_key_version(self, version):
+        """Encrypt with key version from now on, e.g. one another worker rotated to."""
+        if version != self.current_key_version:
+            self.crypto_client = self._get_crypto_client(version)
+            logger.info("Switching from key version %s to %s", self.current_key_version, version)
+            self.current_key_version = version
+
+    def _refresh_key_version(self):
+        if self.key_version_ttl is None or time.monotonic() - self._key_version_checked_at < self.key_version_ttl:
+            return
+        # One thread checks; the others carry on with the version they have
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self.registry.forget_key(self.key_vault_url, self.key_name)
+            self.use_key_version(self._get_latest_key_version())
+        except Exception as e:
+            logger.warning("Could not refresh the key version: %s", type(e).__name__)
+        finally:
+            self._key_version_checked_at = time.monotonic()
+            self._refresh_lock.release()
+
+    def _get_crypto_client(self, version=None):
+        version = version or self.current_key_version
+        crypto_client = self.crypto_clients.get(version)
+        if crypto_client is None:
+            crypto_client = self.registry.crypto_client(self.registry.get_key(self.key_vault_url, self.key_name, version))
+            self.crypto_clients[version] = crypto_client
+        return crypto_client
+
+    def _lock_for(self, key):
+        with self._data_key_lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
 
+    def _get_data_key(self, version):
+        """Return the (wrapped, plain) data key for a key version, loading or wrapping it on first use."""
+        entry = self._data_keys.get(version)
+        if entry is None:
+            with self._lock_for(version):
+                entry = self._data_keys.get(version)
+                if entry is None:
+                    entry = self._data_keys[version] = self._load_data_key(version)
+        return entry
+
+    def _load_data_key(self, version):
+        if self.data_key_store is None:
+            return self._new_data_key(version)
+        try:
+            wrapped_key = self.data_key_store.get(version)
+        except Exception as e:
+            logger.warning("Could not load the data key of version %s, using a new one: %s", version, type(e).__name__)
+            return self._new_data_key(version)
+        if wrapped_key is None:
+            wrapped_key, data_key = self._new_data_key(version)
+            try:
+                # Another worker may have stored its own in the meantime; then that one is used
+                wrapped_key = self.data_key_store.add(version, wrapped_key)
+            except Exception as e:
+                logger.warning("Could not store the data key of version %s: %s", version, type(e).__name__)
+                return wrapped_key, data_key
+        return wrapped_key, self._unwrap_data_key(wrapped_key, version)
+
+    def _new_data_key(self, version):
+        data_key = AESGCM.generate_key(bit_length=256)
+        wrap_result = self._get_crypto_client(version).wrap_key(KeyWrapAlgorithm.rsa_oaep, data_key)
+        self._unwrapped_keys[wrap_result.encrypted_key] = data_key
+        return wrap_result.encrypted_key, data_key
+
+    def _unwrap_data_key(self, wrapped_key, version):
+        """Unwrap a data key through Key Vault once and serve it from memory afterwards."""
+        data_key = self._unwrapped_keys.get(wrapped_key)
+        if data_key is None:
+            with self._lock_for(wrapped_key):
+                data_key = self._unwrapped_keys.get(wrapped_key)
+                if data_key is None:
+                    unwrap_result = self._get_crypto_client(version).unwrap_key(KeyWrapAlgorithm.rsa_oaep, wrapped_key)
+                    data_key = unwrap_result.key
+                    self._unwrapped_keys[wrapped_key] = data_key
+        return data_key
+
+    def _envelope_encrypt(self, plaintext):
+        version = self.current_key_version
+        wrapped_key, data_key = self._get_data_key(version)
+        return seal_envelope(wrapped_key, data_key, plaintext, version)
+
+    def _envelope_decrypt(self, encrypted_data, version):
+        wrapped_key, payload = split_envelope(encrypted_data)
+        return open_envelope(self._unwrap_data_key(wrapped_key, version), payload, version)
+
+    @timed('crypto')
     def encrypt(self, plaintext):
+        self._refresh_key_version()
+        if self.mode == 'envelope':
+            return self._envelope_encrypt(plaintext)
         result = self.crypto_client.encrypt(EncryptionAlgorithm.rsa_oaep, plaintext.encode())
         return f"{base64.b64encode(result.ciphertext).decode()}|{self.current_key_version}"
 
+    @timed('crypto')
     def decrypt(self, ciphertext):
         try:
-            encrypted_data, _ = ciphertext.rsplit("|", 1)
-            result = self.crypto_client.decrypt(EncryptionAlgorithm.rsa_oaep, base64.b64decode(encrypted_data))
+            encrypted_data, version = ciphertext.rsplit("|", 1)
+            if encrypted_data.startswith(ENVELOPE_PREFIX):
+                return self._envelope_decrypt(encrypted_data, version)
+            result = self._get_crypto_client(version).decrypt(EncryptionAlgorithm.rsa_oaep, base64.b64decode(encrypted_data))
             return result.plaintext.decode()
         except Exception as e:
-            print(f"Decryption error: {str(e)}")
-            return f"[Decryption Error: {str(e)}]"
+            logger.warning("Decryption error: %s", type(e).__name__)
+            return f"{DECRYPTION_ERROR_PREFIX}: {str(e)}]"
 
     def rotate_key(self):
-        new_key = self.key_client.create_rsa_key(f"{self.key_name_prefix}-{self.current_key_version + 1}")
+        new_key = self.key_client.create_rsa_key(self.key_name)
+        self.registry.forget_key(self.key_vault_url, self.key_name)
+        self.crypto_clients[new_key.properties.version] = self.registry.crypto_client(new_key)
         self.current_key_version = new_key.properties.version
-        self.crypto_clients[self.current_key_version] = CryptographyClient(new_key, credential=self.credential)
+        self.crypto_client = self.crypto_clients[self.current_key_version]
+        self._key_version_checked_at = time.monotonic()
         return self.current_key_version
 
+    @staticmethod
+    def is_decryption_error(value):
+        """True if value is what decrypt() returned for a field it could not decrypt."""
+        return isinstance(value, str) and value.startswith(DECRYPTION_ERROR_PREFIX)
+
+    @staticmethod
+    def key_version_of(ciphertext):
+        """Return the key version a stored ciphertext was encrypted with, or None."""
+        if not isinstance(ciphertext, str) or "|" not in ciphertext:
+            return None
+        return ciphertext.rsplit("|", 1)[1]
+
     def re_encrypt_data(self, data):
         decrypted = self.decrypt(data)
         return self.encrypt(decrypted)
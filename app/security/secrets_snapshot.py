@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from cryptography.fernet import Fernet, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+
+class SecretsSnapshot:
+    """Key Vault secret values kept in a local file, Fernet-encrypted and valid for ttl seconds.
+
+    A booting worker reads the snapshot instead of making a Key Vault round trip per secret,
+    then refreshes it in the background. The Fernet key (SECRETS_SNAPSHOT_KEY) must come
+    from the environment or a mounted secret, never from a file next to the snapshot.
+    """
+
+    def __init__(self, path, key, ttl, vault_url):
+        self.path = path
+        self.fernet = Fernet(key)
+        self.ttl = ttl
+        self.vault_url = vault_url
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the snapshot configured on a Config class, or None when it is disabled."""
+        if not (config.SECRETS_SNAPSHOT_PATH and config.SECRETS_SNAPSHOT_KEY):
+            return None
+        return cls(config.SECRETS_SNAPSHOT_PATH, config.SECRETS_SNAPSHOT_KEY,
+                   config.SECRETS_SNAPSHOT_TTL, config.KEY_VAULT_URL)
+
+    def load(self):
+        """Return the stored secrets, or None if the snapshot is missing, expired or unreadable."""
+        try:
+            with open(self.path, 'rb') as f:
+                token = f.read()
+            data = json.loads(self.fernet.decrypt(token, ttl=self.ttl))
+        except FileNotFoundError:
+            return None
+        except (InvalidToken, ValueError, OSError) as e:
+            logger.warning("Ignoring secrets snapshot %s: %s", self.path, type(e).__name__)
+            return None
+        if data.get('vault_url') != self.vault_url:
+            return None
+        return data['secrets']
+
+    def save(self, secrets):
+        token = self.fernet.encrypt(json.dumps({'vault_url': self.vault_url, 'secrets': secrets}).encode())
+        # mkstemp creates the file readable by this user only; os.replace swaps it in atomically
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.secrets-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(token)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def refresh_in_background(self, registry, names):
+        """Re-read the secrets from Key Vault on a daemon thread and rewrite the snapshot."""
+        def refresh():
+            values, errors = registry.get_secrets(self.vault_url, names, refresh=True)
+            if errors:
+                logger.warning("Secrets snapshot refresh failed for: %s", ', '.join(sorted(errors)))
+                return
+            try:
+                self.save(values)
+            except OSError as e:
+                logger.warning("Could not write secrets snapshot %s: %s", self.path, e)
+
+        thread = threading.Thread(target=refresh, name='secrets-snapshot-refresh', daemon=True)
+        thread.start()
+        return thread
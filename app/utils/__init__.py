@@ -1 +1 @@
-from .helpers import https_url_for, ensure_https
\ No newline at end of file
+from .helpers import https_url_for, ensure_https, encode_continuation, decode_continuation
\ No newline at end of file
@@ -1,3 +1,4 @@
+import base64
 from flask import request, url_for
 
 def ensure_https(url):
@@ -9,4 +10,19 @@ def ensure_https(url):
 def https_url_for(endpoint, **values):
     """Like url_for, but ensures the URL uses HTTPS."""
     url = url_for(endpoint, **values, _external=True)
-    return ensure_https(url)
\ No newline at end of file
+    return ensure_https(url)
+
+def encode_continuation(token):
+    """Make a Cosmos continuation token safe to pass around in a query string."""
+    if token is None:
+        return None
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+def decode_continuation(token):
+    """Reverse encode_continuation; raises ValueError on a malformed token."""
+    if not token:
+        return None
+    try:
+        return base64.b64decode(token.encode(), altchars=b'-_', validate=True).decode()
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid continuation token") from e
\ No newline at end of file
@@ -0,0 +1,2 @@
+from .fakes import FakeRegistry, LatencyProfile, Services, PROFILES
+from .runner import Benchmark, DEFAULT_MIX, compare, format_report, load_mix, summarize
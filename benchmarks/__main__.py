@@ -0,0 +1,45 @@
+import argparse
+import json
+import sys
+from .fakes import PROFILES
+from .runner import Benchmark, compare, format_report, load_mix, summarize
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Replay a request mix against the app on local Cosmos DB and Key Vault stand-ins.")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='azure',
+                        help="latency and throttling of the stand-ins (default: azure)")
+    parser.add_argument('--mix', help="JSONL file of requests: {method, path, auth, json, weight, name}")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--users', type=int, default=1000, help="users stored before the run")
+    parser.add_argument('--seed', type=int, default=0, help="makes the mix and the latencies repeatable")
+    parser.add_argument('--no-allocations', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--output', help="write the report as JSON to this file")
+    parser.add_argument('--baseline', help="JSON report of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed p95 and throughput regression against the baseline (default: 0.2)")
+    args = parser.parse_args()
+
+    mix = load_mix(args.mix) if args.mix else None
+    benchmark = Benchmark(args.profile, seed=args.seed)
+    benchmark.seed_users(args.users)
+    samples, statuses, duration = benchmark.run(mix, requests=args.requests, concurrency=args.concurrency,
+                                                warmup=args.warmup)
+    allocations = None if args.no_allocations else benchmark.measure_allocations(mix)
+    report = summarize(samples, statuses, duration, allocations)
+    report.update(profile=args.profile, concurrency=args.concurrency, services=benchmark.services.stats())
+    print(format_report(report))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,393 @@
+import copy
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from types import SimpleNamespace
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError
+from azure.cosmos import exceptions
+from app.clients import ClientRegistry
+from app.metrics import record_stage
+
+QUERY_PATTERN = re.compile(r'^\s*SELECT\s+(?P<projection>.+?)\s+FROM\s+c(?:\s+WHERE\s+(?P<filter>.+))?$',
+                           re.IGNORECASE | re.DOTALL)
+EQUALS_PATTERN = re.compile(r"c\.(\w+)\s*=\s*'([^']*)'")
+FIELD_PATTERN = re.compile(r'c(?:\.(\w+)|\["(\w+)"\])')
+
+
+class LatencyProfile:
+    """How long one kind of call takes and how often the service throttles it."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, throttle_rate=0.0, retry_after_ms=10):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.retry_after_ms = retry_after_ms
+
+
+# Call kinds: cosmos.read, cosmos.query (per page), cosmos.write, keyvault.keys, keyvault.crypto, keyvault.secrets
+PROFILES = {
+    'instant': {},
+    'azure': {
+        'cosmos.read': LatencyProfile(4, 2),
+        'cosmos.query': LatencyProfile(8, 4),
+        'cosmos.write': LatencyProfile(7, 3),
+        'keyvault.keys': LatencyProfile(25, 10),
+        'keyvault.crypto': LatencyProfile(20, 10),
+        'keyvault.secrets': LatencyProfile(25, 10),
+    },
+    'throttled': {
+        'cosmos.read': LatencyProfile(4, 2, throttle_rate=0.05),
+        'cosmos.query': LatencyProfile(8, 4, throttle_rate=0.05),
+        'cosmos.write': LatencyProfile(7, 3, throttle_rate=0.1),
+        'keyvault.keys': LatencyProfile(25, 10),
+        'keyvault.crypto': LatencyProfile(20, 10, throttle_rate=0.02, retry_after_ms=1000),
+        'keyvault.secrets': LatencyProfile(25, 10),
+    },
+}
+
+
+class Services:
+    """Applies a latency profile to every fake call and counts the calls by kind."""
+
+    def __init__(self, profile=None, seed=None):
+        if isinstance(profile, str):
+            profile = PROFILES[profile]
+        self.profile = profile or {}
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.throttled = {}
+        self.suspended = False
+
+    @contextmanager
+    def suspend(self):
+        """Serve calls instantly and never throttle, e.g. while seeding data."""
+        self.suspended = True
+        try:
+            yield
+        finally:
+            self.suspended = False
+
+    def call(self, kind):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            profile = self.profile.get(kind)
+            if profile is None or self.suspended:
+                return
+            delay = profile.latency_ms + self.random.uniform(-profile.jitter_ms, profile.jitter_ms)
+            throttled = self.random.random() < profile.throttle_rate
+            if throttled:
+                self.throttled[kind] = self.throttled.get(kind, 0) + 1
+        if delay > 0:
+            time.sleep(delay / 1000)
+            # What TimedTransport reports for the real clients
+            record_stage(kind.partition('.')[0], delay / 1000)
+        if throttled:
+            raise self._throttle_error(kind, profile.retry_after_ms)
+
+    @staticmethod
+    def _throttle_error(kind, retry_after_ms):
+        if kind.startswith('cosmos.'):
+            error = exceptions.CosmosHttpResponseError(status_code=429, message='Request rate is large')
+            error.headers = {'x-ms-retry-after-ms': str(retry_after_ms)}
+        else:
+            error = HttpResponseError(message='Too many requests')
+            error.status_code = 429
+            error.headers = {'Retry-After': str(retry_after_ms / 1000)}
+        return error
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'throttled': dict(self.throttled)}
+
+
+class FakePages:
+    """What ItemPaged.by_page() returns: an iterator of pages with a continuation_token."""
+
+    def __init__(self, services, documents, page_size, continuation):
+        self.services = services
+        self.documents = documents
+        self.page_size = page_size or len(documents) or 1
+        self.offset = int(continuation or 0)
+        self.continuation_token = continuation
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        self.services.call('cosmos.query')
+        page = self.documents[self.offset:self.offset + self.page_size]
+        self.offset += self.page_size
+        self.done = self.offset >= len(self.documents)
+        self.continuation_token = None if self.done else str(self.offset)
+        return page
+
+
+class FakeQueryResult:
+    def __init__(self, services, documents, page_size=None):
+        self.services = services
+        self.documents = documents
+        self.page_size = page_size
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return FakePages(self.services, self.documents, self.page_size, continuation_token)
+
+
+class FakeContainer:
+    """An in-memory container partitioned on /id.
+
+    Queries understand 'SELECT * | c.a, c["b"] FROM c', the @internal_types list filter and
+    c.field = 'value' conditions; anything else in a WHERE clause is ignored.
+    """
+
+    def __init__(self, services, id='items'):
+        self.services = services
+        self.id = id
+        self.documents = {}
+        self.indexing_policy = {'indexingMode': 'consistent', 'automatic': True}
+        self._etags = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _stored(self, body):
+        document = copy.deepcopy(body)
+        document['_etag'] = f'"{next(self._etags)}"'
+        document['_ts'] = int(time.time())
+        self.documents[document['id']] = document
+        return copy.deepcopy(document)
+
+    @staticmethod
+    def _not_found(id):
+        return exceptions.CosmosResourceNotFoundError(status_code=404, message=f'Entity {id} does not exist')
+
+    def read_item(self, item, partition_key, etag=None, match_condition=None, **kwargs):
+        self.services.call('cosmos.read')
+        with self._lock:
+            document = self.documents.get(item)
+            if document is None:
+                raise self._not_found(item)
+            if match_condition == MatchConditions.IfModified and etag == document['_etag']:
+                # 304 Not Modified carries no body
+                return {}
+            return copy.deepcopy(document)
+
+    def create_item(self, body, **kwargs):
+        self.services.call('cosmos.write')
+        with self._lock:
+            if body['id'] in self.documents:
+                raise exceptions.CosmosResourceExistsError(status_code=409, message='Entity already exists')
+            return self._stored(body)
+
+    def upsert_item(self, body, **kwargs):
+        self.services.call('cosmos.write')
+        with self._lock:
+            return self._stored(body)
+
+    def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        self.services.call('cosmos.write')
+        with self._lock:
+            current = self.documents.get(item)
+            if current is None:
+                raise self._not_found(item)
+            if match_condition == MatchConditions.IfNotModified and etag != current['_etag']:
+                raise exceptions.CosmosAccessConditionFailedError(status_code=412, message='Precondition failed')
+            return self._stored(body)
+
+    def delete_item(self, item, partition_key, **kwargs):
+        self.services.call('cosmos.write')
+        with self._lock:
+            if self.documents.pop(item, None) is None:
+                raise self._not_found(item)
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        self.services.call('cosmos.write')
+        with self._lock:
+            before = dict(self.documents)
+            responses = []
+            for index, (operation, args) in enumerate(batch_operations):
+                if operation == 'delete':
+                    status = 204 if self.documents.pop(args[0], None) is not None else 404
+                elif operation == 'create' and args[0]['id'] in self.documents:
+                    status = 409
+                else:
+                    written = self._stored(args[0])
+                    responses.append({'statusCode': 201 if operation == 'create' else 200, 'eTag': written['_etag']})
+                    continue
+                if status >= 400:
+                    # All or nothing: roll back and mark the other operations as failed dependencies
+                    self.documents = before
+                    responses = [{'statusCode': 424} for _ in batch_operations]
+                    responses[index] = {'statusCode': status}
+                    raise exceptions.CosmosBatchOperationError(error_index=index, headers={}, status_code=status,
+                                                               message='Batch failed', operation_responses=responses)
+                responses.append({'statusCode': status})
+            return responses
+
+    def query_items(self, query, parameters=None, max_item_count=None, **kwargs):
+        match = QUERY_PATTERN.match(query)
+        if match is None:
+            raise exceptions.CosmosHttpResponseError(status_code=400, message=f'Unsupported query: {query}')
+        values = {parameter['name']: parameter['value'] for parameter in parameters or []}
+        condition = match.group('filter') or ''
+        with self._lock:
+            documents = list(self.documents.values())
+        if '@internal_types' in values:
+            documents = [document for document in documents if document.get('type') not in values['@internal_types']]
+        for field, value in EQUALS_PATTERN.findall(condition):
+            documents = [document for document in documents if document.get(field) == value]
+        projection = match.group('projection').strip()
+        if projection != '*':
+            fields = [dotted or quoted for dotted, quoted in FIELD_PATTERN.findall(projection)]
+            documents = [{field: document[field] for field in fields if field in document} for document in documents]
+        return FakeQueryResult(self.services, copy.deepcopy(documents), max_item_count)
+
+    def read(self, **kwargs):
+        self.services.call('cosmos.read')
+        return {'id': self.id, 'indexingPolicy': copy.deepcopy(self.indexing_policy)}
+
+
+class FakeDatabase:
+    def __init__(self, services):
+        self.services = services
+        self.containers = {}
+
+    def get_container_client(self, container):
+        return self.containers.setdefault(container, FakeContainer(self.services, container))
+
+    def replace_container(self, container, partition_key=None, indexing_policy=None, **kwargs):
+        fake = self.get_container_client(getattr(container, 'id', container))
+        if indexing_policy is not None:
+            fake.indexing_policy = copy.deepcopy(indexing_policy)
+        return fake
+
+
+class FakeCosmosClient:
+    def __init__(self, services):
+        self.services = services
+        self.databases = {}
+
+    def get_database_client(self, database):
+        return self.databases.setdefault(database, FakeDatabase(self.services))
+
+    def close(self):
+        pass
+
+
+class FakeKeyClient:
+    """Key Vault keys: every name starts with one version; create_rsa_key adds another."""
+
+    def __init__(self, services, vault_url):
+        self.services = services
+        self.vault_url = vault_url
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def _key(self, name, version):
+        return SimpleNamespace(id=f"{self.vault_url.rstrip('/')}/keys/{name}/{version}", name=name,
+                               properties=SimpleNamespace(version=version))
+
+    def get_key(self, name, version=None):
+        self.services.call('keyvault.keys')
+        with self._lock:
+            versions = self.versions.setdefault(name, [uuid.uuid4().hex])
+        if version is not None and version not in versions:
+            raise HttpResponseError(message=f'Key {name}/{version} not found')
+        return self._key(name, version or versions[-1])
+
+    def create_rsa_key(self, name, **kwargs):
+        self.services.call('keyvault.keys')
+        with self._lock:
+            versions = self.versions.setdefault(name, [])
+            versions.append(uuid.uuid4().hex)
+        return self._key(name, versions[-1])
+
+    def close(self):
+        pass
+
+
+class FakeCryptographyClient:
+    """Reversible stand-ins for RSA-OAEP encrypt and key wrap; only the round trip is simulated."""
+
+    def __init__(self, services, key):
+        self.services = services
+        self.tag = key.id.encode() + b'\0'
+
+    def _seal(self, data):
+        self.services.call('keyvault.crypto')
+        return self.tag + bytes(data)
+
+    def _open(self, data):
+        self.services.call('keyvault.crypto')
+        if not data.startswith(self.tag):
+            raise HttpResponseError(message='Ciphertext was not produced with this key')
+        return data[len(self.tag):]
+
+    def encrypt(self, algorithm, plaintext):
+        return SimpleNamespace(ciphertext=self._seal(plaintext))
+
+    def decrypt(self, algorithm, ciphertext):
+        return SimpleNamespace(plaintext=self._open(ciphertext))
+
+    def wrap_key(self, algorithm, key):
+        return SimpleNamespace(encrypted_key=self._seal(key))
+
+    def unwrap_key(self, algorithm, encrypted_key):
+        return SimpleNamespace(key=self._open(encrypted_key))
+
+    def close(self):
+        pass
+
+
+class FakeSecretClient:
+    def __init__(self, services, secrets):
+        self.services = services
+        self.secrets = secrets
+
+    def get_secret(self, name, version=None):
+        self.services.call('keyvault.secrets')
+        if name not in self.secrets:
+            raise HttpResponseError(message=f'Secret {name} not found')
+        return SimpleNamespace(name=name, value=self.secrets[name])
+
+    def close(self):
+        pass
+
+
+class FakeRegistry(ClientRegistry):
+    """A ClientRegistry whose Azure clients are the in-process fakes above.
+
+    Install it with app.clients.set_registry before create_app; every client the app builds
+    then shares one Services, so a single profile shapes the whole run.
+    """
+
+    def __init__(self, services=None, secrets=None):
+        super().__init__()
+        self.services = services or Services()
+        self.secret_values = {'COSMOS-KEY': 'fake-cosmos-key'} if secrets is None else secrets
+
+    def credential(self):
+        return self._memoized(self._clients, ('credential',), object)
+
+    def secret_client(self, vault_url):
+        return self._memoized(self._clients, ('secrets', vault_url),
+                              lambda: FakeSecretClient(self.services, self.secret_values))
+
+    def key_client(self, vault_url):
+        return self._memoized(self._clients, ('keys', vault_url), lambda: FakeKeyClient(self.services, vault_url))
+
+    def crypto_client(self, key):
+        return self._memoized(self._clients, ('crypto', key.id), lambda: FakeCryptographyClient(self.services, key))
+
+    def cosmos_client(self, endpoint, credential):
+        return self._memoized(self._clients, ('cosmos', endpoint), lambda: FakeCosmosClient(self.services))
@@ -0,0 +1,259 @@
+import base64
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask_jwt_extended import create_access_token
+from app import create_app, warm_up
+from app.clients import set_registry
+from config import Config
+from .fakes import FakeRegistry, Services
+
+BASE_URL = 'https://localhost'
+SEED_CHUNK = 1000
+
+# Config.* defaults with local credentials; the Azure endpoints are only names for the fakes
+BENCHMARK_CONFIG = {
+    'COSMOS_ENDPOINT': 'https://benchmark.documents.azure.com:443/',
+    'DATABASE_NAME': 'benchmark',
+    'CONTAINER_NAME': 'users',
+    'KEY_VAULT_URL': 'https://benchmark.vault.azure.net/',
+    'KEY_NAME': 'benchmark-key',
+    'SECRET_KEY': 'benchmark-secret-key',
+    'JWT_SECRET_KEY': 'benchmark-jwt-secret-key',
+    'API_KEY': 'benchmark-api-key',
+    'BASIC_AUTH_USERNAME': 'benchmark',
+    'BASIC_AUTH_PASSWORD': 'benchmark-password',
+    'GITHUB_CLIENT_ID': 'benchmark',
+    'GITHUB_CLIENT_SECRET': 'benchmark',
+    # One principal sends everything, so the per-caller limits would only measure 429s
+    'RATELIMIT_ENABLED': False,
+    'RATELIMIT_STORAGE_URI': 'memory://',
+    'LOG_LEVEL': 'ERROR',
+    'LOG_FILE': None,
+}
+
+# One request per line in a mix file; '{id}' becomes a seeded user id and '{uuid}' a new one
+DEFAULT_MIX = [
+    {'name': 'GET /users/<id>', 'method': 'GET', 'path': '/api/users/{id}', 'auth': 'jwt', 'weight': 10},
+    {'name': 'GET /users/<id>?fields', 'method': 'GET', 'path': '/api/users/{id}?fields=id,email',
+     'auth': 'api_key', 'weight': 3},
+    {'name': 'GET /users?limit', 'method': 'GET', 'path': '/api/users?limit=50', 'auth': 'api_key', 'weight': 3},
+    {'name': 'POST /users', 'method': 'POST', 'path': '/api/users', 'auth': 'basic', 'weight': 2,
+     'json': {'id': '{uuid}', 'name': 'Benchmark {uuid}', 'email': 'benchmark@example.com'}},
+    {'name': 'PUT /users/<id>', 'method': 'PUT', 'path': '/api/users/{id}', 'auth': 'api_key', 'weight': 1,
+     'json': {'name': 'Renamed user', 'email': 'renamed@example.com'}},
+    {'name': 'PUT /users:batch', 'method': 'PUT', 'path': '/api/users:batch', 'auth': 'api_key', 'weight': 1,
+     'json': [{'id': '{id}', 'name': 'Batch user', 'email': 'batch@example.com'} for _ in range(10)]},
+]
+
+
+def load_mix(path):
+    """Read a request mix from a JSONL file; lines that are not request samples are skipped."""
+    mix = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, dict) and entry.get('method') and entry.get('path'):
+                entry.setdefault('name', f"{entry['method']} {entry['path']}")
+                mix.append(entry)
+    if not mix:
+        raise ValueError(f"{path} holds no request samples (objects with 'method' and 'path')")
+    return mix
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def render(value, ids, rng):
+    if isinstance(value, str):
+        if '{id}' in value:
+            value = value.replace('{id}', rng.choice(ids))
+        if '{uuid}' in value:
+            value = value.replace('{uuid}', str(uuid.uuid4()))
+        return value
+    if isinstance(value, list):
+        return [render(item, ids, rng) for item in value]
+    if isinstance(value, dict):
+        return {key: render(item, ids, rng) for key, item in value.items()}
+    return value
+
+
+class Benchmark:
+    """The create_app WSGI app on in-process Cosmos DB and Key Vault fakes, driven by a request mix."""
+
+    def __init__(self, profile='instant', config=None, seed=None):
+        self.services = Services(profile, seed=seed)
+        self.registry = FakeRegistry(self.services)
+        self.seed = seed
+        self.ids = []
+        previous = set_registry(self.registry)
+        try:
+            self.app = create_app(dict(self._defaults(), **BENCHMARK_CONFIG, **(config or {})))
+            # The clients are built lazily and pick up the registry when they are; build them on the fakes
+            with self.services.suspend():
+                warm_up(self.app)
+        finally:
+            set_registry(previous)
+        with self.app.app_context():
+            token = create_access_token(identity='benchmark', additional_claims={'roles': ['admin']})
+        basic = base64.b64encode(
+            f"{BENCHMARK_CONFIG['BASIC_AUTH_USERNAME']}:{BENCHMARK_CONFIG['BASIC_AUTH_PASSWORD']}".encode()).decode()
+        self.auth_headers = {
+            'api_key': {'X-API-Key': self.app.config['API_KEY']},
+            'jwt': {'Authorization': f'Bearer {token}'},
+            'basic': {'Authorization': f'Basic {basic}'},
+            None: {},
+        }
+
+    @staticmethod
+    def _defaults():
+        return {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+
+    def seed_users(self, count):
+        """Create count users through PUT /api/users:batch so they are stored encrypted."""
+        client = self.app.test_client()
+        with self.services.suspend():
+            for start in range(0, count, SEED_CHUNK):
+                users = [{'id': str(uuid.uuid4()), 'name': f'User {n}', 'email': f'user{n}@example.com'}
+                         for n in range(start, min(count, start + SEED_CHUNK))]
+                response = client.put('/api/users:batch', json=users, headers=self.auth_headers['api_key'],
+                                      base_url=BASE_URL)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Seeding failed with status {response.status_code}")
+                self.ids.extend(user['id'] for user in users)
+        return self.ids
+
+    def _send(self, client, entry, rng):
+        headers = dict(self.auth_headers[entry.get('auth', 'api_key')], **entry.get('headers', {}))
+        kwargs = {'headers': headers, 'base_url': BASE_URL}
+        if 'json' in entry:
+            kwargs['json'] = render(entry['json'], self.ids, rng)
+        start = time.perf_counter()
+        response = client.open(render(entry['path'], self.ids, rng), method=entry['method'], **kwargs)
+        # Streamed bodies are produced while they are read
+        response.get_data()
+        return time.perf_counter() - start, response.status_code
+
+    def run(self, mix=None, requests=1000, concurrency=8, warmup=50):
+        """Replay requests picked from the weighted mix on concurrency threads; returns the samples and wall time."""
+        mix = mix or DEFAULT_MIX
+        rng = random.Random(self.seed)
+        plan = rng.choices(mix, weights=[entry.get('weight', 1) for entry in mix], k=warmup + requests)
+        samples = {entry['name']: [] for entry in mix}
+        statuses = {entry['name']: {} for entry in mix}
+        counter = itertools.count(warmup)
+        lock = threading.Lock()
+
+        def worker(worker_seed):
+            client = self.app.test_client()
+            worker_rng = random.Random(worker_seed)
+            while True:
+                with lock:
+                    index = next(counter)
+                if index >= len(plan):
+                    return
+                entry = plan[index]
+                elapsed, status = self._send(client, entry, worker_rng)
+                with lock:
+                    samples[entry['name']].append(elapsed)
+                    statuses[entry['name']][status] = statuses[entry['name']].get(status, 0) + 1
+
+        # Warm-up requests run first so caches and key unwraps are in place before timing starts
+        for entry in plan[:warmup]:
+            self._send(self.app.test_client(), entry, rng)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='benchmark') as pool:
+            for result in [pool.submit(worker, rng.random()) for _ in range(concurrency)]:
+                result.result()
+        return samples, statuses, time.perf_counter() - start
+
+    def measure_allocations(self, mix=None, iterations=20):
+        """Peak bytes allocated while serving one request of each mix entry, run one at a time."""
+        mix = mix or DEFAULT_MIX
+        rng = random.Random(self.seed)
+        client = self.app.test_client()
+        allocations = {}
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            for entry in mix:
+                peaks = []
+                for _ in range(iterations):
+                    before = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    self._send(client, entry, rng)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+                allocations[entry['name']] = sorted(peaks)[len(peaks) // 2]
+        finally:
+            if started:
+                tracemalloc.stop()
+        return allocations
+
+
+def summarize(samples, statuses, duration, allocations=None):
+    endpoints = {}
+    total = 0
+    for name, latencies in samples.items():
+        ordered = sorted(latencies)
+        total += len(ordered)
+        endpoints[name] = {
+            'count': len(ordered),
+            # 207 is a batch with failed items
+            'errors': sum(count for status, count in statuses[name].items() if status >= 400 or status == 207),
+            'statuses': {str(status): count for status, count in sorted(statuses[name].items())},
+            'p50_ms': _ms(percentile(ordered, 50)),
+            'p95_ms': _ms(percentile(ordered, 95)),
+            'p99_ms': _ms(percentile(ordered, 99)),
+            'rps': round(len(ordered) / duration, 1) if duration else None,
+        }
+        if allocations is not None:
+            endpoints[name]['alloc_kib'] = round(allocations.get(name, 0) / 1024, 1)
+    return {'duration_s': round(duration, 3), 'requests': total,
+            'rps': round(total / duration, 1) if duration else None, 'endpoints': endpoints}
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def format_report(report):
+    has_allocations = any('alloc_kib' in stats for stats in report['endpoints'].values())
+    columns = ['endpoint', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'rps'] + (
+        ['alloc KiB'] if has_allocations else [])
+    rows = [[name, stats['count'], stats['errors'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['rps']] +
+            ([stats.get('alloc_kib')] if has_allocations else []) for name, stats in report['endpoints'].items()]
+    rows = [[str('-' if value is None else value) for value in row] for row in rows]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ['  '.join(value.ljust(width) for value, width in zip(row, widths)) for row in rows]
+    lines.append(f"{report['requests']} requests in {report['duration_s']}s: {report['rps']} requests/s")
+    return '\n'.join(lines)
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Endpoints whose p95 latency or throughput is more than tolerance worse than in baseline."""
+    regressions = []
+    for name, stats in report['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        if stats['p95_ms'] and before.get('p95_ms') and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {stats['p95_ms']}ms")
+        if stats['rps'] and before.get('rps') and stats['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {before['rps']} -> {stats['rps']} requests/s")
+        if stats['errors'] > before.get('errors', 0):
+            regressions.append(f"{name}: {before.get('errors', 0)} -> {stats['errors']} errors")
+    return regressions
@@ -1,6 +1,19 @@
+import json
+import logging
 import os
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
+
+logger = logging.getLogger(__name__)
+
+# Key Vault secret name -> config attribute it is loaded into
+SECRETS_TO_LOAD = {
+    'COSMOS-KEY': 'COSMOS_KEY',
+    'API-KEY': 'API_KEY',
+    'BASIC-AUTH-PASSWORD': 'BASIC_AUTH_PASSWORD',
+    'GITHUB-CLIENT-ID': 'GITHUB_CLIENT_ID',
+    'GITHUB-CLIENT-SECRET': 'GITHUB_CLIENT_SECRET',
+    'JWT-SECRET-KEY': 'JWT_SECRET_KEY',
+    'SECRET-KEY': 'SECRET_KEY'
+}
 
 class Config:
     COSMOS_ENDPOINT = os.environ.get('COSMOS_ENDPOINT')
@@ -8,9 +21,78 @@ class Config:
     CONTAINER_NAME = os.environ.get('CONTAINER_NAME')
     RATE_LIMIT = int(os.environ.get('RATE_LIMIT', 1000))
     RATE_LIMIT_PERIOD = int(os.environ.get('RATE_LIMIT_PERIOD', 1000))
+    # Shared by all workers. 'batched+redis://host:6379' keeps hits in process and syncs them every
+    # RATELIMIT_SYNC_INTERVAL seconds; 'memory://' counts per worker (tests, single process)
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
+    RATELIMIT_STRATEGY = os.environ.get('RATELIMIT_STRATEGY', 'moving-window')
+    RATELIMIT_STORAGE_OPTIONS = {'sync_interval': float(os.environ.get('RATELIMIT_SYNC_INTERVAL', 0.5))} \
+        if RATELIMIT_STORAGE_URI.startswith('batched+') else {}
     BASIC_AUTH_USERNAME = os.environ.get('BASIC_AUTH_USERNAME')
     KEY_VAULT_URL = os.environ.get('KEY_VAULT_URL')
     KEY_NAME = os.environ.get('KEY_NAME')  
+    # 'envelope' encrypts fields locally with a Key Vault-wrapped AES-GCM data key; 'rsa' calls Key Vault per field
+    ENCRYPTION_MODE = os.environ.get('ENCRYPTION_MODE', 'envelope')
+    DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 100))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+    MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', 10000))
+    # Total time a request may spend waiting between retries of Cosmos DB / Key Vault calls
+    REQUEST_RETRY_BUDGET_SECONDS = float(os.environ.get('REQUEST_RETRY_BUDGET_SECONDS', 10))
+    # How often each worker reloads roles from Cosmos DB; role changes made through this worker apply at once
+    RBAC_REFRESH_SECONDS = int(os.environ.get('RBAC_REFRESH_SECONDS', 60))
+    # Verified JWTs and API keys are remembered per worker for at most this long (never past a token's exp)
+    AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', 300))
+    AUTH_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', 10000))
+    # JSON lines to stdout, written by a background thread. LOG_LEVELS sets per-logger levels
+    # ('app.data=DEBUG,azure=WARNING'); LOG_SAMPLE_RATES keeps a fraction of the records below WARNING
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', 'azure=WARNING,urllib3=WARNING')
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    LOG_FILE = os.environ.get('LOG_FILE')
+    LOG_FILE_MAX_BYTES = int(os.environ.get('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024))
+    # Workers write their metrics here so /metrics adds up all of them; unset keeps them per process
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+    # Per-stage timings in a Server-Timing response header
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'true').lower() == 'true'
+    # Build the Azure clients and load the roles when wsgi.py is imported rather than on the first request
+    WARM_UP_ON_LOAD = os.environ.get('WARM_UP_ON_LOAD', 'false').lower() == 'true'
+    # Pooled connections per Azure host; config/gunicorn.conf.py sizes it to the worker profile
+    AZURE_POOL_SIZE = int(os.environ.get('AZURE_POOL_SIZE', 32))
+    # Concurrent decrypt calls per listing; 1 decrypts sequentially
+    DECRYPT_CONCURRENCY = int(os.environ.get('DECRYPT_CONCURRENCY', 16))
+    # Fields stored encrypted, per document 'type' ('item' for documents without one), as JSON
+    ENCRYPTED_FIELDS = json.loads(os.environ.get('ENCRYPTED_FIELDS', '{"item": ["name"]}'))
+    KEY_ROTATION_PAGE_SIZE = int(os.environ.get('KEY_ROTATION_PAGE_SIZE', 100))
+    # A rotation whose checkpoint has not been updated for this long is treated as abandoned and resumable
+    KEY_ROTATION_STALE_SECONDS = int(os.environ.get('KEY_ROTATION_STALE_SECONDS', 300))
+    # How often each worker checks Key Vault for a key version created by another worker's rotation
+    KEY_VERSION_REFRESH_SECONDS = float(os.environ.get('KEY_VERSION_REFRESH_SECONDS', 60))
+    # Read-through cache for single-item reads: 'memory' (per worker), 'redis' (shared), 'local' or 'none'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_TTL = float(os.environ.get('CACHE_TTL', 30))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    # Serve GET /users from an in-process copy of every item kept current from the change feed
+    USERS_VIEW_ENABLED = os.environ.get('USERS_VIEW_ENABLED', 'false').lower() == 'true'
+    USERS_VIEW_POLL_SECONDS = float(os.environ.get('USERS_VIEW_POLL_SECONDS', 5))
+    # Deletions are not in the change feed; a periodic rebuild drops items deleted by other processes
+    USERS_VIEW_REBUILD_SECONDS = float(os.environ.get('USERS_VIEW_REBUILD_SECONDS', 600))
+    # 'orjson' (pip install orjson), 'json', or 'auto' for orjson when it is installed
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+    # Responses of COMPRESSION_MIN_BYTES or more are sent with br (pip install brotli) or gzip when accepted
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+    COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+    COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+    # Encoded (and compressed) bodies of unchanged listings and items, by ETag, reused per worker
+    ENCODED_BODY_CACHE_BYTES = int(os.environ.get('ENCODED_BODY_CACHE_BYTES', 32 * 1024 * 1024))
+    # Optional encrypted on-disk copy of the Key Vault secrets for fast worker start-up.
+    # SECRETS_SNAPSHOT_KEY is a Fernet key; keep it out of the snapshot's directory.
+    SECRETS_SNAPSHOT_PATH = os.environ.get('SECRETS_SNAPSHOT_PATH')
+    SECRETS_SNAPSHOT_KEY = os.environ.get('SECRETS_SNAPSHOT_KEY')
+    SECRETS_SNAPSHOT_TTL = int(os.environ.get('SECRETS_SNAPSHOT_TTL', 3600))
 
     # Common security settings
     SESSION_COOKIE_HTTPONLY = True
@@ -19,19 +101,38 @@ class Config:
 
     @classmethod
     def load_secrets(cls):
+        values, errors = cls._fetch_secrets()
+        if errors:
+            raise next(iter(errors.values()))
+        cls._apply_secrets(values)
+
+    @classmethod
+    def _fetch_secrets(cls):
+        """Return (values, errors) keyed by secret name, from a fresh snapshot or else from Key Vault."""
+        # Imported here because the app package imports this module while it initializes
+        from app.clients import get_registry
+        from app.security.secrets_snapshot import SecretsSnapshot
         if not cls.KEY_VAULT_URL:
             raise ValueError("KEY_VAULT_URL environment variable is not set")
 
-        credential = DefaultAzureCredential(additionally_allowed_tenants=["*"])
-        secret_client = SecretClient(vault_url=cls.KEY_VAULT_URL, credential=credential)
+        registry = get_registry()
+        snapshot = SecretsSnapshot.from_config(cls)
+        values = snapshot.load() if snapshot else None
+        if values is not None and set(SECRETS_TO_LOAD).issubset(values):
+            registry.seed_secrets(cls.KEY_VAULT_URL, values)
+            snapshot.refresh_in_background(registry, list(SECRETS_TO_LOAD))
+            return values, {}
+
+        values, errors = registry.get_secrets(cls.KEY_VAULT_URL, SECRETS_TO_LOAD)
+        if snapshot and not errors:
+            snapshot.save(values)
+        return values, errors
 
-        cls.COSMOS_KEY = secret_client.get_secret('COSMOS-KEY').value
-        cls.API_KEY = secret_client.get_secret('API-KEY').value
-        cls.BASIC_AUTH_PASSWORD = secret_client.get_secret('BASIC-AUTH-PASSWORD').value
-        cls.GITHUB_CLIENT_ID = secret_client.get_secret('GITHUB-CLIENT-ID').value
-        cls.GITHUB_CLIENT_SECRET = secret_client.get_secret('GITHUB-CLIENT-SECRET').value
-        cls.JWT_SECRET_KEY = secret_client.get_secret('JWT-SECRET-KEY').value
-        cls.SECRET_KEY = secret_client.get_secret('SECRET-KEY').value
+    @classmethod
+    def _apply_secrets(cls, values):
+        for secret_name, value in values.items():
+            if secret_name in SECRETS_TO_LOAD:
+                setattr(cls, SECRETS_TO_LOAD[secret_name], value)
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -39,6 +140,11 @@ class DevelopmentConfig(Config):
 
 class ProductionConfig(Config):
     DEBUG = False
+    LOG_FILE = os.environ.get('LOG_FILE', 'logs/application.log')
+    # Stage timings tell clients how long auth and storage took; opt in explicitly in production
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+    # The gunicorn master preloads wsgi.py, so the workers inherit built clients
+    WARM_UP_ON_LOAD = os.environ.get('WARM_UP_ON_LOAD', 'true').lower() == 'true'
     SESSION_COOKIE_SECURE = True
     # SESSION_COOKIE_HTTPONLY = True
     # SESSION_COOKIE_SAMESITE = 'Lax'
@@ -48,44 +154,23 @@ class TestingConfig(Config):
     SESSION_COOKIE_SECURE = False
     @classmethod
     def load_secrets(cls):
-        print(f"Attempting to load secrets from Key Vault URL: {cls.KEY_VAULT_URL}")
-        if not cls.KEY_VAULT_URL:
-            raise ValueError("KEY_VAULT_URL environment variable is not set")
-
+        logger.info("Loading secrets from Key Vault", extra={'vault_url': cls.KEY_VAULT_URL})
         try:
-            credential = DefaultAzureCredential(additionally_allowed_tenants=["*"])
-            secret_client = SecretClient(vault_url=cls.KEY_VAULT_URL, credential=credential)
-
-            secrets_to_load = {
-                'COSMOS-KEY': 'COSMOS_KEY',
-                'API-KEY': 'API_KEY',
-                'BASIC-AUTH-PASSWORD': 'BASIC_AUTH_PASSWORD',
-                'GITHUB-CLIENT-ID': 'GITHUB_CLIENT_ID',
-                'GITHUB-CLIENT-SECRET': 'GITHUB_CLIENT_SECRET',
-                'JWT-SECRET-KEY': 'JWT_SECRET_KEY',
-                'SECRET-KEY': 'SECRET_KEY'
-            }
-            
-            for secret_name, attr_name in secrets_to_load.items():
-                try:
-                    value = secret_client.get_secret(secret_name).value
-                    setattr(cls, attr_name, value)
-                    print(f"Successfully loaded secret: {secret_name}")
-                except Exception as e:
-                    print(f"Failed to load secret {secret_name}: {str(e)}")
-
+            values, errors = cls._fetch_secrets()
         except Exception as e:
-            print(f"Error loading secrets from Key Vault: {str(e)}")
+            logger.error("Error loading secrets from Key Vault: %s", e)
             raise
 
+        logger.info("Loaded secrets: %s", ', '.join(sorted(values)))
+        for secret_name, e in errors.items():
+            logger.warning("Failed to load secret %s: %s", secret_name, e)
+        cls._apply_secrets(values)
+
 def get_config():
     env = os.environ.get('FLASK_ENV', 'testing').lower()
     if env == 'production':
-        print("Using ProductionConfig")
         return ProductionConfig
     elif env == 'testing':
-        print("Using TestingConfig")
         return TestingConfig
     else:
-        print("Using DevelopmentConfig")
         return DevelopmentConfig
\ No newline at end of file
@@ -1,11 +1,85 @@
 import multiprocessing
+import os
+
+# Worker profiles, picked with GUNICORN_PROFILE. The service mostly waits on Cosmos DB and Key
+# Vault, so one request per process (sync) leaves the CPU idle. In the in-process benchmark
+# (python -m benchmarks --profile azure) a single process stops gaining throughput at about 8
+# concurrent requests (124 req/s at 1, 341 at 8, 326 at 16) while p95 doubles from 8 to 16,
+# so the concurrent profiles run about one worker per core with 8-64 requests in flight each.
+#
+#   concurrency: requests in flight per worker (threads or worker_connections)
+#   max_requests: recycle a worker after this many requests, +/- the jitter so they do not
+#                 all restart at once; with preload_app a new worker is a cheap fork
+PROFILES = {
+    'sync': {'worker_class': 'sync', 'workers_per_cpu': 2, 'concurrency': 1,
+             'max_requests': 2000, 'max_requests_jitter': 200},
+    'gthread': {'worker_class': 'gthread', 'workers_per_cpu': 1, 'concurrency': 8,
+                'max_requests': 5000, 'max_requests_jitter': 500},
+    # Greenlets cost little, so more requests wait on Azure per worker; useful when throttled
+    'gevent': {'worker_class': 'gevent', 'workers_per_cpu': 1, 'concurrency': 64,
+               'max_requests': 10000, 'max_requests_jitter': 1000},
+    # asgi.py on uvicorn: /api/users is served on asyncio, every other route by the Flask app.
+    # Concurrency only sizes the connection pool; the event loop takes whatever arrives
+    'async': {'worker_class': 'uvicorn.workers.UvicornWorker', 'workers_per_cpu': 1, 'concurrency': 64,
+              'max_requests': 10000, 'max_requests_jitter': 1000, 'wsgi_app': 'asgi:application'},
+}
+
+profile_name = os.environ.get('GUNICORN_PROFILE', 'gthread')
+if profile_name not in PROFILES:
+    raise ValueError(f"Unknown GUNICORN_PROFILE {profile_name!r}; expected one of {', '.join(PROFILES)}")
+profile = PROFILES[profile_name]
+
+if profile_name == 'gevent':
+    # Patch before the app is preloaded, so the requests sessions under the Azure transports,
+    # the client registry's locks and the decrypt pool's threads are all cooperative
+    from gevent import monkey
+    monkey.patch_all()
 
 # Server socket
 bind = "0.0.0.0:8000"  # Use port 8000 by default, adjust as needed
 
-workers = multiprocessing.cpu_count() * 2 + 1  # Dynamically set based on available CPUs
+worker_class = profile['worker_class']
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * profile['workers_per_cpu'] + 1))
+concurrency = int(os.environ.get('WORKER_CONCURRENCY', profile['concurrency']))
+threads = concurrency if worker_class == 'gthread' else 1
+if worker_class == 'gevent':
+    # For gthread this would also cap idle keep-alive connections, so it only bounds greenlets
+    worker_connections = concurrency
+max_requests = int(os.environ.get('MAX_REQUESTS', profile['max_requests']))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', profile['max_requests_jitter']))
+wsgi_app = profile.get('wsgi_app', 'wsgi:application')
+
+# One pooled connection per request in flight, plus one per concurrent decrypt call; beyond
+# the pool size connections are opened and dropped per call, paying a TLS handshake each time
+os.environ.setdefault('AZURE_POOL_SIZE', str(concurrency + int(os.environ.get('DECRYPT_CONCURRENCY', 16))))
+
+# Build the app once in the master: with WARM_UP_ON_LOAD (on in production) secrets, Key Vault
+# keys, the credential's token and the Azure clients are then inherited by every worker. The
+# client registry drops the inherited pooled connections in each forked child, so workers
+# never share a socket.
+preload_app = True
+
+# Shared by the workers so /metrics reports the whole server rather than one worker
+os.environ.setdefault('METRICS_DIR', '/tmp/api-metrics')
+
+
+def on_starting(server):
+    # Totals from a previous run of the server would otherwise be added to this one's
+    from app.metrics import metrics
+    metrics.configure(os.environ['METRICS_DIR'])
+    metrics.clear()
+
+
+def worker_exit(server, worker):
+    # In the worker: totals recorded since its last periodic flush
+    from app.metrics import metrics
+    metrics.flush()
+
 
-#worker_class = "gevent"
+def child_exit(server, worker):
+    # In the master: fold the worker's totals into one file, so recycled workers do not pile up files
+    from app.metrics import metrics
+    metrics.mark_process_dead(worker.pid)
 
 # Logging
 accesslog = "-" 
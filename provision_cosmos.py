@@ -0,0 +1,34 @@
+import argparse
+import json
+from dotenv import load_dotenv
+from flask import Flask
+from config import get_config
+from app.data.cosmos_db_client import CosmosDBClient
+
+def build_client():
+    """Connect with the same configuration and Key Vault secrets as the application."""
+    load_dotenv()
+    app = Flask(__name__)
+    config_class = get_config()
+    config_class.load_secrets()
+    app.config.from_object(config_class)
+    return CosmosDBClient(app)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Provision the Cosmos DB container used by the API.")
+    parser.add_argument('--indexing-policy', action='store_true',
+                        help="replace the container's indexing policy with the tuned one")
+    parser.add_argument('--lookups', action='store_true',
+                        help="write username and role-name lookups and the role catalog for existing documents")
+    args = parser.parse_args()
+    if not (args.indexing_policy or args.lookups):
+        parser.error("choose --indexing-policy, --lookups or both")
+
+    cosmos_client = build_client()
+    if args.indexing_policy:
+        policy = cosmos_client.apply_indexing_policy()
+        print("Indexing policy applied:")
+        print(json.dumps(policy, indent=2))
+    if args.lookups:
+        counts = cosmos_client.rebuild_lookups()
+        print(f"Lookups written for {counts['users']} users and {counts['roles']} roles")
@@ -1,4 +1,5 @@
 #!/bin/bash
 export FLASK_ENV=production
 export FLASK_APP=wsgi.py
-gunicorn --config gunicorn.conf.py wsgi:application
\ No newline at end of file
+# GUNICORN_PROFILE=sync|gthread|gevent|async picks the worker model (default gthread)
+gunicorn --config config/gunicorn.conf.py
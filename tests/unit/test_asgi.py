@@ -0,0 +1,147 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import asyncio
+import json
+import time
+import unittest
+from flask import Flask
+from app.asgi import AsyncAPI
+from app.data.async_cosmos_db_client import AsyncCosmosDBClient
+from app.data.etags import NOT_MODIFIED, Versioned, matches
+
+class FakeAsyncCosmosClient:
+    def __init__(self):
+        self.items = {'1': {'id': '1', 'name': 'One'}}
+
+    async def get_all_items_versioned(self, fields=None, if_none_match=None):
+        return Versioned(list(self.items.values()), '"list"')
+
+    async def get_item_versioned(self, id, fields=None, if_none_match=None):
+        item = self.items.get(id)
+        etag = f'"v{id}"' if item else None
+        return Versioned(NOT_MODIFIED if matches(etag, if_none_match) else item, etag)
+
+    async def create_item(self, item):
+        self.items[item['id']] = item
+        return item
+
+async def call(app, method, path, headers=None, body=b'', query_string=b''):
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'path': path, 'root_path': '',
+        'scheme': 'https', 'query_string': query_string, 'server': ('localhost', 443),
+        'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        'client': ('127.0.0.1', 1234),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    status = sent[0]['status']
+    payload = b''.join(m.get('body', b'') for m in sent[1:])
+    return status, payload
+
+class TestAsyncAPI(unittest.TestCase):
+    def setUp(self):
+        flask_app = Flask('test')
+        flask_app.config.update(API_KEY='test_api_key', RATE_LIMIT=1000, RATE_LIMIT_PERIOD=1000)
+
+        @flask_app.route('/api/roles')
+        def roles():
+            return 'from flask'
+
+        self.api = AsyncAPI(flask_app)
+        self.api.cosmos_client = FakeAsyncCosmosClient()
+        self.headers = {'X-API-Key': 'test_api_key'}
+
+    def test_requires_authentication(self):
+        status, _ = asyncio.run(call(self.api, 'GET', '/api/users/1'))
+        self.assertEqual(status, 401)
+
+    def test_native_user_routes(self):
+        status, body = asyncio.run(call(self.api, 'GET', '/api/users', self.headers))
+        self.assertEqual((status, json.loads(body)), (200, [{'id': '1', 'name': 'One'}]))
+
+        status, _ = asyncio.run(call(self.api, 'POST', '/api/users', self.headers,
+                                     body=json.dumps({'id': '2', 'name': 'Two'}).encode()))
+        self.assertEqual(status, 201)
+        status, body = asyncio.run(call(self.api, 'GET', '/api/users/2', self.headers))
+        self.assertEqual((status, json.loads(body)['name']), (200, 'Two'))
+        status, body = asyncio.run(call(self.api, 'GET', '/api/users/2', dict(self.headers, **{'If-None-Match': '"v2"'})))
+        self.assertEqual((status, body), (304, b''))
+        status, _ = asyncio.run(call(self.api, 'GET', '/api/users/3', self.headers))
+        self.assertEqual(status, 404)
+
+    def test_other_paths_fall_through_to_flask(self):
+        status, body = asyncio.run(call(self.api, 'GET', '/api/roles'))
+        self.assertEqual((status, body), (200, b'from flask'))
+
+class TestAsyncCosmosDBClient(unittest.TestCase):
+    def test_decrypts_concurrently_in_order(self):
+        class SlowEncryptor:
+            async def decrypt(self, value):
+                await asyncio.sleep(0.05)
+                return value.upper()
+
+        async def run():
+            cosmos = AsyncCosmosDBClient({
+                'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/', 'DATABASE_NAME': 'db',
+                'CONTAINER_NAME': 'container', 'KEY_VAULT_URL': 'https://vault', 'KEY_NAME': 'key',
+                'DECRYPT_CONCURRENCY': 50
+            })
+            cosmos.encryptor = SlowEncryptor()
+            cosmos._decrypt_semaphore = asyncio.Semaphore(cosmos.decrypt_concurrency)
+            return await cosmos._decrypt_items([{'id': str(i), 'name': f'user {i}'} for i in range(50)])
+
+        start = time.monotonic()
+        items = asyncio.run(run())
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual([item['name'] for item in items], [f'USER {i}' for i in range(50)])
+
+    def test_point_reads_use_the_read_through_cache(self):
+        class Encryptor:
+            async def encrypt(self, value):
+                return 'enc:' + value
+
+            async def decrypt(self, value):
+                return value.replace('enc:', '')
+
+        class Container:
+            reads = 0
+
+            async def read_item(self, **kwargs):
+                self.reads += 1
+                return {'id': '1', 'name': 'enc:One', '_etag': '"e1"'}
+
+            async def upsert_item(self, body):
+                return body
+
+        async def run(backend):
+            cosmos = AsyncCosmosDBClient({
+                'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/', 'DATABASE_NAME': 'db',
+                'CONTAINER_NAME': 'container', 'KEY_VAULT_URL': 'https://vault', 'KEY_NAME': 'key',
+                'CACHE_BACKEND': backend
+            })
+            cosmos.encryptor = Encryptor()
+            cosmos.container = Container()
+            cosmos._decrypt_semaphore = asyncio.Semaphore(1)
+            names = [(await cosmos.get_item('1'))['name'], (await cosmos.get_item('1', fields=['id']))]
+            await cosmos.update_item({'id': '1', 'name': 'Uno'})
+            self.assertIsNone(cosmos.cache.get('1'))
+            return cosmos, names
+
+        for backend in ('memory', 'local'):
+            cosmos, names = asyncio.run(run(backend))
+            self.assertEqual(names, ['One', {'id': '1'}])
+            self.assertEqual(cosmos.container.reads, 1)
+            self.assertEqual(cosmos.cache.get_stats()['hits'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
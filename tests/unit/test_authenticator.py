@@ -0,0 +1,68 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import base64
+import unittest
+from unittest.mock import patch
+from flask import Flask, g, jsonify
+from flask_jwt_extended import JWTManager, decode_token, create_access_token, create_refresh_token
+from app.auth.authenticator import Authenticator
+from app.auth.base import Auth
+
+def basic(username, password):
+    return 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+
+class TestAuthenticator(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask('test')
+        self.app.config.update(API_KEY='test_api_key', BASIC_AUTH_USERNAME='admin', BASIC_AUTH_PASSWORD='secret',
+                               JWT_SECRET_KEY='test-secret', API_KEY_ROLES=['admin'])
+        JWTManager(self.app)
+        self.authenticator = Authenticator(self.app)
+        with self.app.app_context():
+            self.token = create_access_token(identity='alice', additional_claims={'roles': ['user']})
+            self.refresh_token = create_refresh_token(identity='alice')
+
+    def test_dispatches_on_the_header_present(self):
+        principal = self.authenticator.authenticate({'x-api-key': 'test_api_key'})
+        self.assertEqual((principal.method, principal.roles), ('api_key', ['admin']))
+        principal = self.authenticator.authenticate({'authorization': basic('admin', 'secret')})
+        self.assertEqual((principal.method, principal.identity), ('basic', 'admin'))
+        principal = self.authenticator.authenticate({'authorization': f'Bearer {self.token}'})
+        self.assertEqual((principal.method, principal.identity, principal.roles), ('jwt', 'alice', ['user']))
+
+        self.assertIsNone(self.authenticator.authenticate({}))
+        self.assertIsNone(self.authenticator.authenticate({'x-api-key': 'wrong'}))
+        self.assertIsNone(self.authenticator.authenticate({'authorization': basic('admin', 'wrong')}))
+        self.assertIsNone(self.authenticator.authenticate({'authorization': 'Bearer not-a-jwt'}))
+        self.assertIsNone(self.authenticator.authenticate({'authorization': f'Bearer {self.refresh_token}'}))
+        self.assertIsNone(self.authenticator.authenticate({'x-api-key': 'test_api_key'}, ('jwt',)))
+
+    def test_repeat_tokens_are_verified_once_until_they_expire(self):
+        headers = {'authorization': f'Bearer {self.token}'}
+        with patch('app.auth.authenticator.decode_token', wraps=decode_token) as decode:
+            first = self.authenticator.authenticate(headers)
+            second = self.authenticator.authenticate(headers)
+            self.assertIs(first, second)
+            self.assertEqual(decode.call_count, 1)
+
+            self.authenticator.clock = lambda: first.claims['exp'] + 1
+            self.authenticator.authenticate(headers)
+            self.assertEqual(decode.call_count, 2)
+
+    def test_require_auth_sets_the_principal(self):
+        auth = Auth(self.app, None, None, None, self.authenticator)
+
+        @self.app.route('/whoami')
+        @auth.require_auth()
+        def whoami():
+            return jsonify(identity=g.user.identity, roles=g.user.roles)
+
+        client = self.app.test_client()
+        response = client.get('/whoami', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.get_json(), {'identity': 'alice', 'roles': ['user']})
+        self.assertEqual(client.get('/whoami').status_code, 401)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from azure.cosmos import exceptions
+from app.data.retry import retry_after
+from benchmarks import Benchmark, LatencyProfile, Services, compare, summarize
+from benchmarks.fakes import FakeContainer
+
+class TestFakes(unittest.TestCase):
+    def test_throttled_calls_ask_for_a_wait(self):
+        services = Services({'cosmos.read': LatencyProfile(throttle_rate=1.0, retry_after_ms=250)})
+        container = FakeContainer(services)
+        with self.assertRaises(exceptions.CosmosHttpResponseError) as raised:
+            container.read_item('1', partition_key='1')
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertEqual(retry_after(raised.exception), 0.25)
+        with services.suspend():
+            with self.assertRaises(exceptions.CosmosResourceNotFoundError):
+                container.read_item('1', partition_key='1')
+        self.assertEqual(services.stats(), {'calls': {'cosmos.read': 2}, 'throttled': {'cosmos.read': 1}})
+
+    def test_query_pages_and_projection(self):
+        container = FakeContainer(Services())
+        for n in range(5):
+            container.create_item({'id': str(n), 'name': f'User {n}', 'email': f'{n}@example.com'})
+        container.create_item({'id': 'lookup', 'type': 'lookup'})
+        pages = container.query_items('SELECT c.id, c["email"] FROM c WHERE NOT ARRAY_CONTAINS(@internal_types, c.type)',
+                                      parameters=[{'name': '@internal_types', 'value': ['lookup']}],
+                                      max_item_count=2).by_page()
+        first = next(pages)
+        self.assertEqual(first, [{'id': '0', 'email': '0@example.com'}, {'id': '1', 'email': '1@example.com'}])
+        rest = container.query_items('SELECT * FROM c WHERE NOT ARRAY_CONTAINS(@internal_types, c.type)',
+                                     parameters=[{'name': '@internal_types', 'value': ['lookup']}],
+                                     max_item_count=2).by_page(pages.continuation_token)
+        self.assertEqual([[item['id'] for item in page] for page in rest], [['2', '3'], ['4']])
+
+    def test_failed_batch_is_rolled_back(self):
+        container = FakeContainer(Services())
+        container.create_item({'id': 'a'})
+        with self.assertRaises(exceptions.CosmosBatchOperationError) as raised:
+            container.execute_item_batch([('upsert', ({'id': 'a', 'v': 1},)), ('create', ({'id': 'a'},))], 'a')
+        self.assertEqual([r['statusCode'] for r in raised.exception.operation_responses], [424, 409])
+        self.assertNotIn('v', container.documents['a'])
+
+class TestBenchmark(unittest.TestCase):
+    def test_mix_runs_against_the_app(self):
+        benchmark = Benchmark('instant', seed=1)
+        benchmark.seed_users(30)
+        samples, statuses, duration = benchmark.run(requests=60, concurrency=4, warmup=5)
+        report = summarize(samples, statuses, duration, benchmark.measure_allocations(iterations=2))
+
+        self.assertEqual(report['requests'], 60)
+        for name, stats in report['endpoints'].items():
+            self.assertEqual(stats['errors'], 0, f"{name}: {stats['statuses']}")
+            if stats['count']:
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+            self.assertGreater(stats['alloc_kib'], 0)
+
+        slower = {'endpoints': {name: dict(stats, p95_ms=stats['p95_ms'] and stats['p95_ms'] * 2)
+                                for name, stats in report['endpoints'].items()}}
+        self.assertEqual(compare(report, report), [])
+        self.assertTrue(compare(slower, report))
+
+if __name__ == '__main__':
+    unittest.main()
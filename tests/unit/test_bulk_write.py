@@ -0,0 +1,75 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from unittest.mock import MagicMock, patch
+from azure.cosmos import exceptions
+from app.data.cosmos_db_client import CosmosDBClient
+
+class TestBulkWrite(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def setUp(self, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name',
+            'DECRYPT_CONCURRENCY': 4
+        }
+        self.cosmos_client = CosmosDBClient(app)
+        self.cosmos_client.encryptor.encrypt.side_effect = lambda value: f'enc:{value}'
+        self.container = self.cosmos_client.container
+        self.container.create_item.side_effect = lambda body: dict(body, _etag=f'"{body["id"]}"')
+
+    def test_create_encrypts_copies_and_keeps_order(self):
+        items = [{'id': str(i), 'name': f'User {i}'} for i in range(10)]
+        results = self.cosmos_client.bulk_write('create', items)
+
+        self.assertEqual([(r['index'], r['id'], r['status']) for r in results], [(i, str(i), 201) for i in range(10)])
+        written = sorted(call.kwargs['body']['name'] for call in self.container.create_item.call_args_list)
+        self.assertEqual(written, sorted(f'enc:User {i}' for i in range(10)))
+        self.assertEqual(items[0]['name'], 'User 0')
+        self.container.execute_item_batch.assert_not_called()
+
+    def test_same_id_is_written_in_order_with_point_operations(self):
+        written = []
+        self.container.upsert_item.side_effect = lambda body: written.append(body['name']) or dict(
+            body, _etag=f'"{body["name"]}"')
+        results = self.cosmos_client.bulk_write('upsert', [{'id': 'a', 'name': 'A1'}, {'id': 'b', 'name': 'B'},
+                                                           {'id': 'a', 'name': 'A2'}])
+
+        self.assertEqual([(r['id'], r['status'], r['etag']) for r in results],
+                         [('a', 200, '"enc:A1"'), ('b', 200, '"enc:B"'), ('a', 200, '"enc:A2"')])
+        self.assertLess(written.index('enc:A1'), written.index('enc:A2'))
+        self.container.execute_item_batch.assert_not_called()
+
+    def test_failures_are_reported_per_item(self):
+        self.container.create_item.side_effect = [dict(id='a'), exceptions.CosmosResourceExistsError(
+            status_code=409, message='exists')]
+
+        results = self.cosmos_client.bulk_write('create', [{'id': 'a'}, {'id': 'a'}, 'not an object'])
+
+        self.assertEqual([(r['id'], r['status']) for r in results], [('a', 201), ('a', 409), (None, 400)])
+        self.assertEqual(['error' in r for r in results], [False, True, True])
+
+    def test_invalid_items_are_refused_before_writing(self):
+        results = self.cosmos_client.bulk_write('upsert', [{'id': 'a', 'email': 'nope'}, {'id': 'b', 'type': 'lookup'}])
+
+        self.assertEqual([(r['id'], r['status']) for r in results], [('a', 400), ('b', 400)])
+        self.assertEqual(results[0]['error'], 'email is not valid')
+        self.container.upsert_item.assert_not_called()
+
+    def test_delete_accepts_ids_and_invalidates_cache(self):
+        self.cosmos_client.cache.set('a', {'id': 'a'})
+        results = self.cosmos_client.bulk_write('delete', ['a', {'id': 'b'}, {}])
+
+        self.assertEqual([r['status'] for r in results], [204, 204, 400])
+        self.assertEqual(self.container.delete_item.call_count, 2)
+        self.assertIsNone(self.cosmos_client.cache.get('a'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from unittest.mock import MagicMock, patch
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from app.data.cache import InProcessCache, SharedCache, LocalKeyValueStore
+from app.data.cosmos_db_client import CosmosDBClient
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestInProcessCache(unittest.TestCase):
+    def test_lru_eviction_and_ttl(self):
+        clock = FakeClock()
+        cache = InProcessCache(max_entries=2, ttl=10, clock=clock)
+        cache.set('a', 1, etag='"a"')
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), (1, '"a"', True))
+        clock.now += 11
+        self.assertEqual(cache.get('c'), (3, None, False))
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['stale'], stats['evictions']), (2, 1, 1, 1))
+
+class TestSharedCache(unittest.TestCase):
+    def test_round_trip_and_clear(self):
+        clock = FakeClock()
+        cache = SharedCache(LocalKeyValueStore(clock=clock), ttl=10, clock=clock)
+        cache.set('1', {'id': '1', 'name': 'enc:One'}, etag='"e1"')
+        cache.set('2', {'id': '2'})
+
+        self.assertEqual(cache.get('1'), ({'id': '1', 'name': 'enc:One'}, '"e1"', True))
+        clock.now += 11
+        self.assertFalse(cache.get('1').fresh)
+        clock.now += 100
+        self.assertIsNone(cache.get('1'))
+        cache.clear()
+        self.assertIsNone(cache.get('2'))
+
+class TestCosmosDBClientCache(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def build(self, backend, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name',
+            'CACHE_BACKEND': backend,
+            'CACHE_TTL': 10
+        }
+        cosmos_client = CosmosDBClient(app)
+        cosmos_client.encryptor.decrypt.side_effect = lambda value: value.replace('enc:', '')
+        cosmos_client.container.read_item.side_effect = lambda **kwargs: {'id': '1', 'name': 'enc:One', '_etag': '"e1"'}
+        return cosmos_client
+
+    def test_hit_skips_read_and_decrypt(self):
+        for backend in ('memory', 'local'):
+            cosmos_client = self.build(backend)
+            self.assertEqual(cosmos_client.get_item('1')['name'], 'One')
+            self.assertEqual(cosmos_client.get_item('1')['name'], 'One')
+
+            self.assertEqual(cosmos_client.container.read_item.call_count, 1)
+            expected_decrypts = 1 if backend == 'memory' else 2
+            self.assertEqual(cosmos_client.encryptor.decrypt.call_count, expected_decrypts)
+            self.assertEqual(cosmos_client.get_cache_stats()['hits'], 1)
+
+    def test_stale_entry_is_revalidated_with_etag(self):
+        cosmos_client = self.build('memory')
+        cosmos_client.cache.clock = clock = FakeClock()
+        cosmos_client.get_item('1')
+        clock.now += 11
+        cosmos_client.container.read_item.side_effect = lambda **kwargs: None  # 304 Not Modified
+
+        self.assertEqual(cosmos_client.get_item('1')['name'], 'One')
+        kwargs = cosmos_client.container.read_item.call_args.kwargs
+        self.assertEqual((kwargs['etag'], kwargs['match_condition']), ('"e1"', MatchConditions.IfModified))
+        self.assertEqual(cosmos_client.encryptor.decrypt.call_count, 1)
+        self.assertEqual(cosmos_client.get_cache_stats()['revalidations'], 1)
+
+    def test_writes_and_rotation_invalidate(self):
+        cosmos_client = self.build('memory')
+        cosmos_client.get_item('1')
+        cosmos_client.update_item({'id': '1', 'name': 'Uno'})
+        self.assertIsNone(cosmos_client.cache.get('1'))
+
+        cosmos_client.get_item('1')
+        cosmos_client.delete_item('1')
+        self.assertIsNone(cosmos_client.cache.get('1'))
+
+        cosmos_client.get_item('1')
+        with patch.object(cosmos_client, 're_encrypt_all_items'):
+            cosmos_client.rotate_encryption_key()
+        self.assertIsNone(cosmos_client.cache.get('1'))
+
+    def test_failed_decrypt_is_not_cached(self):
+        for backend in ('memory', 'local'):
+            cosmos_client = self.build(backend)
+            outcomes = ['[Decryption Error: kv down]']
+            cosmos_client.encryptor.decrypt.side_effect = \
+                lambda value: outcomes.pop() if outcomes else value.replace('enc:', '')
+
+            failed = cosmos_client.get_item_versioned('1')
+            self.assertEqual((failed.value['name'], failed.etag), ('[Decryption Error: kv down]', None))
+            # Key Vault is back: the next reads decrypt again instead of serving the error
+            self.assertEqual(cosmos_client.get_item_versioned('1').etag, '"e1"')
+            self.assertEqual(cosmos_client.get_item('1')['name'], 'One')
+            self.assertEqual(cosmos_client.get_cache_stats()['revalidations'], 0)
+
+    def test_missing_item_is_not_cached(self):
+        cosmos_client = self.build('memory')
+        cosmos_client.container.read_item.side_effect = exceptions.CosmosResourceNotFoundError()
+        self.assertIsNone(cosmos_client.get_item('1'))
+        self.assertIsNone(cosmos_client.cache.get('1'))
+
+if __name__ == '__main__':
+    unittest.main()
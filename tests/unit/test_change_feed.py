@@ -0,0 +1,190 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from flask import Blueprint, Flask, g
+from app.api.routes import init_routes
+from app.data.change_feed import ChangeFeed, MaterializedView, decode_cursor, encode_cursor
+from app.data.cosmos_db_client import is_internal
+from app.data.etags import NOT_MODIFIED
+
+class FakePages:
+    def __init__(self, log, start, page_size):
+        self.log = log
+        self.position = start
+        self.page_size = page_size
+        self.continuation_token = str(start)
+
+    def __iter__(self):
+        while True:
+            page = self.log[self.position:self.position + self.page_size]
+            self.position += len(page)
+            if page:
+                self.continuation_token = str(self.position)
+            yield [dict(document) for document in page]
+            if not page:
+                return
+
+class FakeContainer:
+    """A single partition key range whose feed is an append-only log; the etag is the log position."""
+
+    def __init__(self):
+        self.log = []
+        self.container_link = 'dbs/test/colls/test'
+        self.client_connection = MagicMock()
+        self.client_connection._ReadPartitionKeyRanges.return_value = [{'id': '0'}]
+
+    def write(self, document):
+        self.log.append(dict(document, _ts=len(self.log) + 1, _lsn=len(self.log) + 1,
+                             _etag=f'"{len(self.log) + 1}"'))
+
+    def query_items_change_feed(self, partition_key_range_id, max_item_count, is_start_from_beginning=False,
+                                continuation=None, start_time=None):
+        start = int(continuation) if continuation is not None else 0
+        outer = self
+
+        class Feed:
+            def by_page(self):
+                return FakePages(outer.log, start, max_item_count)
+        return Feed()
+
+class TestChangeFeed(unittest.TestCase):
+    def setUp(self):
+        self.container = FakeContainer()
+        self.feed = ChangeFeed(self.container, is_internal=is_internal)
+
+    def test_cursor_round_trip(self):
+        cursor = {'ranges': {'0': '"12"'}, 'ts': 1700000000}
+        self.assertEqual(decode_cursor(encode_cursor(cursor)), cursor)
+        self.assertIsNone(decode_cursor(None))
+        for token in ('not-a-cursor', encode_cursor(['ranges'])):
+            with self.assertRaises(ValueError):
+                decode_cursor(token)
+
+    def test_reads_only_changes_after_the_cursor(self):
+        self.container.write({'id': '1', 'name': 'One'})
+        self.container.write({'id': 'lookup:email:x', 'type': 'lookup'})
+        documents, cursor, more = self.feed.read(None, limit=10)
+        self.assertEqual([document['id'] for document in documents], ['1'])
+        self.assertNotIn('_lsn', documents[0])
+        self.assertFalse(more)
+
+        self.container.write({'id': '2', 'name': 'Two'})
+        self.container.write({'id': '1', 'name': 'Uno'})
+        documents, cursor, more = self.feed.read(cursor, limit=1)
+        self.assertEqual([document['id'] for document in documents], ['2'])
+        self.assertTrue(more)
+        documents, cursor, more = self.feed.read(cursor, limit=1)
+        self.assertEqual([document['name'] for document in documents], ['Uno'])
+        self.assertEqual(self.feed.read(cursor, limit=1)[0], [])
+
+class TestMaterializedView(unittest.TestCase):
+    def setUp(self):
+        self.container = FakeContainer()
+        self.decrypted = []
+
+        def decrypt(documents):
+            self.decrypted.extend(documents)
+            return [dict(document) for document in documents]
+        self.view = MaterializedView(ChangeFeed(self.container, is_internal=is_internal), decrypt, poll_interval=0)
+
+    def test_applies_changes_and_discards(self):
+        self.container.write({'id': '1', 'name': 'One'})
+        self.container.write({'id': '2', 'name': 'Two'})
+        first = self.view.list()
+        self.assertEqual(sorted(item['id'] for item in first.value), ['1', '2'])
+        self.assertIs(self.view.list(if_none_match={first.etag}).value, NOT_MODIFIED)
+
+        self.container.write({'id': '2', 'name': 'Dos'})
+        self.assertEqual(self.view.sync(), 1)
+        # Only the changed document was decrypted again
+        self.assertEqual(len(self.decrypted), 3)
+        changed = self.view.list(fields=['name'], if_none_match={first.etag})
+        self.assertEqual(sorted(item['name'] for item in changed.value), ['Dos', 'One'])
+
+        self.view.discard('1')
+        self.assertEqual([item['id'] for item in self.view.list().value], ['2'])
+        self.assertEqual(self.view.stats()['items'], 1)
+
+    def test_failed_decrypt_is_left_out_and_retried(self):
+        failures = ['2']
+
+        def decrypt(documents):
+            decrypted = []
+            for document in documents:
+                ok = document['id'] not in failures
+                if not ok:
+                    failures.remove(document['id'])
+                # In place, like the client's decrypt
+                document['name'] = document['name'].upper() if ok else '[Decryption Error: key unavailable]'
+                decrypted.append(document)
+            return decrypted
+        view = MaterializedView(ChangeFeed(self.container, is_internal=is_internal), decrypt, poll_interval=0,
+                                failed=lambda item: item['name'].startswith('[Decryption Error'))
+        self.container.write({'id': '1', 'name': 'one'})
+        self.container.write({'id': '2', 'name': 'two'})
+        first = view.list()
+        self.assertEqual([item['id'] for item in first.value], ['1'])
+        self.assertEqual(view.stats()['failed_decrypts'], 1)
+
+        # Nothing new in the feed: the failed document is decrypted again from what the feed returned
+        view.sync()
+        second = view.list(if_none_match={first.etag})
+        self.assertEqual(sorted(item['name'] for item in second.value), ['ONE', 'TWO'])
+        self.assertEqual(view.stats()['failed_decrypts'], 0)
+
+    def test_newer_version_replaces_a_failed_one(self):
+        failures = ['2']
+
+        def decrypt(documents):
+            return [dict(document, name='[Decryption Error: bad]') if document['id'] in failures else dict(document)
+                    for document in documents]
+        view = MaterializedView(ChangeFeed(self.container, is_internal=is_internal), decrypt, poll_interval=0,
+                                failed=lambda item: item['name'].startswith('[Decryption Error'))
+        self.container.write({'id': '2', 'name': 'Two'})
+        self.assertEqual(view.list().value, [])
+
+        failures.clear()
+        self.container.write({'id': '2', 'name': 'Dos'})
+        view.sync()
+        self.assertEqual([item['name'] for item in view.list().value], ['Dos'])
+        self.assertEqual(view.stats()['failed_decrypts'], 0)
+
+class TestChangesRoute(unittest.TestCase):
+    def setUp(self):
+        self.cosmos_client = MagicMock()
+        auth = MagicMock()
+        auth.require_auth.return_value = lambda f: f
+        limiter = MagicMock()
+        limiter.limit.return_value = lambda f: f
+        app = Flask(__name__)
+        app.register_blueprint(init_routes(Blueprint('api', __name__),
+                                           self.cosmos_client, auth, limiter), url_prefix='/api')
+        app.before_request(lambda: setattr(g, 'user', SimpleNamespace(roles=['reader'])))
+        allowed = patch('app.rbac.utils.rbac_engine.is_allowed', return_value=True)
+        allowed.start()
+        self.addCleanup(allowed.stop)
+        self.client = app.test_client()
+
+    def test_bad_cursor_and_consumer_are_400(self):
+        self.assertEqual(self.client.get('/api/users/changes?since=garbage').status_code, 400)
+        self.assertEqual(self.client.get('/api/users/changes?consumer=a/b').status_code, 400)
+        self.cosmos_client.read_changes.assert_not_called()
+
+    def test_consumer_resumes_from_its_acknowledged_cursor(self):
+        since = encode_cursor({'ranges': {'0': '"3"'}, 'ts': 3})
+        self.cosmos_client.load_change_feed_cursor.return_value = since
+        self.cosmos_client.read_changes.return_value = ([{'id': '1'}], 'next', False)
+        response = self.client.get('/api/users/changes?consumer=billing')
+        self.assertEqual(response.get_json(), {'items': [{'id': '1'}], 'cursor': 'next', 'more': False})
+        self.assertEqual(self.cosmos_client.read_changes.call_args.args[0], since)
+        self.cosmos_client.save_change_feed_cursor.assert_not_called()
+
+        self.client.get(f'/api/users/changes?consumer=billing&since={since}')
+        self.cosmos_client.save_change_feed_cursor.assert_called_once_with('billing', since)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from app.clients import ClientRegistry
+
+VAULT_URL = 'https://fake-vault.vault.azure.net'
+
+class TestClientRegistry(unittest.TestCase):
+    def setUp(self):
+        patchers = [
+            patch('app.clients.registry.DefaultAzureCredential'),
+            patch('app.clients.registry.SecretClient'),
+            patch('app.clients.registry.KeyClient'),
+        ]
+        self.mock_credential, self.mock_secret_client, self.mock_key_client = [p.start() for p in patchers]
+        for p in patchers:
+            self.addCleanup(p.stop)
+        self.mock_secret_client.return_value.get_secret.side_effect = lambda name: MagicMock(value=f'{name}-value')
+        self.registry = ClientRegistry()
+
+    def test_secrets_and_clients_are_fetched_once(self):
+        threads = [threading.Thread(target=self.registry.get_secret, args=(VAULT_URL, 'COSMOS-KEY')) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.registry.get_secret(VAULT_URL, 'COSMOS-KEY'), 'COSMOS-KEY-value')
+        self.registry.get_secret(VAULT_URL, 'API-KEY')
+        self.registry.key_client(VAULT_URL)
+        self.assertEqual(self.mock_secret_client.return_value.get_secret.call_count, 2)
+        self.assertEqual(self.mock_credential.call_count, 1)
+        self.assertEqual(self.mock_secret_client.call_count, 1)
+
+    def test_latest_key_is_memoized_until_forgotten(self):
+        self.registry.get_key(VAULT_URL, 'key')
+        self.registry.get_key(VAULT_URL, 'key')
+        self.registry.forget_key(VAULT_URL, 'key')
+        self.registry.get_key(VAULT_URL, 'key')
+        self.assertEqual(self.mock_key_client.return_value.get_key.call_count, 2)
+
+    @patch('app.clients.registry.CosmosClient')
+    def test_cosmos_client_leaves_throttle_retries_to_cosmos_retry(self, mock_cosmos_client):
+        self.registry.cosmos_client('https://test.documents.azure.com:443/', 'key')
+        policy = mock_cosmos_client.call_args.kwargs['connection_policy']
+        self.assertEqual(policy.RetryOptions.MaxRetryAttemptCount, 0)
+
+    def test_after_fork_keeps_clients_and_drops_connections(self):
+        secret_client = self.registry.secret_client(VAULT_URL)
+        self.registry.get_secret(VAULT_URL, 'COSMOS-KEY')
+        with patch.object(self.registry._session, 'close') as close_session:
+            self.registry.after_fork()
+        close_session.assert_called_once()
+
+        self.assertIs(self.registry.secret_client(VAULT_URL), secret_client)
+        self.registry.get_secret(VAULT_URL, 'COSMOS-KEY')
+        self.assertEqual(self.mock_secret_client.return_value.get_secret.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
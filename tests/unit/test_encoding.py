@@ -0,0 +1,146 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import asyncio
+import gzip
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from flask import Blueprint, Flask, Response, g, jsonify
+from app.api.routes import init_routes
+from app.asgi import AsyncResponse
+from app.data.etags import Versioned
+from app.encoding import (Gzip, JSONBackend, ResponseEncoder, choose_coding, create_json_backend,
+                          init_encoding, json_response)
+
+USERS = [{'id': str(i), 'name': f'User {i}', 'email': f'user{i}@example.com'} for i in range(100)]
+
+class TestJSONBackends(unittest.TestCase):
+    def test_backends_agree(self):
+        try:
+            backend = create_json_backend('orjson')
+        except ImportError:
+            self.skipTest("orjson is not installed")
+        value = {'b': [1, 2.5, None, True], 'a': {'nested': 'é'}}
+        self.assertEqual(backend.dumps(value, sort_keys=True).decode(),
+                         JSONBackend().dumps(value, sort_keys=True).decode().replace('\\u00e9', 'é'))
+        self.assertEqual(backend.dumps({3: 'int key'}), b'{"3":"int key"}')
+        # Beyond orjson's 64-bit integers json takes over
+        self.assertEqual(backend.dumps({'n': 2 ** 70}), b'{"n":1180591620717411303424}')
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_json_backend('simplejson')
+
+class TestNegotiation(unittest.TestCase):
+    def test_choose_coding(self):
+        codings = [Gzip()]
+        self.assertEqual(choose_coding('br, gzip;q=0.8', codings).name, 'gzip')
+        self.assertIsNone(choose_coding('gzip;q=0, identity', codings))
+        self.assertEqual(choose_coding('*', codings).name, 'gzip')
+        self.assertIsNone(choose_coding(None, codings))
+
+class TestFlaskEncoding(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.config.update(COMPRESSION_MIN_BYTES=1024, ENCODED_BODY_CACHE_BYTES=1024 * 1024)
+        self.encoder = init_encoding(app)
+
+        @app.route('/users')
+        def users():
+            return json_response(USERS, key=('"etag"', '/users'))
+
+        @app.route('/small')
+        def small():
+            return json_response({'status': 'ok'})
+
+        @app.route('/stream')
+        def stream():
+            return Response((self.encoder.ndjson(USERS[i:i + 10]) for i in range(0, 100, 10)),
+                            mimetype='application/x-ndjson')
+        self.client = app.test_client()
+
+    def test_large_bodies_are_compressed_once(self):
+        for _ in range(2):
+            response = self.client.get('/users', headers={'Accept-Encoding': 'gzip, deflate'})
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response.headers['Vary'])
+            self.assertEqual(self.encoder.backend.dumps(USERS, sort_keys=True), gzip.decompress(response.data))
+        self.assertEqual(self.encoder.bodies.stats()['hits'], 1)
+
+        response = self.client.get('/users')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_json(), USERS)
+
+    def test_small_bodies_are_sent_as_they_are(self):
+        response = self.client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_json(), {'status': 'ok'})
+
+    def test_streams_are_compressed_as_they_go(self):
+        response = self.client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(response.data).decode().splitlines()
+        self.assertEqual(len(lines), 100)
+
+    def test_jsonify_uses_the_backend(self):
+        with self.client.application.test_request_context():
+            response = jsonify({'at': datetime(2024, 1, 2, tzinfo=timezone.utc)})
+        # Dates are still written the way Flask writes them
+        self.assertEqual(response.get_json(), {'at': 'Tue, 02 Jan 2024 00:00:00 GMT'})
+
+class TestRouteBodyCache(unittest.TestCase):
+    def test_reads_without_an_etag_are_not_kept(self):
+        cosmos_client = MagicMock()
+        auth, limiter = MagicMock(), MagicMock()
+        auth.require_auth.return_value = lambda f: f
+        limiter.limit.return_value = lambda f: f
+        app = Flask(__name__)
+        app.config['ENCODED_BODY_CACHE_BYTES'] = 1024 * 1024
+        encoder = init_encoding(app)
+        app.register_blueprint(init_routes(Blueprint('api', __name__), cosmos_client, auth, limiter), url_prefix='/api')
+        app.before_request(lambda: setattr(g, 'user', SimpleNamespace(roles=['admin'])))
+        client = app.test_client()
+        with patch('app.rbac.utils.rbac_engine.is_allowed', return_value=True):
+            # How the client returns an item with a field it could not decrypt
+            cosmos_client.get_item_versioned.return_value = Versioned({'id': '1', 'name': '[Decryption Error: x]'}, None)
+            for _ in range(2):
+                response = client.get('/api/users/1')
+                self.assertNotIn('ETag', response.headers)
+            self.assertEqual(encoder.bodies.stats()['hits'], 0)
+
+            cosmos_client.get_item_versioned.return_value = Versioned({'id': '1', 'name': 'One'}, '"e1"')
+            for _ in range(2):
+                response = client.get('/api/users/1')
+            self.assertEqual((response.headers['ETag'], response.get_json()['name']), ('"e1"', 'One'))
+            self.assertEqual(encoder.bodies.stats()['hits'], 1)
+
+class TestAsyncResponseEncoding(unittest.TestCase):
+    def send(self, response, accept_encoding):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+        encoder = ResponseEncoder(JSONBackend(), [Gzip()], min_size=100)
+        asyncio.run(response.send(send, encoder, accept_encoding))
+        headers = dict(messages[0]['headers'])
+        return headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+    def test_payload_and_chunks(self):
+        headers, body = self.send(AsyncResponse(200, USERS), 'gzip')
+        self.assertEqual(headers[b'content-encoding'], b'gzip')
+        self.assertEqual(len(gzip.decompress(body)), len(JSONBackend().dumps(USERS)))
+
+        async def chunks():
+            yield b'{"id":"1"}\n'
+            yield '{"id":"2"}\n'
+        headers, body = self.send(AsyncResponse(200, chunks=chunks(), content_type='application/x-ndjson'), 'gzip')
+        self.assertEqual(gzip.decompress(body), b'{"id":"1"}\n{"id":"2"}\n')
+
+        headers, body = self.send(AsyncResponse(404, {"error": "User not found"}), 'gzip')
+        self.assertNotIn(b'content-encoding', headers)
+
+if __name__ == '__main__':
+    unittest.main()
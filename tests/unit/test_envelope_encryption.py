@@ -0,0 +1,201 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from azure.cosmos import exceptions
+from app.clients import ClientRegistry
+from app.data.data_keys import AsyncDataKeyStore, DataKeyStore
+from app.security.async_encryption import AsyncEncryptor
+from app.security.encryption import Encryptor, ENVELOPE_PREFIX
+
+class FakeContainer:
+    def __init__(self):
+        self.docs = {}
+
+    def read_item(self, item, partition_key):
+        if item not in self.docs:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message='Not found')
+        return dict(self.docs[item])
+
+    def create_item(self, body):
+        if body['id'] in self.docs:
+            raise exceptions.CosmosResourceExistsError(status_code=409, message='Conflict')
+        self.docs[body['id']] = dict(body)
+        return body
+
+class TestEnvelopeEncryption(unittest.TestCase):
+    def setUp(self):
+        patchers = [
+            patch('app.clients.registry.KeyClient'),
+            patch('app.clients.registry.CryptographyClient'),
+            patch('app.clients.registry.DefaultAzureCredential'),
+        ]
+        self.mock_key_client, self.mock_crypto_client_class, _ = [p.start() for p in patchers]
+        for p in patchers:
+            self.addCleanup(p.stop)
+
+        self.registry = ClientRegistry()
+        mock_key = MagicMock()
+        mock_key.name = 'fake-key-name'
+        mock_key.properties.version = 'v1'
+        self.mock_key_client.return_value.get_key.return_value = mock_key
+
+        self.mock_crypto_client = MagicMock()
+        self.mock_crypto_client.wrap_key.side_effect = lambda alg, key: MagicMock(encrypted_key=key[::-1])
+        self.mock_crypto_client.unwrap_key.side_effect = lambda alg, key: MagicMock(key=key[::-1])
+        self.mock_crypto_client.decrypt.return_value.plaintext = b'legacy_data'
+        self.mock_crypto_client_class.return_value = self.mock_crypto_client
+
+    def new_encryptor(self, data_key_store=None):
+        return Encryptor('https://fake-vault.vault.azure.net', 'fake-key-name', mode='envelope', registry=self.registry,
+                         data_key_store=data_key_store)
+
+    @staticmethod
+    def wrapped_key_of(ciphertext):
+        return ciphertext.split(':')[1]
+
+    def test_round_trip_wraps_data_key_once(self):
+        encryptor = self.new_encryptor()
+        ciphertexts = [encryptor.encrypt(f"name {i}") for i in range(50)]
+
+        self.assertTrue(all(c.startswith(ENVELOPE_PREFIX) and c.endswith('|v1') for c in ciphertexts))
+        self.assertEqual([encryptor.decrypt(c) for c in ciphertexts], [f"name {i}" for i in range(50)])
+        self.assertEqual(self.mock_crypto_client.wrap_key.call_count, 1)
+        self.mock_crypto_client.encrypt.assert_not_called()
+        self.mock_crypto_client.unwrap_key.assert_not_called()
+
+    def test_new_instance_unwraps_once(self):
+        ciphertexts = [self.new_encryptor().encrypt(f"n{i}") for i in range(2)]
+        reader = self.new_encryptor()
+        for _ in range(10):
+            self.assertEqual([reader.decrypt(c) for c in ciphertexts], ['n0', 'n1'])
+        self.assertEqual(self.mock_crypto_client.unwrap_key.call_count, 2)
+
+    def test_legacy_ciphertext_still_decrypts(self):
+        encryptor = self.new_encryptor()
+        self.assertEqual(encryptor.decrypt('ZW5jcnlwdGVkX2RhdGE=|v1'), 'legacy_data')
+        self.mock_crypto_client.decrypt.assert_called_once()
+
+    def test_tampered_ciphertext_reports_error(self):
+        encryptor = self.new_encryptor()
+        ciphertext = encryptor.encrypt('secret')
+        tampered = ciphertext.replace('|v1', '|v2')
+        self.assertTrue(encryptor.decrypt(tampered).startswith('[Decryption Error'))
+
+    def test_workers_share_one_stored_data_key(self):
+        store = DataKeyStore(FakeContainer())
+        first, second = self.new_encryptor(store), self.new_encryptor(store)
+        ciphertexts = [first.encrypt('a'), second.encrypt('b')]
+
+        self.assertEqual(self.wrapped_key_of(ciphertexts[0]), self.wrapped_key_of(ciphertexts[1]))
+        self.assertEqual(list(store.container.docs), ['data_key:v1'])
+        self.assertEqual(self.mock_crypto_client.wrap_key.call_count, 1)
+        # The second worker unwrapped the stored key once; a new reader needs one unwrap for both
+        reader = self.new_encryptor(store)
+        self.assertEqual([reader.decrypt(c) for c in ciphertexts], ['a', 'b'])
+        self.assertEqual(self.mock_crypto_client.unwrap_key.call_count, 2)
+
+    def test_data_key_stored_first_wins(self):
+        store = DataKeyStore(FakeContainer())
+        winning = self.new_encryptor(store).encrypt('a')
+        loser = self.new_encryptor(DataKeyStore(store.container))
+        # It looked before the winner stored its key, so it wraps its own and loses the create
+        with patch.object(loser.data_key_store, 'get', side_effect=[None, store.get('v1')]):
+            losing = loser.encrypt('b')
+
+        self.assertEqual(self.wrapped_key_of(winning), self.wrapped_key_of(losing))
+        self.assertEqual(self.mock_crypto_client.wrap_key.call_count, 2)
+        self.assertEqual(loser.decrypt(winning), 'a')
+
+    def test_stored_data_key_falls_back_when_cosmos_fails(self):
+        store = MagicMock()
+        store.get.side_effect = exceptions.CosmosHttpResponseError(status_code=503, message='Unavailable')
+        encryptor = self.new_encryptor(store)
+        self.assertEqual(encryptor.decrypt(encryptor.encrypt('a')), 'a')
+        store.add.assert_not_called()
+
+    def test_unwraps_of_different_keys_overlap(self):
+        ciphertexts = [self.new_encryptor().encrypt(f"n{i}") for i in range(4)]
+        def unwrap_key(alg, key):
+            time.sleep(0.2)
+            return MagicMock(key=key[::-1])
+        self.mock_crypto_client.unwrap_key.side_effect = unwrap_key
+
+        reader = self.new_encryptor()
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            # Two callers per key: one unwrap each, and the four run side by side
+            results = list(pool.map(reader.decrypt, ciphertexts * 2))
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(results, ['n0', 'n1', 'n2', 'n3'] * 2)
+        self.assertEqual(self.mock_crypto_client.unwrap_key.call_count, 4)
+
+    def test_key_version_of_another_workers_rotation_is_picked_up(self):
+        encryptor = Encryptor('https://fake-vault.vault.azure.net', 'fake-key-name', mode='envelope',
+                              registry=self.registry, key_version_ttl=60)
+        self.assertTrue(encryptor.encrypt('before').endswith('|v1'))
+        rotated = MagicMock()
+        rotated.properties.version = 'v2'
+        self.mock_key_client.return_value.get_key.return_value = rotated
+
+        # Not looked up again until the TTL has passed
+        self.assertTrue(encryptor.encrypt('soon after').endswith('|v1'))
+        encryptor._key_version_checked_at -= 61
+        self.assertTrue(encryptor.encrypt('after').endswith('|v2'))
+        self.assertEqual(encryptor.current_key_version, 'v2')
+
+class TestAsyncEnvelopeEncryption(unittest.TestCase):
+    def test_shared_data_key_and_overlapping_unwraps(self):
+        container = FakeContainer()
+
+        class AsyncContainer:
+            async def read_item(self, item, partition_key):
+                return container.read_item(item, partition_key)
+
+            async def create_item(self, body):
+                return container.create_item(body)
+
+        class CryptoClient:
+            unwraps = 0
+
+            async def wrap_key(self, alg, key):
+                return MagicMock(encrypted_key=key[::-1])
+
+            async def unwrap_key(self, alg, key):
+                self.unwraps += 1
+                await asyncio.sleep(0.2)
+                return MagicMock(key=key[::-1])
+
+        crypto_client = CryptoClient()
+
+        def new_encryptor(data_key_store=None):
+            encryptor = AsyncEncryptor('https://fake-vault.vault.azure.net', 'fake-key-name', mode='envelope',
+                                       credential=MagicMock(), data_key_store=data_key_store)
+            encryptor.current_key_version = 'v1'
+            encryptor.crypto_clients['v1'] = crypto_client
+            return encryptor
+
+        async def run():
+            store = AsyncDataKeyStore(AsyncContainer())
+            shared = [await new_encryptor(store).encrypt('a'), await new_encryptor(store).encrypt('b')]
+            own = [await new_encryptor().encrypt(f'n{i}') for i in range(3)]
+            crypto_client.unwraps = 0
+            reader = new_encryptor()
+            start = time.monotonic()
+            results = await asyncio.gather(*(reader.decrypt(c) for c in (shared + own) * 2))
+            return shared, results, time.monotonic() - start
+
+        shared, results, elapsed = asyncio.run(run())
+        self.assertEqual(shared[0].split(':')[1], shared[1].split(':')[1])
+        self.assertEqual(results, ['a', 'b', 'n0', 'n1', 'n2'] * 2)
+        # Four distinct data keys, each unwrapped once, all at the same time
+        self.assertEqual(crypto_client.unwraps, 4)
+        self.assertLess(elapsed, 0.6)
+
+if __name__ == '__main__':
+    unittest.main()
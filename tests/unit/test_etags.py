@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from unittest.mock import MagicMock, patch
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from flask import Blueprint, Flask
+from app.api.routes import init_routes
+from app.data.cosmos_db_client import CosmosDBClient
+from app.data.etags import ANY, NOT_MODIFIED, Versioned, parse_if_match, parse_if_none_match
+
+ITEM = {'id': '1', 'name': 'enc:One', '_etag': '"e1"'}
+
+class TestETagParsing(unittest.TestCase):
+    def test_headers(self):
+        self.assertIsNone(parse_if_none_match(None))
+        self.assertEqual(parse_if_none_match('"a", W/"b"'), {'"a"', '"b"'})
+        self.assertEqual(parse_if_none_match('*'), {ANY})
+        self.assertEqual(parse_if_match('"a"'), '"a"')
+        with self.assertRaises(ValueError):
+            parse_if_match('"a", "b"')
+
+class TestConditionalCosmosDBClient(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def build(self, backend, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name',
+            'CACHE_BACKEND': backend,
+            'CACHE_TTL': 10
+        }
+        cosmos_client = CosmosDBClient(app)
+        cosmos_client.encryptor.decrypt.side_effect = lambda value: value.replace('enc:', '')
+        cosmos_client.container.read_item.side_effect = lambda **kwargs: dict(ITEM)
+        return cosmos_client
+
+    def test_matching_etag_skips_decrypt(self):
+        for backend in ('none', 'memory'):
+            cosmos_client = self.build(backend)
+            user = cosmos_client.get_item_versioned('1')
+            self.assertEqual((user.value['name'], user.etag), ('One', '"e1"'))
+
+            # Cached or not, an unchanged item is answered without decrypting it
+            cosmos_client.container.read_item.side_effect = lambda **kwargs: {}
+            self.assertIs(cosmos_client.get_item_versioned('1', if_none_match={'"e1"'}).value, NOT_MODIFIED)
+            self.assertEqual(cosmos_client.encryptor.decrypt.call_count, 1)
+
+    def test_conditional_read_without_cache_uses_the_clients_etag(self):
+        cosmos_client = self.build('none')
+        cosmos_client.container.read_item.side_effect = lambda **kwargs: {}
+        self.assertIs(cosmos_client.get_item_versioned('1', if_none_match={'"e1"'}).value, NOT_MODIFIED)
+        cosmos_client.container.read_item.assert_called_with(item='1', partition_key='1', etag='"e1"',
+                                                             match_condition=MatchConditions.IfModified)
+
+    def test_listing_etag_changes_with_items(self):
+        cosmos_client = self.build('none')
+        cosmos_client.container.query_items.return_value = [dict(ITEM)]
+        first = cosmos_client.get_all_items_versioned()
+        self.assertIs(cosmos_client.get_all_items_versioned(if_none_match={first.etag}).value, NOT_MODIFIED)
+        self.assertEqual(cosmos_client.encryptor.decrypt.call_count, 1)
+
+        cosmos_client.container.query_items.return_value = [dict(ITEM, _etag='"e2"')]
+        changed = cosmos_client.get_all_items_versioned(if_none_match={first.etag})
+        self.assertNotEqual(changed.etag, first.etag)
+        self.assertEqual(changed.value[0]['name'], 'One')
+
+    def test_if_match_replaces_conditionally(self):
+        cosmos_client = self.build('none')
+        cosmos_client.encryptor.encrypt.side_effect = lambda value: 'enc:' + value
+        cosmos_client.update_item({'id': '1', 'name': 'One'}, if_match='"e1"')
+        cosmos_client.container.replace_item.assert_called_once_with(
+            item='1', body={'id': '1', 'name': 'enc:One'}, etag='"e1"', match_condition=MatchConditions.IfNotModified)
+        cosmos_client.container.upsert_item.assert_not_called()
+
+        cosmos_client.delete_item('1', if_match=ANY)
+        cosmos_client.container.delete_item.assert_called_once_with(item='1', partition_key='1')
+
+class TestConditionalRoutes(unittest.TestCase):
+    def setUp(self):
+        self.cosmos_client = MagicMock()
+        auth = MagicMock()
+        auth.require_auth.return_value = lambda f: f
+        limiter = MagicMock()
+        limiter.limit.return_value = lambda f: f
+        app = Flask(__name__)
+        app.register_blueprint(init_routes(Blueprint('api', __name__),
+                                           self.cosmos_client, auth, limiter), url_prefix='/api')
+        self.client = app.test_client()
+
+    def test_get_user_not_modified(self):
+        self.cosmos_client.get_item_versioned.return_value = Versioned(NOT_MODIFIED, '"e1"')
+        response = self.client.get('/api/users/1', headers={'If-None-Match': '"e1"'})
+        self.assertEqual((response.status_code, response.data, response.headers['ETag']), (304, b'', '"e1"'))
+        self.assertEqual(self.cosmos_client.get_item_versioned.call_args.kwargs['if_none_match'], {'"e1"'})
+
+    def test_stale_if_match_is_412(self):
+        self.cosmos_client.update_item.side_effect = exceptions.CosmosAccessConditionFailedError(
+            status_code=412, message='Precondition failed')
+        response = self.client.put('/api/users/1', json={'name': 'One'}, headers={'If-Match': '"old"'})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.cosmos_client.update_item.call_args.kwargs['if_match'], '"old"')
+
+if __name__ == '__main__':
+    unittest.main()
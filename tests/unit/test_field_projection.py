@@ -0,0 +1,88 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from unittest.mock import MagicMock, patch
+from app.data.cosmos_db_client import CosmosDBClient, list_query
+from app.data.fields import FieldPolicy, parse_fields
+from app.data.key_rotation import pending_filter
+
+class TestFieldProjection(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def setUp(self, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name',
+            'ENCRYPTED_FIELDS': {'item': ['name', 'ssn']}
+        }
+        self.cosmos_client = CosmosDBClient(app)
+        self.decrypt = self.cosmos_client.encryptor.decrypt
+        self.decrypt.side_effect = lambda value: value.replace('enc:', '')
+        self.container = self.cosmos_client.container
+
+    def test_parse_fields(self):
+        self.assertIsNone(parse_fields(None))
+        self.assertEqual(parse_fields('email, name,email'), ['id', 'email', 'name'])
+        for bad in ('', 'name,', 'c.name', 'name FROM c', '1st'):
+            with self.assertRaises(ValueError):
+                parse_fields(bad)
+
+    def test_projected_query_selects_only_requested_fields(self):
+        query = list_query(['id', 'email'])
+        self.assertTrue(query.startswith('SELECT c["id"], c["email"], c["type"], c["_etag"] FROM c WHERE '))
+        self.assertTrue(list_query().startswith('SELECT * FROM c'))
+
+    def test_reserved_words_are_quoted_in_queries(self):
+        # c.value, c.select, c.top, ... are syntax errors; the quoted form is not
+        query = list_query(parse_fields('value,select,order,email'))
+        self.assertTrue(query.startswith('SELECT c["id"], c["value"], c["select"], c["order"], c["email"], '))
+        self.assertNotIn('c.value', query)
+        query = pending_filter(FieldPolicy({'item': ['value']}))
+        self.assertIn('NOT ENDSWITH(c["value"], @suffix)', query)
+
+    def test_only_requested_encrypted_fields_are_decrypted(self):
+        self.container.query_items.return_value = [
+            {'id': '1', 'name': 'enc:One', 'email': 'one@example.com'},
+        ]
+        items = self.cosmos_client.get_all_items(fields=['id', 'name'])
+
+        self.assertEqual(items, [{'id': '1', 'name': 'One'}])
+        self.decrypt.assert_called_once_with('enc:One')
+
+    def test_projection_without_encrypted_fields_skips_decryption(self):
+        self.container.query_items.return_value = [{'id': '1', 'email': 'one@example.com'}]
+        items = self.cosmos_client.get_all_items(fields=['id', 'email'])
+
+        self.assertEqual(items, [{'id': '1', 'email': 'one@example.com'}])
+        self.decrypt.assert_not_called()
+
+    def test_partial_get_item_is_not_cached(self):
+        self.container.read_item.return_value = {'id': '1', 'name': 'enc:One', 'ssn': 'enc:123', '_etag': '"1"'}
+
+        self.assertEqual(self.cosmos_client.get_item('1', fields=['id', 'name']), {'id': '1', 'name': 'One'})
+        self.decrypt.assert_called_once_with('enc:One')
+        self.assertIsNone(self.cosmos_client.cache.get('1'))
+
+        item = self.cosmos_client.get_item('1')
+        self.assertEqual((item['name'], item['ssn']), ('One', '123'))
+        self.assertEqual(self.cosmos_client.get_item('1', fields=['id', 'ssn']), {'id': '1', 'ssn': '123'})
+        self.assertEqual(self.container.read_item.call_count, 2)
+
+    def test_field_policy_rejects_unsafe_names(self):
+        with self.assertRaises(ValueError):
+            FieldPolicy({'item': ['name) OR (1=1']})
+
+    def test_pending_filter_covers_each_type(self):
+        query = pending_filter(FieldPolicy({'item': ['name'], 'profile': ['ssn', 'phone']}))
+        self.assertIn('NOT IS_DEFINED(c.type) AND ((IS_DEFINED(c["name"]) AND NOT ENDSWITH(c["name"], @suffix)))', query)
+        self.assertIn("c.type = 'profile'", query)
+        self.assertIn('NOT ENDSWITH(c["phone"], @suffix)', query)
+
+if __name__ == '__main__':
+    unittest.main()
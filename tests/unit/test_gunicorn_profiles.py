@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import importlib.util
+import runpy
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+import urllib.request
+from unittest.mock import patch
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+CONF = os.path.join(ROOT, 'config/gunicorn.conf.py')
+
+def load(**env):
+    with patch.dict(os.environ, env, clear=False):
+        for name in ('AZURE_POOL_SIZE', 'WEB_CONCURRENCY', 'WORKER_CONCURRENCY'):
+            if name not in env:
+                os.environ.pop(name, None)
+        settings = runpy.run_path(CONF)
+        settings['AZURE_POOL_SIZE'] = os.environ['AZURE_POOL_SIZE']
+    return settings
+
+class TestGunicornProfiles(unittest.TestCase):
+    def test_gthread_is_the_default(self):
+        settings = load(DECRYPT_CONCURRENCY='16')
+        self.assertEqual(settings['worker_class'], 'gthread')
+        self.assertEqual(settings['threads'], 8)
+        self.assertEqual(settings['wsgi_app'], 'wsgi:application')
+        # One connection per thread plus one per concurrent decrypt call
+        self.assertEqual(settings['AZURE_POOL_SIZE'], '24')
+        self.assertGreater(settings['max_requests_jitter'], 0)
+
+    def test_async_profile_serves_the_asgi_app(self):
+        settings = load(GUNICORN_PROFILE='async', WORKER_CONCURRENCY='32', DECRYPT_CONCURRENCY='16')
+        self.assertEqual(settings['worker_class'], 'uvicorn.workers.UvicornWorker')
+        self.assertEqual(settings['wsgi_app'], 'asgi:application')
+        self.assertEqual(settings['threads'], 1)
+        self.assertEqual(settings['AZURE_POOL_SIZE'], '48')
+
+    def test_explicit_pool_size_and_worker_count_win(self):
+        settings = load(GUNICORN_PROFILE='sync', AZURE_POOL_SIZE='10', WEB_CONCURRENCY='3')
+        self.assertEqual(settings['workers'], 3)
+        self.assertEqual(settings['AZURE_POOL_SIZE'], '10')
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            load(GUNICORN_PROFILE='eventlet')
+
+@unittest.skipIf(importlib.util.find_spec('gunicorn') is None, "gunicorn is not installed")
+class TestGunicornBoot(unittest.TestCase):
+    """Starts gunicorn with each profile, preloaded app included, and waits for a worker to answer."""
+
+    def boot(self, profile):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        env = dict(os.environ, GUNICORN_PROFILE=profile, WEB_CONCURRENCY='1', WARM_UP_ON_LOAD='false',
+                   METRICS_DIR=metrics_dir.name)
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', CONF, '-b', f'127.0.0.1:{port}'],
+                                  cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                if server.poll() is not None:
+                    self.fail(f"gunicorn exited with {server.returncode}: {server.stderr.read().decode()[-2000:]}")
+                try:
+                    with urllib.request.urlopen(f'http://127.0.0.1:{port}/healthz', timeout=2) as response:
+                        return response.status
+                except OSError:
+                    time.sleep(0.2)
+            self.fail(f"no worker of the {profile} profile answered")
+        finally:
+            server.terminate()
+            server.communicate(timeout=30)
+
+    def test_every_profile_boots(self):
+        for profile in ('sync', 'gthread', 'gevent', 'async'):
+            with self.subTest(profile=profile):
+                if profile == 'gevent' and importlib.util.find_spec('gevent') is None:
+                    self.skipTest("gevent is not installed")
+                self.assertEqual(self.boot(profile), 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import itertools
+import unittest
+from unittest.mock import MagicMock, patch
+from azure.cosmos import exceptions
+from app.data.cosmos_db_client import CosmosDBClient
+from app.data.key_rotation import RotationInProgressError, CHECKPOINT_ID, new_checkpoint
+
+class FakeQuery:
+    def __init__(self, container, docs, page_size):
+        self.container = container
+        self.docs = docs
+        self.page_size = page_size
+        self.continuation_token = None
+
+    def by_page(self, continuation=None):
+        self.docs = [d for d in self.docs if continuation is None or d['id'] > continuation]
+        self.pages_read = 0
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = self.pages_read * self.page_size
+        if start >= len(self.docs):
+            raise StopIteration
+        self.pages_read += 1
+        if self.pages_read == self.container.fail_on_page:
+            raise exceptions.CosmosHttpResponseError(status_code=503, message='Service unavailable')
+        page = self.docs[start:start + self.page_size]
+        self.continuation_token = page[-1]['id'] if start + self.page_size < len(self.docs) else None
+        return iter([dict(d) for d in page])
+
+class FakeContainer:
+    def __init__(self, docs):
+        self._etags = itertools.count()
+        self.docs = {}
+        self.replaced = []
+        self.fail_on_page = None
+        for doc in docs:
+            self.upsert_item(doc)
+
+    def _store(self, body):
+        self.docs[body['id']] = dict(body, _etag=str(next(self._etags)))
+        return dict(self.docs[body['id']])
+
+    def read_item(self, item, partition_key):
+        if item not in self.docs:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message='Not found')
+        return dict(self.docs[item])
+
+    def create_item(self, body):
+        if body['id'] in self.docs:
+            raise exceptions.CosmosResourceExistsError(status_code=409, message='Conflict')
+        return self._store(body)
+
+    def upsert_item(self, body):
+        return self._store(body)
+
+    def replace_item(self, item, body, etag=None, match_condition=None):
+        if etag is not None and self.docs[item]['_etag'] != etag:
+            raise exceptions.CosmosAccessConditionFailedError(status_code=412, message='Precondition failed')
+        self.replaced.append(item)
+        return self._store(body)
+
+    def query_items(self, query, parameters=None, enable_cross_partition_query=None, max_item_count=None):
+        suffix = parameters[0]['value']
+        pending = [d for _, d in sorted(self.docs.items())
+                   if 'name' in d and not d['name'].endswith(suffix) and d.get('type') != 'role']
+        if 'COUNT' in query:
+            return [len(pending)]
+        return FakeQuery(self, pending, max_item_count)
+
+class TestKeyRotationJob(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def setUp(self, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name',
+            'KEY_ROTATION_PAGE_SIZE': 2
+        }
+        self.cosmos_client = CosmosDBClient(app)
+        docs = [{'id': f'user{i}', 'name': f'enc:User {i}|v1'} for i in range(5)]
+        docs.append({'id': 'user9', 'name': 'enc:Already rotated|v2'})
+        docs.append({'id': 'role1', 'type': 'role', 'name': 'admin', 'permissions': []})
+        self.container = FakeContainer(docs)
+        self.cosmos_client.container = self.container
+
+        encryptor = self.cosmos_client.encryptor
+        encryptor.current_key_version = 'v1'
+        def rotate_key():
+            encryptor.current_key_version = 'v2'
+            return 'v2'
+        encryptor.rotate_key.side_effect = rotate_key
+        encryptor.encrypt.side_effect = lambda text: f"enc:{text}|{encryptor.current_key_version}"
+        encryptor.decrypt.side_effect = lambda text: text[len('enc:'):].rsplit('|', 1)[0]
+
+    def test_rotation_re_encrypts_pending_items(self):
+        self.cosmos_client.start_key_rotation()
+        self.cosmos_client.rotation_job._thread.join(5)
+
+        status = self.cosmos_client.get_key_rotation_status()
+        self.assertEqual(status['status'], 'completed')
+        self.assertEqual(status['target_version'], 'v2')
+        self.assertEqual((status['total'], status['processed'], status['remaining']), (5, 5, 0))
+        self.assertEqual(sorted(self.container.replaced), [f'user{i}' for i in range(5)])
+        self.assertEqual(self.container.docs['user3']['name'], 'enc:User 3|v2')
+        self.assertEqual(self.container.docs['role1']['name'], 'admin')
+
+    def test_interrupted_rotation_resumes_from_checkpoint(self):
+        self.container.fail_on_page = 2
+        self.cosmos_client.start_key_rotation()
+        self.cosmos_client.rotation_job._thread.join(5)
+        checkpoint = self.container.docs[CHECKPOINT_ID]
+        self.assertEqual(checkpoint['status'], 'failed')
+        self.assertEqual(checkpoint['continuation'], 'user1')
+
+        self.container.fail_on_page = None
+        self.cosmos_client.start_key_rotation()
+        self.cosmos_client.rotation_job._thread.join(5)
+
+        self.assertEqual(self.cosmos_client.encryptor.rotate_key.call_count, 1)
+        replaced = [item_id for item_id in self.container.replaced if item_id != CHECKPOINT_ID]
+        self.assertEqual(sorted(replaced), [f'user{i}' for i in range(5)])
+        self.assertEqual(self.container.docs[CHECKPOINT_ID]['status'], 'completed')
+
+    def test_another_workers_rotation_is_resumed_on_its_version(self):
+        # Started by a worker that rotated to v2 and died before it was done
+        self.container.upsert_item(dict(new_checkpoint('v2'), status='running', updated_at=0))
+        encryptor = self.cosmos_client.encryptor
+        encryptor.use_key_version.side_effect = lambda version: setattr(encryptor, 'current_key_version', version)
+
+        self.cosmos_client.start_key_rotation()
+        self.cosmos_client.rotation_job._thread.join(5)
+
+        encryptor.rotate_key.assert_not_called()
+        encryptor.use_key_version.assert_called_once_with('v2')
+        self.assertEqual(self.container.docs['user3']['name'], 'enc:User 3|v2')
+        self.assertEqual(self.container.docs[CHECKPOINT_ID]['status'], 'completed')
+
+    def test_active_rotation_is_not_started_twice(self):
+        self.container.upsert_item({'id': CHECKPOINT_ID, 'type': 'key_rotation', 'target_version': 'v1',
+                                    'status': 'running', 'updated_at': 10 ** 12})
+        with self.assertRaises(RotationInProgressError):
+            self.cosmos_client.start_key_rotation()
+        self.cosmos_client.encryptor.rotate_key.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from types import SimpleNamespace
+from app import create_app, warm_up
+from app.clients.lazy import LazyClient
+from config import Config
+
+BASE_URL = 'https://localhost'
+
+class TestLazyClient(unittest.TestCase):
+    def test_builds_once_and_retries_after_a_failure(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ConnectionError("vault unreachable")
+            return SimpleNamespace(status='built')
+
+        client = LazyClient(factory, 'test client')
+        self.assertFalse(client.ready)
+        with self.assertRaises(ConnectionError):
+            client.get()
+        self.assertIsInstance(client.error, ConnectionError)
+
+        self.assertEqual(client.get().status, 'built')
+        self.assertTrue(client.ready)
+        self.assertIsNone(client.error)
+        # Attribute access goes to the built client
+        self.assertEqual(client.status, 'built')
+        self.assertEqual(len(calls), 2)
+
+class TestLazyApp(unittest.TestCase):
+    def make_app(self, **overrides):
+        config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+        config.update(TESTING=True, SECRET_KEY='test', JWT_SECRET_KEY='test', GITHUB_CLIENT_ID=None,
+                      RATELIMIT_STORAGE_URI='memory://', LOG_LEVEL='ERROR', METRICS_DIR=None,
+                      KEY_VAULT_URL='https://unreachable.invalid/', **overrides)
+        return create_app(config)
+
+    def test_create_app_does_not_contact_azure_and_can_run_twice(self):
+        first, second = self.make_app(), self.make_app()
+        self.assertIsNot(first.blueprints['api'], second.blueprints['api'])
+        self.assertFalse(first.extensions['cosmos'].ready)
+
+    def test_probes(self):
+        app = self.make_app()
+        client = app.test_client()
+
+        response = client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'status': 'ok'})
+
+        built = {'ok': False}
+
+        def factory():
+            if not built['ok']:
+                raise ConnectionError("Key Vault unreachable")
+            return object()
+        app.extensions['cosmos']._factory = factory
+
+        # Probes come over plain HTTP from the orchestrator and are not redirected
+        response = client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['error'], 'ConnectionError')
+
+        built['ok'] = True
+        self.assertEqual(client.get('/readyz').status_code, 200)
+
+    def test_warm_up_reports_failures_instead_of_raising(self):
+        app = self.make_app()
+        app.extensions['cosmos']._factory = lambda: (_ for _ in ()).throw(ConnectionError("down"))
+        self.assertFalse(warm_up(app))
+
+    def test_github_login_is_optional(self):
+        app = self.make_app()
+        response = app.test_client().get('/auth/login/github', base_url=BASE_URL)
+        self.assertEqual(response.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import io
+import json
+import logging
+import queue
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from app.logging.setup import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, configure_logging
+
+def make_record(level=logging.INFO, msg='hello %s', args=('world',), **extra):
+    record = logging.LogRecord('app.test', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+class TestLoggingPipeline(unittest.TestCase):
+    def test_json_lines_carry_extra_fields(self):
+        entry = json.loads(JsonFormatter().format(make_record(item_id='42')))
+        self.assertEqual((entry['level'], entry['logger'], entry['message'], entry['item_id']),
+                         ('INFO', 'app.test', 'hello world', '42'))
+
+    def test_sampling_never_drops_warnings(self):
+        sampler = SamplingFilter({'DEBUG': 0.1, 'INFO': 0.5}, random_func=lambda: 0.3)
+        self.assertFalse(sampler.filter(make_record(logging.DEBUG)))
+        self.assertTrue(sampler.filter(make_record(logging.INFO)))
+        self.assertTrue(sampler.filter(make_record(logging.WARNING)))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+        handler.handle(make_record())
+        handler.handle(make_record())
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(handler.queue.get_nowait().msg, 'hello world')
+
+    def test_records_are_written_by_the_listener_with_per_module_levels(self):
+        stream = io.StringIO()
+        app = SimpleNamespace(config={'LOG_LEVEL': 'INFO', 'LOG_LEVELS': 'app.noisy=ERROR'},
+                              logger=logging.getLogger('app'))
+        with patch('app.logging.setup.sys.stdout', stream):
+            pipeline = configure_logging(app)
+        logging.getLogger('app.noisy').warning('suppressed')
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logging.getLogger('app.data').exception('failed', extra={'item_id': '7'})
+        pipeline.stop()
+        logging.getLogger('app.noisy').setLevel(logging.NOTSET)
+
+        entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([e['message'] for e in entries], ['Application startup', 'failed'])
+        self.assertEqual(entries[1]['item_id'], '7')
+        self.assertIn('ValueError: boom', entries[1]['exception'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import copy
+import itertools
+import unittest
+from unittest.mock import MagicMock, patch
+from azure.cosmos import exceptions
+from app.data.cosmos_db_client import CosmosDBClient
+from app.models.role import Role
+from app.models.user import User
+
+class FakeContainer:
+    """Point operations on a dict; queries are answered from query_results and counted."""
+
+    def __init__(self):
+        self.documents = {}
+        self.etags = itertools.count(1)
+        self.queries = []
+        self.query_results = []
+
+    def _store(self, body):
+        document = copy.deepcopy(body)
+        document['_etag'] = f'"{next(self.etags)}"'
+        self.documents[document['id']] = document
+        return copy.deepcopy(document)
+
+    def create_item(self, body):
+        if body['id'] in self.documents:
+            raise exceptions.CosmosResourceExistsError(status_code=409, message='exists')
+        return self._store(body)
+
+    def upsert_item(self, body):
+        return self._store(body)
+
+    def replace_item(self, item, body, etag=None, match_condition=None):
+        if etag is not None and self.documents.get(item, {}).get('_etag') != etag:
+            raise exceptions.CosmosAccessConditionFailedError(status_code=412, message='etag')
+        return self._store(body)
+
+    def read_item(self, item, partition_key):
+        if item not in self.documents:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message='missing')
+        return copy.deepcopy(self.documents[item])
+
+    def delete_item(self, item, partition_key):
+        if self.documents.pop(item, None) is None:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message='missing')
+
+    def query_items(self, query, **kwargs):
+        self.queries.append(query)
+        return list(self.query_results)
+
+class TestLookups(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def setUp(self, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name'
+        }
+        self.cosmos_client = CosmosDBClient(app)
+        self.container = self.cosmos_client.container = FakeContainer()
+
+    def test_usernames_resolve_with_point_reads_and_stay_unique(self):
+        user = self.cosmos_client.create_user(User('alice/admin', 'alice@example.com', ['user']))
+
+        self.assertEqual(self.cosmos_client.get_user_by_username('alice/admin').id, user.id)
+        self.assertIsNone(self.cosmos_client.get_user_by_username('bob'))
+        with self.assertRaises(exceptions.CosmosResourceExistsError):
+            self.cosmos_client.create_user(User('alice/admin', 'other@example.com'))
+        self.assertEqual(self.container.queries, [])
+
+    def test_stale_lookup_is_ignored_and_reclaimed(self):
+        user = self.cosmos_client.create_user(User('carol', 'carol@example.com'))
+        del self.container.documents[user.id]
+        self.assertIsNone(self.cosmos_client.get_user_by_username('carol'))
+
+        again = self.cosmos_client.create_user(User('carol', 'carol@example.com'))
+        self.assertEqual(self.cosmos_client.get_user_by_username('carol').id, again.id)
+
+    def test_roles_come_from_the_catalog(self):
+        editor = self.cosmos_client.create_role(Role('editor', ['read_user', 'update_user']))
+        self.cosmos_client.create_role(Role('viewer', ['read_user']))
+        editor.name, editor.permissions = 'writer', ['create_user']
+        self.cosmos_client.update_role(editor)
+        self.container.queries.clear()
+
+        roles = {role.name: role.permissions for role in self.cosmos_client.get_all_roles()}
+        self.assertEqual(roles, {'writer': ['create_user'], 'viewer': ['read_user']})
+        self.assertIsNone(self.cosmos_client.get_role_by_name('editor'))
+        self.assertEqual(self.cosmos_client.get_role_by_name('writer').id, editor.id)
+
+        self.cosmos_client.delete_role(editor.id)
+        self.assertEqual([role.name for role in self.cosmos_client.get_all_roles()], ['viewer'])
+        self.assertIsNone(self.cosmos_client.get_role_by_name('writer'))
+        self.assertEqual(self.container.queries, [])
+
+    def test_missing_catalog_is_rebuilt_from_a_projected_query(self):
+        self.container.query_results = [{'id': 'r1', 'name': 'auditor', 'permissions': ['read_user']}]
+        self.assertEqual([role.name for role in self.cosmos_client.get_all_roles()], ['auditor'])
+        self.assertTrue(self.container.queries[0].startswith('SELECT c["id"], c["name"], c["permissions"] FROM c'))
+
+        self.container.queries.clear()
+        self.assertEqual([role.name for role in self.cosmos_client.get_all_roles()], ['auditor'])
+        self.assertEqual(self.container.queries, [])
+
+if __name__ == '__main__':
+    unittest.main()
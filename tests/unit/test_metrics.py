@@ -0,0 +1,103 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import tempfile
+import unittest
+from unittest.mock import patch
+from flask import Flask, jsonify
+from app.metrics import init_metrics, metrics, record_request_charge, stage
+from app.metrics.registry import MetricsRegistry, render
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_histogram_exposition(self):
+        registry = MetricsRegistry()
+        for value in (0.0004, 0.003, 0.003, 20):
+            registry.observe('app_stage_seconds', value, (('stage', 'cosmos'),))
+        text = render(registry.snapshot())
+
+        self.assertIn('# TYPE app_stage_seconds histogram', text)
+        self.assertIn('app_stage_seconds_bucket{stage="cosmos",le="0.0005"} 1', text)
+        self.assertIn('app_stage_seconds_bucket{stage="cosmos",le="0.005"} 3', text)
+        self.assertIn('app_stage_seconds_bucket{stage="cosmos",le="+Inf"} 4', text)
+        self.assertIn('app_stage_seconds_count{stage="cosmos"} 4', text)
+
+    def test_workers_are_added_up_through_the_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = MetricsRegistry(directory, flush_interval=60), MetricsRegistry(directory, flush_interval=60)
+            first.observe('cosmos_request_charge', 2.5)
+            second.observe('cosmos_request_charge', 7.5)
+            # Stands in for another worker process, which flushes on its own
+            second.flush()
+
+            text = render(first.collect())
+            self.assertIn('cosmos_request_charge_count 2', text)
+            self.assertIn('cosmos_request_charge_sum 10.0', text)
+            first.clear()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_exited_workers_are_folded_into_one_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            live = MetricsRegistry(directory, flush_interval=60)
+            live.observe('cosmos_request_charge', 1)
+            # Recycled workers, each flushing its file before the master hears it has exited
+            for pid in range(1000, 1050):
+                with patch('app.metrics.registry.os.getpid', return_value=pid):
+                    worker = MetricsRegistry(directory, flush_interval=60)
+                    worker._flusher_pid = pid  # no background flusher for the stand-in
+                    worker.observe('cosmos_request_charge', 2)
+                    worker.flush()
+                live.mark_process_dead(pid)
+                self.assertLessEqual(len(os.listdir(directory)), 2)
+
+            text = render(live.collect())
+            self.assertIn('cosmos_request_charge_count 51', text)
+            self.assertIn('cosmos_request_charge_sum 101', text)
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+            # A worker file the master folded in but did not get to delete is not counted twice
+            with patch('app.metrics.registry.os.getpid', return_value=2000):
+                worker = MetricsRegistry(directory, flush_interval=60)
+                worker._flusher_pid = 2000
+                worker.observe('cosmos_request_charge', 2)
+                worker.flush()
+            with patch('app.metrics.registry.os.unlink'):
+                live.mark_process_dead(2000)
+            self.assertIn('cosmos_request_charge_count 52', render(live.collect()))
+
+class TestRequestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.app = Flask(__name__)
+        self.app.config['METRICS_DIR'] = None
+
+        @self.app.route('/users/<id>')
+        def get_user(id):
+            with stage('auth'):
+                pass
+            record_request_charge(1.5)
+            return jsonify({'id': id})
+
+        init_metrics(self.app)
+        self.client = self.app.test_client()
+
+    def test_server_timing_and_metrics_endpoint(self):
+        response = self.client.get('/users/1')
+        timing = response.headers['Server-Timing']
+        for part in ('auth;dur=', 'serialize;dur=', 'cosmos-ru;desc="1.50"', 'total;dur='):
+            self.assertIn(part, timing)
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{endpoint="/users/<id>",method="GET",status="200"} 1', text)
+        self.assertIn('app_stage_seconds_count{stage="auth"} 1', text)
+        self.assertIn('cosmos_request_charge_sum 1.5', text)
+
+    def test_server_timing_can_be_disabled(self):
+        app = Flask('disabled')
+        app.config['SERVER_TIMING_ENABLED'] = False
+        app.add_url_rule('/', 'index', lambda: 'ok')
+        init_metrics(app)
+        self.assertNotIn('Server-Timing', app.test_client().get('/').headers)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from flask import Blueprint, Flask, g
+from app.api.routes import init_routes
+from app.models.role import Role
+from app.models.schema import ValidationError
+from app.models.user import User
+
+class TestModels(unittest.TestCase):
+    def test_slots_and_lazy_ids(self):
+        with patch('app.models.base.uuid.uuid4') as uuid4:
+            roles = Role.from_dicts([{'id': str(i), 'name': f'role{i}', 'permissions': ['read_user']} for i in range(3)])
+            uuid4.assert_not_called()
+        self.assertFalse(hasattr(roles[0], '__dict__'))
+        self.assertEqual(Role.to_dicts(roles)[2], {'id': '2', 'name': 'role2', 'permissions': ['read_user']})
+
+        user = User('alice', 'alice@example.com')
+        self.assertEqual(user.id, user.id)
+        self.assertEqual(User.from_dict(user.to_dict()), user)
+
+    def test_schemas(self):
+        self.assertEqual(User.schema.validate({'name': 'One', 'email': 'one@example.com', 'city': 'Oslo'})['city'], 'Oslo')
+        with self.assertRaises(ValidationError) as raised:
+            User.schema.validate({'id': 'a/b', 'email': 'nope', 'type': 'role_catalog', 'roles': ['admin', 1]})
+        self.assertEqual(len(raised.exception.errors), 4)
+        with self.assertRaises(ValidationError):
+            User.schema.validate(['not', 'an', 'object'])
+
+        with self.assertRaises(ValidationError) as raised:
+            Role.schema.validate({'name': 'auditor', 'permissions': 'read_user', 'id': '1'})
+        self.assertEqual(raised.exception.errors, ["permissions must be a list", "id is not allowed"])
+        self.assertEqual(str(ValidationError(["a is required", "b is required"])), "a is required; b is required")
+
+class TestValidatedRoutes(unittest.TestCase):
+    def setUp(self):
+        self.cosmos_client = MagicMock()
+        auth = MagicMock()
+        auth.require_auth.return_value = lambda f: f
+        limiter = MagicMock()
+        limiter.limit.return_value = lambda f: f
+        app = Flask(__name__)
+        app.register_blueprint(init_routes(Blueprint('api', __name__),
+                                           self.cosmos_client, auth, limiter), url_prefix='/api')
+        app.before_request(lambda: setattr(g, 'user', SimpleNamespace(roles=['admin'])))
+        allowed = patch('app.rbac.utils.rbac_engine.is_allowed', return_value=True)
+        allowed.start()
+        self.addCleanup(allowed.stop)
+        self.client = app.test_client()
+
+    def test_invalid_bodies_are_400(self):
+        response = self.client.post('/api/users', json={'name': 'One', 'email': 'not-an-email'})
+        self.assertEqual((response.status_code, response.get_json()), (400, {'error': 'email is not valid'}))
+        self.assertEqual(self.client.put('/api/users/1', json={'id': '2'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/roles', json={'name': 'auditor'}).status_code, 400)
+        self.cosmos_client.create_item.assert_not_called()
+        self.cosmos_client.update_item.assert_not_called()
+        self.cosmos_client.create_role.assert_not_called()
+
+    def test_valid_role_is_created(self):
+        self.cosmos_client.create_role.side_effect = lambda role: role
+        with patch('app.api.routes.rbac_engine.refresh'):
+            response = self.client.post('/api/roles', json={'name': 'auditor', 'permissions': ['read_user']})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['permissions'], ['read_user'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from unittest.mock import MagicMock, patch
+from app.data.cosmos_db_client import CosmosDBClient
+from app.utils.helpers import encode_continuation, decode_continuation
+
+class FakePager:
+    def __init__(self, pages, start=None):
+        self._pages = pages
+        self._index = int(start) if start else 0
+        self.continuation_token = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._index >= len(self._pages):
+            raise StopIteration
+        page = self._pages[self._index]
+        self._index += 1
+        self.continuation_token = str(self._index) if self._index < len(self._pages) else None
+        return iter(page)
+
+class TestPagination(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def setUp(self, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name'
+        }
+        self.cosmos_client = CosmosDBClient(app)
+        self.cosmos_client.encryptor.decrypt.side_effect = lambda value: value.replace('enc:', '')
+        self.pages = [
+            [{'id': '1', 'name': 'enc:One'}, {'id': '2', 'name': 'enc:Two'}],
+            [{'id': '3', 'name': 'enc:Three'}],
+        ]
+        self.cosmos_client.container.query_items.return_value.by_page.side_effect = \
+            lambda continuation=None: FakePager([[dict(i) for i in page] for page in self.pages], continuation)
+
+    def test_get_items_page_follows_continuation(self):
+        items, continuation = self.cosmos_client.get_items_page(2)
+        self.assertEqual([i['name'] for i in items], ['One', 'Two'])
+        self.assertEqual(continuation, '1')
+
+        items, continuation = self.cosmos_client.get_items_page(2, continuation)
+        self.assertEqual([i['name'] for i in items], ['Three'])
+        self.assertIsNone(continuation)
+        self.assertEqual(self.cosmos_client.container.query_items.call_args.kwargs['max_item_count'], 2)
+
+    def test_iter_item_pages_yields_decrypted_pages(self):
+        pages = list(self.cosmos_client.iter_item_pages(2))
+        self.assertEqual([[i['name'] for i in page] for page in pages], [['One', 'Two'], ['Three']])
+
+    def test_continuation_round_trip(self):
+        token = '{"token":"+RID:~abc==#RT:1","range":{"min":"","max":"FF"}}'
+        encoded = encode_continuation(token)
+        self.assertNotIn('+', encoded)
+        self.assertEqual(decode_continuation(encoded), token)
+        self.assertIsNone(encode_continuation(None))
+        with self.assertRaises(ValueError):
+            decode_continuation('not base64!')
+
+if __name__ == '__main__':
+    unittest.main()
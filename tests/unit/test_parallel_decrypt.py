@@ -0,0 +1,62 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from app.data.cosmos_db_client import CosmosDBClient
+
+class TestParallelDecrypt(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def setUp(self, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name',
+            'DECRYPT_CONCURRENCY': 10
+        }
+        self.cosmos_client = CosmosDBClient(app)
+
+        def slow_decrypt(value):
+            time.sleep(0.05)
+            if value == 'enc:bad':
+                raise ValueError('bad ciphertext')
+            return value.replace('enc:', '')
+        self.cosmos_client.encryptor.decrypt.side_effect = slow_decrypt
+
+    def test_get_all_items_decrypts_concurrently_in_order(self):
+        self.cosmos_client.container.query_items.return_value = [
+            {'id': str(i), 'name': f'enc:User {i}'} for i in range(20)
+        ]
+        start = time.monotonic()
+        items = self.cosmos_client.get_all_items()
+        elapsed = time.monotonic() - start
+
+        self.assertEqual([item['name'] for item in items], [f'User {i}' for i in range(20)])
+        self.assertLess(elapsed, 0.5)
+
+    def test_failed_item_is_left_encrypted(self):
+        items = self.cosmos_client._decrypt_items([
+            {'id': '1', 'name': 'enc:One'}, {'id': '2', 'name': 'enc:bad'}, {'id': '3'}
+        ])
+        self.assertEqual(items, [{'id': '1', 'name': 'One'}, {'id': '2', 'name': 'enc:bad'}, {'id': '3'}])
+
+    def test_listing_with_a_failed_decrypt_has_no_etag(self):
+        documents = [{'id': '1', 'name': 'enc:One', '_etag': '"1"'}, {'id': '2', 'name': 'enc:kv down', '_etag': '"2"'}]
+        self.cosmos_client.container.query_items.side_effect = lambda **kwargs: [dict(d) for d in documents]
+        self.cosmos_client.encryptor.decrypt.side_effect = \
+            lambda value: '[Decryption Error: down]' if value == 'enc:kv down' else value.replace('enc:', '')
+
+        listing = self.cosmos_client.get_all_items_versioned()
+        self.assertIsNone(listing.etag)
+        self.assertEqual(listing.value[1]['name'], '[Decryption Error: down]')
+        documents[1]['name'] = 'enc:Two'
+        self.assertIsNotNone(self.cosmos_client.get_all_items_versioned().etag)
+
+if __name__ == '__main__':
+    unittest.main()
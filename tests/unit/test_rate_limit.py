@@ -0,0 +1,78 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from flask import Flask
+from limits import parse
+from limits.storage import MemoryStorage
+from limits.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+from app.auth.authenticator import Authenticator
+from app.ratelimit import principal_key
+from app.ratelimit.storage import BatchedStorage
+
+def worker(shared):
+    storage = BatchedStorage('batched+memory://', sync_interval=3600)
+    storage.backend = shared
+    return storage
+
+class TestBatchedStorage(unittest.TestCase):
+    def setUp(self):
+        self.shared = MemoryStorage()
+        self.limit = parse('5/minute')
+
+    def test_hits_are_sent_in_batches(self):
+        first, second = worker(self.shared), worker(self.shared)
+        limiter = FixedWindowRateLimiter(first)
+        self.assertTrue(all(limiter.hit(self.limit, 'alice') for _ in range(3)))
+        key = self.limit.key_for('alice')
+        self.assertEqual(self.shared.get(key), 1)
+
+        first.sync()
+        self.assertEqual(self.shared.get(key), 3)
+        other = FixedWindowRateLimiter(second)
+        self.assertEqual([other.hit(self.limit, 'alice') for _ in range(3)], [True, True, False])
+
+    def test_moving_window_is_enforced_locally_and_shared_after_sync(self):
+        first, second = worker(self.shared), worker(self.shared)
+        limiter = MovingWindowRateLimiter(first)
+        self.assertEqual([limiter.hit(self.limit, 'bob') for _ in range(7)], [True] * 5 + [False] * 2)
+
+        first.sync()
+        self.assertFalse(MovingWindowRateLimiter(second).hit(self.limit, 'bob'))
+        self.assertEqual(limiter.get_window_stats(self.limit, 'bob').remaining, 0)
+
+    def test_workers_stay_within_one_interval_of_the_limit(self):
+        limit = parse('100/minute')
+        workers = [worker(self.shared) for _ in range(4)]
+        limiters = [MovingWindowRateLimiter(storage) for storage in workers]
+        admitted = 0
+        # Every worker tries 50 requests per sync interval, for longer than the limit allows
+        for _ in range(10):
+            for limiter in limiters:
+                admitted += sum(limiter.hit(limit, 'dave') for _ in range(50))
+            for storage in workers:
+                storage.sync()
+        self.assertLessEqual(admitted, 100 + (len(workers) - 1) * 50)
+        self.assertEqual(self.shared.get_moving_window(limit.key_for('dave'), 100, 60)[1], 100)
+
+    def test_idle_keys_are_forgotten(self):
+        storage = worker(self.shared)
+        FixedWindowRateLimiter(storage).hit(self.limit, 'carol')
+        storage.sync()
+        storage.sync()
+        self.assertEqual(storage._counters, {})
+
+class TestPrincipalKey(unittest.TestCase):
+    def test_keys_by_principal_then_address(self):
+        app = Flask('test')
+        app.config.update(API_KEY='test_api_key')
+        app.extensions['authenticator'] = Authenticator(app)
+
+        with app.test_request_context(headers={'X-API-Key': 'test_api_key'}):
+            self.assertEqual(principal_key(), 'api_key:api-key')
+        with app.test_request_context(headers={'X-API-Key': 'wrong'}, environ_base={'REMOTE_ADDR': '10.0.0.7'}):
+            self.assertEqual(principal_key(), 'ip:10.0.0.7')
+
+if __name__ == '__main__':
+    unittest.main()
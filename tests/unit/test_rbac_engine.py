@@ -0,0 +1,71 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import unittest
+from types import SimpleNamespace
+from flask import Flask, g
+from app.rbac.engine import RBACEngine
+from app.rbac.utils import rbac_required
+
+class TestRBACEngine(unittest.TestCase):
+    def setUp(self):
+        self.stored_roles = {}
+        self.loads = 0
+
+        def loader():
+            self.loads += 1
+            return dict(self.stored_roles)
+        self.engine = RBACEngine(loader=loader, static_roles={'user': ['read_user']}, refresh_interval=0)
+
+    def test_checks_use_compiled_masks(self):
+        read = self.engine.permission_mask(['read_user'])
+        write = self.engine.permission_mask(['create_user', 'update_user'])
+
+        self.assertTrue(self.engine.is_allowed(['user'], read))
+        self.assertFalse(self.engine.is_allowed(['user'], read | write))
+        self.assertFalse(self.engine.is_allowed(['unknown'], read))
+        self.assertEqual(self.loads, 0)
+
+    def test_refresh_overlays_stored_roles_and_bumps_version(self):
+        required = self.engine.permission_mask(['create_user'])
+        self.assertFalse(self.engine.is_allowed(['editor'], required))
+
+        self.stored_roles['editor'] = ['read_user', 'create_user']
+        self.assertEqual(self.engine.refresh(), 1)
+        self.assertTrue(self.engine.is_allowed(['editor'], required))
+        self.assertEqual(self.engine.refresh(), 1)
+
+        self.stored_roles['user'] = []
+        self.assertEqual(self.engine.refresh(), 2)
+        self.assertFalse(self.engine.is_allowed(['user'], self.engine.permission_mask(['read_user'])))
+
+    def test_principal_masks_are_memoized_per_version(self):
+        self.engine.principal_mask(['user'])
+        self.assertIn(('user',), self.engine._snapshot.principals)
+        self.stored_roles['editor'] = ['create_user']
+        self.engine.refresh()
+        self.assertEqual(self.engine._snapshot.principals, {})
+
+class TestRbacRequired(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask('test')
+
+        @self.app.route('/roles')
+        @rbac_required(['manage_roles'])
+        def roles():
+            return 'ok'
+
+    def get_as(self, roles):
+        with self.app.test_request_context('/roles'):
+            g.user = SimpleNamespace(roles=roles) if roles is not None else None
+            response = self.app.make_response(self.app.view_functions['roles']())
+            return response.status_code
+
+    def test_decorator(self):
+        self.assertEqual(self.get_as(['admin']), 200)
+        self.assertEqual(self.get_as(['manager']), 403)
+        self.assertEqual(self.get_as(None), 401)
+
+if __name__ == '__main__':
+    unittest.main()
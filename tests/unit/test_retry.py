@@ -0,0 +1,120 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+from azure.cosmos import exceptions
+from azure.core.exceptions import ServiceRequestError
+from azure.cosmos._resource_throttle_retry_policy import ResourceThrottleRetryPolicy
+from azure.cosmos.cosmos_client import _build_connection_policy
+from app.data.retry import RetryPolicy, cosmos_connection_policy, deadline, is_retryable
+from app.data.cosmos_db_client import CosmosDBClient
+
+def cosmos_error(status_code, retry_after_ms=None):
+    error = exceptions.CosmosHttpResponseError(status_code=status_code, message='error')
+    if retry_after_ms is not None:
+        error.headers = {'x-ms-retry-after-ms': str(retry_after_ms)}
+    return error
+
+class FlakyCall:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.policy = RetryPolicy(max_attempts=4, base_delay=0.01, sleep=self.sleeps.append)
+
+    def test_classification(self):
+        self.assertTrue(all(is_retryable(cosmos_error(code)) for code in (408, 429, 449, 503)))
+        self.assertFalse(any(is_retryable(cosmos_error(code)) for code in (400, 404, 409, 412)))
+        self.assertTrue(is_retryable(ServiceRequestError('connection reset')))
+        self.assertFalse(is_retryable(ValueError('bad body')))
+
+    def test_permanent_error_is_not_retried(self):
+        call = FlakyCall(cosmos_error(409))
+        with self.assertRaises(exceptions.CosmosHttpResponseError):
+            self.policy(call)()
+        self.assertEqual((call.calls, self.sleeps), (1, []))
+        self.assertEqual(self.policy.stats.as_dict()['not_retryable'], 1)
+
+    def test_throttling_waits_as_long_as_the_service_asks(self):
+        call = FlakyCall(cosmos_error(429, retry_after_ms=250), cosmos_error(503))
+        self.assertEqual(self.policy(call)(), 'ok')
+
+        self.assertEqual(call.calls, 3)
+        self.assertTrue(0.25 <= self.sleeps[0] <= 0.26)
+        self.assertLessEqual(self.sleeps[1], 0.02)
+        stats = self.policy.stats.as_dict()
+        self.assertEqual((stats['recovered'], stats['retries_by_status']), (1, {'429': 1, '503': 1}))
+
+    def test_stops_when_retry_after_exceeds_the_request_budget(self):
+        call = FlakyCall(cosmos_error(429, retry_after_ms=5000))
+        with deadline(1), self.assertRaises(exceptions.CosmosHttpResponseError):
+            self.policy(call)()
+        self.assertEqual((call.calls, self.sleeps), (1, []))
+        self.assertEqual(self.policy.stats.as_dict()['exhausted'], 1)
+
+    def test_retries_do_not_nest(self):
+        inner = FlakyCall(*[cosmos_error(503)] * 10)
+        outer = self.policy(lambda: self.policy(inner)())
+        with self.assertRaises(exceptions.CosmosHttpResponseError):
+            outer()
+        self.assertEqual(inner.calls, 4)
+
+    def test_async_functions(self):
+        call = FlakyCall(cosmos_error(503))
+
+        @RetryPolicy(base_delay=0.001)
+        async def read():
+            return call()
+
+        self.assertEqual(asyncio.run(read()), 'ok')
+        self.assertEqual(call.calls, 2)
+
+class TestCosmosConnectionPolicy(unittest.TestCase):
+    def throttle_policy(self, **kwargs):
+        options = _build_connection_policy(kwargs).RetryOptions
+        return ResourceThrottleRetryPolicy(options.MaxRetryAttemptCount, options.FixedRetryIntervalInMilliseconds,
+                                           options.MaxWaitTimeInSeconds)
+
+    def test_sdk_does_not_retry_throttles_under_cosmos_retry(self):
+        self.assertTrue(self.throttle_policy().ShouldRetry(cosmos_error(429, retry_after_ms=1)))
+        # The SDK reads retry_total=0 as unset
+        self.assertTrue(self.throttle_policy(retry_total=0).ShouldRetry(cosmos_error(429, retry_after_ms=1)))
+        throttle = self.throttle_policy(connection_policy=cosmos_connection_policy())
+        self.assertFalse(throttle.ShouldRetry(cosmos_error(429, retry_after_ms=1)))
+
+class TestCosmosDBClientRetries(unittest.TestCase):
+    @patch('app.data.cosmos_db_client.Encryptor')
+    @patch('app.data.cosmos_db_client.get_registry')
+    def test_retried_create_does_not_encrypt_twice(self, mock_get_registry, mock_encryptor):
+        app = MagicMock()
+        app.config = {
+            'COSMOS_ENDPOINT': 'https://test.documents.azure.com:443/',
+            'DATABASE_NAME': 'test_db',
+            'CONTAINER_NAME': 'test_container',
+            'KEY_VAULT_URL': 'https://test-keyvault.vault.azure.net/',
+            'KEY_NAME': 'test-key-name'
+        }
+        cosmos_client = CosmosDBClient(app)
+        cosmos_client.encryptor.encrypt.side_effect = lambda value: f'enc:{value}'
+        cosmos_client.container.create_item.side_effect = [cosmos_error(429, retry_after_ms=1), {'id': '1'}]
+
+        item = {'id': '1', 'name': 'One'}
+        cosmos_client.create_item(item)
+
+        self.assertEqual(cosmos_client.container.create_item.call_args.kwargs['body']['name'], 'enc:One')
+        self.assertEqual(item['name'], 'One')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from cryptography.fernet import Fernet
+from app.clients import ClientRegistry
+from app.security.secrets_snapshot import SecretsSnapshot
+from config import Config, SECRETS_TO_LOAD
+
+VAULT_URL = 'https://fake-vault.vault.azure.net'
+
+class TestSecretsSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'secrets.bin')
+        self.key = Fernet.generate_key()
+
+    def test_round_trip_is_encrypted(self):
+        snapshot = SecretsSnapshot(self.path, self.key, 60, VAULT_URL)
+        snapshot.save({'API-KEY': 'super-secret'})
+
+        with open(self.path, 'rb') as f:
+            self.assertNotIn(b'super-secret', f.read())
+        self.assertEqual(snapshot.load(), {'API-KEY': 'super-secret'})
+
+    def test_expired_foreign_or_missing_snapshot_is_ignored(self):
+        self.assertIsNone(SecretsSnapshot(self.path, self.key, 60, VAULT_URL).load())
+        SecretsSnapshot(self.path, self.key, 60, VAULT_URL).save({'API-KEY': 'value'})
+
+        self.assertIsNone(SecretsSnapshot(self.path, Fernet.generate_key(), 60, VAULT_URL).load())
+        self.assertIsNone(SecretsSnapshot(self.path, self.key, 60, 'https://other-vault').load())
+        with patch('cryptography.fernet.time.time', return_value=time.time() + 120):
+            self.assertIsNone(SecretsSnapshot(self.path, self.key, 60, VAULT_URL).load())
+
+class TestLoadSecrets(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.registry = ClientRegistry()
+        patcher = patch('app.clients.get_registry', return_value=self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.fetched = []
+        self.fetch_lock = threading.Lock()
+
+        def get_secret(name):
+            time.sleep(0.1)
+            with self.fetch_lock:
+                self.fetched.append(name)
+            return MagicMock(value=f'{name}-value')
+        self.secret_client = MagicMock()
+        self.secret_client.get_secret.side_effect = get_secret
+        self.registry.secret_client = lambda vault_url: self.secret_client
+
+        class SnapshotConfig(Config):
+            KEY_VAULT_URL = VAULT_URL
+            SECRETS_SNAPSHOT_PATH = os.path.join(self.directory, 'secrets.bin')
+            SECRETS_SNAPSHOT_KEY = Fernet.generate_key()
+            SECRETS_SNAPSHOT_TTL = 60
+        self.config_class = SnapshotConfig
+
+    def test_fetches_concurrently_and_writes_snapshot(self):
+        start = time.monotonic()
+        self.config_class.load_secrets()
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(sorted(self.fetched), sorted(SECRETS_TO_LOAD))
+        self.assertEqual(self.config_class.API_KEY, 'API-KEY-value')
+        self.assertTrue(os.path.exists(self.config_class.SECRETS_SNAPSHOT_PATH))
+
+    def test_starts_from_snapshot_and_refreshes_in_background(self):
+        SecretsSnapshot.from_config(self.config_class).save({name: 'cached' for name in SECRETS_TO_LOAD})
+
+        with patch.object(SecretsSnapshot, 'refresh_in_background') as refresh:
+            self.config_class.load_secrets()
+
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(self.config_class.COSMOS_KEY, 'cached')
+        self.assertEqual(self.registry.get_secret(VAULT_URL, 'COSMOS-KEY'), 'cached')
+        refresh.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
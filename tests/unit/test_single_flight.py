@@ -0,0 +1,127 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from app.data.etags import Versioned
+from app.data.single_flight import SingleFlight
+
+def make_backend(flight):
+    class Backend:
+        def __init__(self):
+            self.calls = 0
+            self.name = 'One'
+            self.release = threading.Event()
+
+        @flight
+        def read(self, id, fields=None):
+            self.calls += 1
+            name = self.name
+            self.release.wait(5)
+            if id == 'missing':
+                raise KeyError(id)
+            return Versioned({'id': id, 'name': name, 'fields': fields}, '"e1"')
+
+        @flight.writes
+        def write(self, name):
+            self.name = name
+    return Backend()
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        backend = make_backend(flight)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(backend.read, '1', fields=['name']) for _ in range(8)]
+            while flight.stats.as_dict()['calls'] < 8:
+                threading.Event().wait(0.01)
+            backend.release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(flight.stats.as_dict(), {'calls': 8, 'shared': 7})
+        self.assertTrue(all(result == results[0] for result in results))
+        # Every caller has its own copy to change
+        self.assertEqual(len({id(result.value) for result in results}), 8)
+
+        # Once the call has returned nothing is kept
+        backend.read('1', fields=['name'])
+        self.assertEqual(backend.calls, 2)
+
+    def test_errors_reach_every_caller(self):
+        flight = SingleFlight()
+        backend = make_backend(flight)
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(backend.read, 'missing') for _ in range(3)]
+            while flight.stats.as_dict()['calls'] < 3:
+                threading.Event().wait(0.01)
+            backend.release.set()
+            for future in futures:
+                with self.assertRaises(KeyError):
+                    future.result()
+        self.assertEqual(backend.calls, 1)
+
+    def test_read_after_a_write_does_not_join_an_earlier_read(self):
+        flight = SingleFlight()
+        backend = make_backend(flight)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            before = pool.submit(backend.read, '1')
+            while backend.calls < 1:
+                threading.Event().wait(0.01)
+            backend.write('Uno')
+            after = pool.submit(backend.read, '1')
+            while backend.calls < 2:
+                threading.Event().wait(0.01)
+            backend.release.set()
+            self.assertEqual(before.result().value['name'], 'One')
+            self.assertEqual(after.result().value['name'], 'Uno')
+        self.assertEqual(flight.stats.as_dict()['shared'], 0)
+
+    def test_async_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+
+        class AsyncBackend:
+            @flight
+            async def read(self, id):
+                calls.append(id)
+                await asyncio.sleep(0.01)
+                return {'id': id}
+
+        async def main():
+            backend = AsyncBackend()
+            results = await asyncio.gather(*(backend.read('1') for _ in range(5)), backend.read('2'))
+            return results
+
+        results = asyncio.run(main())
+        self.assertEqual(sorted(calls), ['1', '2'])
+        self.assertEqual(results, [{'id': '1'}] * 5 + [{'id': '2'}])
+
+    def test_cancelled_leader_hands_over(self):
+        flight = SingleFlight()
+        calls = []
+
+        class AsyncBackend:
+            @flight
+            async def read(self, id):
+                calls.append(id)
+                await asyncio.sleep(0.05)
+                return {'id': id}
+
+        async def main():
+            backend = AsyncBackend()
+            leader = asyncio.ensure_future(backend.read('1'))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(backend.read('1'))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(asyncio.run(main()), {'id': '1'})
+        self.assertEqual(calls, ['1', '1'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
-from app import create_app
+from app import create_app, warm_up
 
 application = create_app()
 
+if application.config.get('WARM_UP_ON_LOAD'):
+    warm_up(application)
+
 if __name__ == '__main__':
-    application.run()
\ No newline at end of file
+    application.run()